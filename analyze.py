@@ -1,32 +1,67 @@
 import os
 import re
 import pandas as pd
-import seaborn as sns
 import numpy as np
-from scipy.io import wavfile
-import matplotlib.pyplot as plt
 
-def analyze_folder(folder_path):
-    values = []
-    volumes = []
-    spectral_data = []
-    
-    # Iterate over all .wav files in the folder
+from fft_cache import get_default_cache
+from fft_kernel import (analyze_channels, analyze_clips, analyze_files, channel_coherence, read_channels, read_mono,
+                        split_coherent, to_mono)
+from frames import analyze_audio_clean, analyze_clip_clean
+from manifest import Manifest
+from metrics import timed, timer
+from session_archive import SessionArchive, find_sessions, is_archive, session_folder
+
+def format_speed(value):
+    """
+    Formats a fan speed for use in a recording filename: "50" for whole percentages, "12.5" otherwise.
+    """
+    value = float(value)
+    return str(int(value)) if value.is_integer() else f"{value:g}"
+
+def parse_speed(text):
+    """
+    Inverse of format_speed: returns an int for whole percentages and a float otherwise.
+    """
+    value = float(text)
+    return int(value) if value.is_integer() else value
+
+RECORDING_PATTERN = re.compile(r"audio_(\d+(?:\.\d+)?)\.wav")
+
+def recording_speed(file_path):
+    """
+    Returns the fan speed encoded in an "audio_<speed>.wav" filename, or None if there is none.
+    """
+    match = RECORDING_PATTERN.search(os.path.basename(file_path))
+    return parse_speed(match.group(1)) if match else None
+
+def list_recordings(folder_path):
+    """
+    Lists the fan speed recordings in a folder.
+
+    Parameters:
+    - folder_path (str): Path to a "Recordings_*" folder.
+
+    Returns:
+    - list of (value, file_path) tuples, in sorted filename order.
+    """
+    recordings = []
     for filename in sorted(os.listdir(folder_path)):
         if filename.endswith(".wav"):
             # Extract the value from the filename using regex
-            match = re.search(r"audio_(\d+).wav", filename)
+            match = RECORDING_PATTERN.search(filename)
             if match:
-                value = int(match.group(1))
-                values.append(value)
-                
-                # Perform analysis on the audio file
-                file_path = os.path.join(folder_path, filename)
-                print(f"Analyzing audio recording for fan speed {value}")
-                average_volume, freqs, fft_magnitude = analyze_audio(file_path)
-                
-                volumes.append(average_volume)
-                spectral_data.append(fft_magnitude)
+                recordings.append((parse_speed(match.group(1)), os.path.join(folder_path, filename)))
+    return recordings
+
+def save_folder_results(folder_path, values, volumes, freqs, spectral_data, store=None, kept_fractions=None):
+    """
+    Writes "analysis_results.csv" and "spectral_data.npz" for one recordings folder.
+    If a SpectraStore is given, the spectra are written into it instead of the .npz file.
+    If kept_fractions is given (see frames.py), it is saved as a "Kept Fraction" column.
+    Raises ValueError, before writing anything, if the spectra do not share one frequency grid.
+    """
+    if len({len(fft_magnitude) for fft_magnitude in spectral_data}) > 1:
+        raise ValueError(f"Recordings in {folder_path} differ in length, so their spectra do not share frequency bins")
 
     # Save data to a CSV file
     csv_file = os.path.join(folder_path, "analysis_results.csv")
@@ -34,19 +69,236 @@ def analyze_folder(folder_path):
         "Value": values,
         "Average Volume": volumes,
     })
+    if kept_fractions is not None:
+        df["Kept Fraction"] = kept_fractions
     df.to_csv(csv_file, index=False)
     print(f"Analysis results saved to {csv_file}")
 
+    if store is not None:
+        store.write_session(os.path.basename(os.path.normpath(folder_path)), values, volumes, freqs, spectral_data)
+        print(f"Spectral data saved to {store.path}")
+        return
+
     # Save spectral data separately in a .npz file
     npz_file = os.path.join(folder_path, "spectral_data.npz")
     np.savez(npz_file, values=values, freqs=freqs, spectral_data=spectral_data)
     print(f"Spectral data saved to {npz_file}")
 
+# Frame settings of clean analysis (see frames.analyze_clip_clean)
+CLEAN_SETTINGS = {"frame_seconds": 0.1, "threshold": 3.5, "spectrum": "gated"}
+
+def analysis_stage(clean=False):
+    """
+    Returns the manifest stage that analyze_folder records a folder under: "analyze" for plain
+    analysis, and one keyed by CLEAN_SETTINGS for clean analysis, so that outputs written with
+    other settings are never taken as current.
+    """
+    if not clean:
+        return "analyze"
+    return "analyze:clean:" + ",".join(f"{name}={value}" for name, value in sorted(CLEAN_SETTINGS.items()))
+
+def record_analysis(manifest, file_paths, stage):
+    """
+    Records a folder's inputs under its analysis stage and drops them from the other analysis
+    stages, whose outputs were just overwritten, then saves the manifest.
+    """
+    for file_path in file_paths:
+        manifest.record(file_path, stage, family="analyze")
+    manifest.save()
+
+def folder_is_current(folder_path, manifest, recordings=None, stage="analyze"):
+    """
+    Returns True if a folder's outputs exist and none of its recordings changed since the
+    manifest's analysis stage (see analysis_stage) last recorded them.
+    """
+    if recordings is None:
+        recordings = list_recordings(folder_path)
+    outputs = [os.path.join(folder_path, name) for name in ("analysis_results.csv", "spectral_data.npz")]
+    return (bool(recordings) and all(os.path.exists(output) for output in outputs)
+            and all(manifest.is_current(file_path, stage) for _, file_path in recordings))
+
+@timed("analyze_folder")
+def analyze_folder(folder_path, manifest=None, clean=False):
+    """
+    Analyzes every recording in a folder and saves the results next to them.
+    If a Manifest is given, folders whose recordings are unchanged since the last run are skipped.
+    With clean=True, interrupted frames are left out of each recording's volume and spectrum
+    (see frames.analyze_audio_clean).
+    A session archive (see session_archive.py) can be given instead of a folder.
+    """
+    if is_archive(folder_path):
+        return analyze_archive(folder_path, manifest=manifest, clean=clean)
+
+    recordings = list_recordings(folder_path)
+    stage = analysis_stage(clean)
+    if manifest is not None and folder_is_current(folder_path, manifest, recordings, stage):
+        print(f"Skipping {folder_path}: recordings unchanged since last analysis")
+        return False
+
+    values = []
+    volumes = []
+    spectral_data = []
+    freqs = None
+    kept_fractions = None
+    
+    print(f"Analyzing {len(recordings)} audio recordings in {folder_path}")
+    if clean:
+        # Frame-level analysis that drops interrupted frames
+        kept_fractions = []
+        results = []
+        for _, file_path in recordings:
+            clean_volume, freqs, fft_magnitude, kept_fraction = analyze_audio_clean(file_path, **CLEAN_SETTINGS)
+            results.append((clean_volume, freqs, fft_magnitude))
+            kept_fractions.append(kept_fraction)
+    else:
+        # Analyze all .wav files in the folder with one batched FFT
+        results = analyze_recordings([file_path for _, file_path in recordings])
+    for (value, _), (average_volume, freqs, fft_magnitude) in zip(recordings, results):
+        values.append(value)
+        volumes.append(average_volume)
+        spectral_data.append(fft_magnitude)
+
+    save_folder_results(folder_path, values, volumes, freqs, spectral_data, kept_fractions=kept_fractions)
+
+    if manifest is not None:
+        record_analysis(manifest, [file_path for _, file_path in recordings], stage)
+    return True
+
     # plotVolumes(values, volumes) # Create the Value vs Volume plot
     # plotSpectra(values, freqs, spectral_data) # Create the spectral distribution heatmap
+
+def archive_values(archive):
+    """
+    Returns the fan speeds of a SessionArchive in the order list_recordings gives for the folder
+    it was packed from (sorted by "audio_<speed>.wav" filename), so results rows line up.
+    """
+    return sorted(archive.speeds, key=lambda value: f"audio_{format_speed(value)}.wav")
+
+@timed("analyze_archive")
+def analyze_archive(archive_path, manifest=None, clean=False):
+    """
+    Analyzes every recording in a session archive and saves the results in its session folder
+    (see session_archive.session_folder), which is created if needed. The results are the same
+    as analyze_folder's for the folder the archive was packed from.
+    """
+    folder_path = session_folder(archive_path)
+    stage = analysis_stage(clean)
+    if manifest is not None and folder_is_current(folder_path, manifest, [(None, archive_path)], stage):
+        print(f"Skipping {archive_path}: archive unchanged since last analysis")
+        return False
+    os.makedirs(folder_path, exist_ok=True)
+
+    kept_fractions = None
+    with SessionArchive(archive_path) as archive:
+        values = archive_values(archive)
+        if not values:
+            print(f"Skipping {archive_path}: no recordings found.")
+            return False
+        print(f"Analyzing {len(values)} audio recordings in {archive_path}")
+        clips = [archive.read(value) for value in values]
+        if clean:
+            kept_fractions = []
+            results = []
+            for sample_rate, data in clips:
+                clean_volume, freqs, fft_magnitude, kept_fraction = analyze_clip_clean(to_mono(data), sample_rate, **CLEAN_SETTINGS)
+                results.append((clean_volume, freqs, fft_magnitude))
+                kept_fractions.append(kept_fraction)
+        else:
+            results = analyze_clips(clips)
+        del clips
+
+    volumes = [average_volume for average_volume, _, _ in results]
+    spectral_data = [fft_magnitude for _, _, fft_magnitude in results]
+    save_folder_results(folder_path, values, volumes, results[-1][1], spectral_data, kept_fractions=kept_fractions)
+
+    if manifest is not None:
+        record_analysis(manifest, [archive_path], stage)
+    return True
     
 
+@timed("analyze_channels")
+def analyze_folder_channels(folder_path, reference=0, coherence=True, nperseg=4096):
+    """
+    Per-microphone analysis of a multi-channel session, next to analyze_folder's mixed-down
+    results.
+
+    Every recording is analyzed per channel with one batched FFT (see fft_kernel.analyze_channels).
+    With coherence=True, each channel's coherence with the reference channel is estimated too,
+    and its "Coherent Fraction" (share of its spectral power that is coherent with the reference)
+    is saved; low fractions point to a source the reference does not hear, such as the motherboard
+    fan.
+
+    Writes "channel_results.csv" (one row per recording and channel) and "channel_spectra.npz"
+    (values, freqs, float32 spectra of shape (recordings, channels, bins) and, with coherence,
+    coherence_freqs and coherence) into the session folder. A session archive can be given
+    instead of a folder.
+
+    Parameters:
+    - folder_path (str): Path to a "Recordings_*" folder or session archive.
+    - reference (int): Index of the reference channel. Default is 0.
+    - coherence (bool): Whether to estimate coherence. Default is True.
+    - nperseg (int): Welch segment length of the coherence estimate. Default is 4096.
+
+    Returns:
+    - True if results were written, False if the session holds no recordings.
+    """
+    if is_archive(folder_path):
+        archive = SessionArchive(folder_path)
+        values = archive_values(archive)
+        clips = ((value, archive.read(value)) for value in values)
+        output_folder = session_folder(folder_path)
+        os.makedirs(output_folder, exist_ok=True)
+    else:
+        archive = None
+        recordings = list_recordings(folder_path)
+        values = [value for value, _ in recordings]
+        clips = ((value, read_channels(file_path)) for value, file_path in recordings)
+        output_folder = folder_path
+    if not values:
+        print(f"Skipping {folder_path}: no recordings found.")
+        return False
+
+    print(f"Analyzing {len(values)} multi-channel recordings in {folder_path}")
+    rows = []
+    spectral_data = []
+    coherence_data = []
+    freqs = coherence_freqs = None
+    try:
+        for value, (sample_rate, data) in clips:
+            volumes, freqs, magnitudes = analyze_channels(sample_rate, data)
+            spectral_data.append(magnitudes)
+            fractions = None
+            if coherence:
+                with timer("coherence"):
+                    coherence_freqs, channel_coh = channel_coherence(sample_rate, data, reference, nperseg)
+                coherence_data.append(channel_coh.astype(np.float32))
+                # Share of each channel's spectral power that is coherent with the reference
+                coherent, _ = split_coherent(freqs, magnitudes, coherence_freqs, channel_coh)
+                fractions = (coherent ** 2).sum(axis=1) / np.maximum((magnitudes ** 2).sum(axis=1), 1e-30)
+            for channel, volume in enumerate(volumes):
+                row = {"Value": value, "Channel": channel, "Average Volume": volume}
+                if fractions is not None:
+                    row["Coherent Fraction"] = fractions[channel]
+                rows.append(row)
+            del data
+    finally:
+        if archive is not None:
+            archive.close()
+
+    csv_file = os.path.join(output_folder, "channel_results.csv")
+    pd.DataFrame(rows).to_csv(csv_file, index=False)
+    print(f"Channel results saved to {csv_file}")
+    npz_file = os.path.join(output_folder, "channel_spectra.npz")
+    arrays = {"values": values, "freqs": freqs, "spectral_data": np.array(spectral_data)}
+    if coherence:
+        arrays.update(coherence_freqs=coherence_freqs, coherence=np.array(coherence_data))
+    np.savez(npz_file, **arrays)
+    print(f"Channel spectra saved to {npz_file}")
+    return True
+
 def plotVolumes(values, volumes):
+    import matplotlib.pyplot as plt
+
     plt.figure(figsize=(10, 5))
     plt.plot(values, volumes, marker='o')
     plt.xlabel("Value")
@@ -55,22 +307,69 @@ def plotVolumes(values, volumes):
     plt.grid()
     plt.show()
 
-def plotSpectra(values, freqs, spectal_data):
-    spectral_data = np.array(spectral_data)
-    plt.figure(figsize=(12, 8))
-    sns.heatmap(spectral_data.T, xticklabels=values, yticklabels=freqs, cmap="viridis", cbar_kws={'label': 'Magnitude'})
-    plt.xlabel("Value")
-    plt.ylabel("Frequency (Hz)")
-    plt.title("Spectral Distribution Heatmap")
-    plt.show()
+def plotSpectra(values, freqs, spectal_data, output_image=None):
+    from render import render_heatmap
 
-def analyze_audio(file_path):
-    # Read the .wav file
-    sample_rate, data = wavfile.read(file_path)
-    
-    # If the audio has two channels (stereo), convert it to mono by averaging the channels
-    if len(data.shape) == 2:
-        data = data.mean(axis=1)
+    # Pooled to the figure's resolution (see render.py) instead of one heatmap cell per bin
+    spectral_data = np.array(spectal_data)
+    render_heatmap(spectral_data.T, values, freqs, output_image, xlabel="Value", ylabel="Frequency (Hz)",
+                   title="Spectral Distribution Heatmap", cbar_label="Magnitude")
+
+@timed("analyze_audio")
+def analyze_audio(file_path, use_cache=True):
+    """
+    Computes the average volume and FFT magnitude spectrum of a .wav file.
+
+    Results are looked up in the shared on-disk spectrum cache (see fft_cache.py) so that a
+    recording is only decoded and transformed once, no matter how many scripts analyze it.
+
+    Parameters:
+    - file_path (str): Path to the .wav file.
+    - use_cache (bool): Whether to go through the spectrum cache. Default is True.
+
+    Returns:
+    - average_volume, freqs, fft_magnitude
+    """
+    if use_cache:
+        return get_default_cache().get_or_compute(file_path, _analyze_audio_uncached, params={"analysis": "analyze_audio"})
+    return _analyze_audio_uncached(file_path)
+
+@timed("analyze_recordings")
+def analyze_recordings(file_paths, use_cache=True, length_mode="exact"):
+    """
+    Batched analyze_audio over many files.
+
+    Files missing from the spectrum cache are decoded and run through one batched, multithreaded
+    FFT (see fft_kernel.py). In the default "exact" length mode the results share cache entries
+    with analyze_audio and agree with it to within fft_kernel.RELATIVE_TOLERANCE.
+
+    Parameters:
+    - file_paths (list): Paths to the .wav files.
+    - use_cache (bool): Whether to go through the spectrum cache. Default is True.
+    - length_mode (str): "exact", "pad" or "trim" transform length (see fft_kernel.fft_length).
+
+    Returns:
+    - list of (average_volume, freqs, fft_magnitude) in the order of file_paths; magnitudes are
+      float64 like those of analyze_audio, although computed in float32.
+    """
+    params = {"analysis": "analyze_audio"}
+    if length_mode != "exact":
+        params["fft_length"] = length_mode
+
+    cache = get_default_cache() if use_cache else None
+    results = [cache.get(file_path, params) if cache is not None else None for file_path in file_paths]
+    missing = [i for i, result in enumerate(results) if result is None]
+    if missing:
+        computed = analyze_files([file_paths[i] for i in missing], length_mode=length_mode)
+        for i, (average_volume, freqs, fft_magnitude) in zip(missing, computed):
+            # Same dtype as analyze_audio, whichever of the two fills the shared cache entry
+            result = (average_volume, freqs, fft_magnitude.astype(np.float64))
+            results[i] = cache.put(file_paths[i], result, params) if cache is not None else result
+    return results
+
+def _analyze_audio_uncached(file_path):
+    # Read the .wav file (mono, as in fft_kernel.read_mono, which also counts files and bytes)
+    sample_rate, data = read_mono(file_path)
     
     # Calculate the average volume (magnitude)
     average_volume = np.mean(np.abs(data))
@@ -78,7 +377,8 @@ def analyze_audio(file_path):
     # Perform Fourier Transform to get the spectral distribution
     n = len(data)
     freqs = np.fft.rfftfreq(n, d=1/sample_rate)
-    fft_magnitude = np.abs(np.fft.rfft(data)) / n
+    with timer("fft"):
+        fft_magnitude = np.abs(np.fft.rfft(data)) / n
 
     return average_volume, freqs, fft_magnitude
 
@@ -89,10 +389,14 @@ def analyze_audio(file_path):
 if __name__ == "__main__":
     # folder_path = "data\\Recordings_20241029_195328"  # Update with your folder path
     data_path = "data3"
-    folders = [os.path.join(data_path, folder) for folder in os.listdir(data_path) if os.path.isdir(os.path.join(data_path, folder))]
+    manifest = Manifest(os.path.join(data_path, "manifest.json"))
+    # Recordings_* folders and session archives
+    folders = find_sessions(data_path)
     for folder in folders:
-        analyze_folder(folder)
-        print(f"Finished analysis of {folder}")
+        if analyze_folder(folder, manifest=manifest):
+            print(f"Finished analysis of {folder}")
 
-    zero, _, _ = analyze_audio("dataSilence//Recordings_20241209_092922//audio_1.wav")
-    print(f"Zero reference: {zero}")
+    # Zero reference from the calibration sessions, built once and reused (see noise_reference.py)
+    from noise_reference import load_reference_library
+    library = load_reference_library("dataSilence")
+    print(f"Zero reference: {np.median(library.volumes)} (median of {len(library.names)} calibration sessions)")
@@ -0,0 +1,170 @@
+import os
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import metrics
+from analyze import (analyze_audio, analysis_stage, archive_values, folder_is_current, list_recordings, record_analysis,
+                     save_folder_results)
+from fft_kernel import analyze_clips
+from manifest import Manifest
+from session_archive import ARCHIVE_SUFFIX, SessionArchive, is_archive, session_folder
+from spectra_store import SpectraStore
+
+def _analyze_unit(unit):
+    """
+    Worker entry point: analyzes a single (folder, value, file) work unit, or a whole session
+    archive for a (folder, None, archive) unit.
+    Returns the unit's folder, a list of (value, average_volume, freqs, fft_magnitude) results,
+    the elapsed time and the worker's metrics for the unit (see metrics.Metrics.take).
+    """
+    folder_path, value, file_path = unit
+    start = time.perf_counter()
+    if value is None:
+        # One unit per archive: its clips are mapped from one file and transformed in one batch
+        with SessionArchive(file_path) as archive:
+            values = archive.speeds
+            results = analyze_clips([archive.read(speed) for speed in values])
+        results = [(speed,) + result for speed, result in zip(values, results)]
+    else:
+        results = [(value,) + analyze_audio(file_path)]
+    elapsed = time.perf_counter() - start
+    return folder_path, results, elapsed, metrics.metrics.take()
+
+def find_session_folders(data_path):
+    """
+    Returns the sorted list of recording session folders inside data_path. A session packed
+    into an archive (see session_archive.py) is returned as the archive instead of its folder.
+    """
+    sessions = {}
+    for name in sorted(os.listdir(data_path)):
+        path = os.path.join(data_path, name)
+        if os.path.isdir(path):
+            sessions.setdefault(name, path)
+        elif name.endswith(ARCHIVE_SUFFIX):
+            sessions[os.path.basename(session_folder(path))] = path
+    return [sessions[name] for name in sorted(sessions)]
+
+@metrics.timed("analyze_corpus")
+def analyze_corpus(data_path, workers=None, store_path=None, max_freq=3500, manifest_path=None):
+    """
+    Analyzes every recording session under data_path using a pool of worker processes.
+
+    Each (folder, file) pair is a separate work unit, so a single large folder is spread over
+    all workers. A folder's "analysis_results.csv" and "spectral_data.npz" are written as soon
+    as all of its files are done, with rows in the same sorted order as analyze.analyze_folder.
+    A folder with an unreadable recording, or whose clips do not share one frequency grid (or
+    the store's), is reported and skipped; the other folders are still analyzed.
+
+    Parameters:
+    - data_path (str): Path to the root directory containing "Recordings_*" folders.
+    - workers (int): Number of worker processes. Default is os.cpu_count().
+    - store_path (str): If given, spectra are written into a SpectraStore at this path instead
+      of per-folder "spectral_data.npz" files.
+    - max_freq (float): Highest frequency kept in the store. Default is 3500 Hz.
+    - manifest_path (str): If given, folders whose recordings are unchanged since the last run
+      (according to this Manifest) are skipped. A store is always rebuilt in full.
+
+    Returns:
+    - dict mapping each analyzed folder to its total per-file analysis time in seconds.
+    """
+    # Build the work units up front so that ordering is fixed before any work starts
+    manifest = Manifest(manifest_path) if manifest_path is not None else None
+    units = []
+    pending = {}
+    file_paths = {}
+    for folder in find_session_folders(data_path):
+        if is_archive(folder):
+            archive_path, folder = folder, session_folder(folder)
+            if manifest is not None and store_path is None and folder_is_current(folder, manifest, [(None, archive_path)]):
+                print(f"Skipping {archive_path}: archive unchanged since last analysis")
+                continue
+            with SessionArchive(archive_path) as archive:
+                values = archive_values(archive)
+            if not values:
+                print(f"Skipping {archive_path}: no recordings found.")
+                continue
+            os.makedirs(folder, exist_ok=True)
+            pending[folder] = {value: None for value in values}
+            file_paths[folder] = [archive_path]
+            units.append((folder, None, archive_path))
+            continue
+        recordings = list_recordings(folder)
+        if not recordings:
+            print(f"Skipping {folder}: no recordings found.")
+            continue
+        if manifest is not None and store_path is None and folder_is_current(folder, manifest, recordings):
+            print(f"Skipping {folder}: recordings unchanged since last analysis")
+            continue
+        pending[folder] = {value: None for value, _ in recordings}
+        file_paths[folder] = [file_path for _, file_path in recordings]
+        units.extend((folder, value, file_path) for value, file_path in recordings)
+
+    total = sum(len(results) for results in pending.values())
+    print(f"Analyzing {total} recordings in {len(pending)} folders with {workers or os.cpu_count()} workers")
+
+    # The store needs the frequency bins, so it is created when the first result arrives
+    store = None
+    store_sessions = [os.path.basename(folder) for folder in pending]
+    store_speeds = sorted({value for results in pending.values() for value in results})
+
+    folder_times = {}
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, initializer=metrics.init_worker,
+                             initargs=(metrics.metrics.enabled,)) as executor:
+        futures = {executor.submit(_analyze_unit, unit): unit for unit in units}
+        done = 0
+        for future in as_completed(futures):
+            folder = futures[future][0]
+            try:
+                folder, unit_results, elapsed, unit_metrics = future.result()
+            except Exception as e:
+                if folder in pending:
+                    print(f"Skipping {folder}: {futures[future][2]} could not be analyzed ({e})")
+                    del pending[folder]
+                continue
+            metrics.metrics.merge(unit_metrics)
+            if folder not in pending:
+                # An earlier unit of this folder failed
+                continue
+            results = pending[folder]
+            for value, average_volume, freqs, fft_magnitude in unit_results:
+                if store_path is not None and store is None:
+                    store = SpectraStore.create(store_path, store_sessions, store_speeds, freqs[freqs <= max_freq])
+                results[value] = (average_volume, freqs, fft_magnitude)
+            folder_times[folder] = folder_times.get(folder, 0.0) + elapsed
+            done += len(unit_results)
+            label = f"fan speed {unit_results[0][0]}" if len(unit_results) == 1 else f"{len(unit_results)} recordings"
+            print(f"[{done}/{total}] {folder} {label}: {elapsed:.3f} s")
+
+            # Write the folder out once all of its files are in, then release its spectra
+            if all(result is not None for result in results.values()):
+                values = list(results)
+                volumes = [results[v][0] for v in values]
+                spectral_data = [results[v][2] for v in values]
+                try:
+                    save_folder_results(folder, values, volumes, results[values[-1]][1], spectral_data, store=store)
+                except ValueError as e:
+                    print(f"Skipping {folder}: {e}")
+                    del pending[folder]
+                    continue
+                if manifest is not None:
+                    record_analysis(manifest, file_paths[folder], analysis_stage())
+                del pending[folder]
+                print(f"Finished analysis of {folder}")
+
+    elapsed = time.perf_counter() - start
+    if total:
+        print(f"Analyzed {total} recordings in {elapsed:.1f} s ({total / elapsed:.1f} files/s)")
+    return folder_times
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Analyze all recording sessions in parallel.")
+    parser.add_argument("data_path", nargs="?", default="data3", help="Root directory of Recordings_* folders")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="Number of worker processes (default: all cores)")
+    parser.add_argument("--store", default=None, help="Write spectra into a SpectraStore at this path")
+    parser.add_argument("--full", action="store_true", help="Re-analyze every folder, even if unchanged")
+    args = parser.parse_args()
+    manifest_path = None if args.full else os.path.join(args.data_path, "manifest.json")
+    analyze_corpus(args.data_path, workers=args.workers, store_path=args.store, manifest_path=manifest_path)
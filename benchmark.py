@@ -0,0 +1,245 @@
+import io
+import os
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import contextlib
+import subprocess
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+from scipy.io.wavfile import write
+
+import fft_cache
+from analyze import analyze_audio, analyze_folder, list_recordings
+from batch_analyze import analyze_corpus
+from binning import bin_spectra, linear_edges
+from spectra_aggregation import generate_spectra_csv
+from spectra_store import read_spectra
+from volume_aggregation import aggregate_volumes
+
+def synthesize_recording(speed, duration=5.0, sample_rate=44100, rng=None, hz_per_percent=4.0,
+                         harmonics=4, interruption_rate=0.2):
+    """
+    Synthesizes a fan-like int16 recording for a given fan speed.
+
+    The signal has a blade-pass tone at hz_per_percent * speed Hz plus decaying harmonics, both
+    growing louder with speed, on top of broadband noise. With probability interruption_rate the
+    clip also contains one loud burst standing in for an environmental interruption.
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+    n = int(duration * sample_rate)
+    t = np.arange(n) / sample_rate
+
+    signal = rng.normal(0, 30 + 0.5 * speed, n)
+    blade_pass = hz_per_percent * speed
+    for order in range(1, harmonics + 1):
+        amplitude = (5 + 2 * speed) / order
+        signal += amplitude * np.sin(2 * np.pi * order * blade_pass * t + rng.uniform(0, 2 * np.pi))
+
+    if rng.random() < interruption_rate:
+        length = int(rng.uniform(0.1, 1.0) * sample_rate)
+        start = rng.integers(0, max(n - length, 1))
+        signal[start:start + length] += rng.normal(0, 2000, min(length, n - start))
+
+    return np.clip(signal, -32768, 32767).astype(np.int16)
+
+def generate_corpus(root, sessions=5, speeds=range(0, 101, 5), duration=5.0, sample_rate=44100, seed=0):
+    """
+    Writes a synthetic corpus of "Recordings_*/audio_<speed>.wav" folders under root/data, and a
+    zero noise reference under root/dataSilence. Returns (data_dir, reference_wav).
+    """
+    rng = np.random.default_rng(seed)
+    data_dir = os.path.join(root, "data")
+    for session in range(sessions):
+        folder = os.path.join(data_dir, f"Recordings_20240101_{session:06d}")
+        os.makedirs(folder, exist_ok=True)
+        for speed in speeds:
+            write(os.path.join(folder, f"audio_{speed}.wav"), sample_rate,
+                  synthesize_recording(speed, duration, sample_rate, rng))
+
+    reference_dir = os.path.join(root, "dataSilence", "Recordings_20240101_000000")
+    os.makedirs(reference_dir, exist_ok=True)
+    reference_wav = os.path.join(reference_dir, "audio_1.wav")
+    write(reference_wav, sample_rate, np.clip(rng.normal(0, 30, int(duration * sample_rate)), -32768, 32767).astype(np.int16))
+    return data_dir, reference_wav
+
+def _fresh_cache(root):
+    # Every stage starts from a cold, private spectrum cache
+    cache_dir = tempfile.mkdtemp(dir=root, prefix="cache_")
+    os.environ["FFT_CACHE_DIR"] = cache_dir
+    fft_cache.set_default_cache(fft_cache.SpectrumCache(cache_dir))
+
+def time_stage(function, *args, setup=None, memory=True, **kwargs):
+    """
+    Runs function with its output suppressed and returns (result, seconds, peak traced MB).
+
+    The timed run has tracemalloc off, since tracing every allocation slows numpy-heavy code
+    down by a varying factor. The peak memory comes from a second, traced run (skipped when
+    memory is False, in which case the peak is None). setup, if given, is called before each run
+    so that both start from the same state (for example a cold cache).
+    """
+    if setup is not None:
+        setup()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = function(*args, **kwargs)
+    elapsed = time.perf_counter() - start
+
+    peak_mb = None
+    if memory:
+        if setup is not None:
+            setup()
+        tracemalloc.start()
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                function(*args, **kwargs)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        peak_mb = peak / 1e6
+    return result, elapsed, peak_mb
+
+def run_benchmarks(root, sessions=5, speeds=range(0, 101, 5), duration=5.0, workers=None, memory=True):
+    """
+    Times each pipeline stage on a synthetic corpus and returns a dict of results.
+
+    Parameters:
+    - root (str): Scratch directory for the corpus and outputs.
+    - sessions (int): Number of synthetic sessions.
+    - speeds (iterable): Fan speeds recorded per session.
+    - duration (float): Length of each recording in seconds.
+    - workers (list): Worker counts for the batch_analyze scaling run. Default is powers of two
+      up to os.cpu_count().
+    - memory (bool): Also measure each stage's peak memory in a separate traced run. Default is True.
+    """
+    speeds = list(speeds)
+    data_dir, reference_wav = generate_corpus(root, sessions, speeds, duration)
+    files = [path for folder in sorted(os.listdir(data_dir)) for _, path in list_recordings(os.path.join(data_dir, folder))]
+    n_files = len(files)
+    audio_seconds = n_files * duration
+    stages = {}
+
+    def record(name, elapsed, peak_mb, n=n_files, seconds=audio_seconds):
+        stages[name] = {
+            "seconds": elapsed,
+            "files_per_s": n / elapsed if elapsed else None,
+            "audio_s_per_s": seconds / elapsed if elapsed else None,
+            "peak_mb": peak_mb,
+        }
+        peak = f"{peak_mb:8.1f} MB peak" if peak_mb is not None else ""
+        print(f"{name:<24} {elapsed:8.3f} s  {n / elapsed:8.1f} files/s  {seconds / elapsed:9.1f} audio-s/s  {peak}")
+
+    _, elapsed, peak = time_stage(lambda: [analyze_audio(path, use_cache=False) for path in files], memory=memory)
+    record("analyze_audio", elapsed, peak)
+
+    folders = [os.path.join(data_dir, folder) for folder in sorted(os.listdir(data_dir))]
+    _, elapsed, peak = time_stage(lambda: [analyze_folder(folder) for folder in folders],
+                                  setup=lambda: _fresh_cache(root), memory=memory)
+    record("analyze_folder", elapsed, peak)
+
+    volumes_csv = os.path.join(root, "all_volumes.csv")
+    _, elapsed, peak = time_stage(aggregate_volumes, data_dir, volumes_csv, memory=memory)
+    record("aggregate_volumes", elapsed, peak, n=sessions, seconds=0)
+
+    spectra_csv = os.path.join(root, "all_spectra.csv")
+    _, elapsed, peak = time_stage(generate_spectra_csv, volumes_csv, data_dir, spectra_csv,
+                                  setup=lambda: _fresh_cache(root), memory=memory)
+    record("generate_spectra_csv", elapsed, peak, n=min(3, sessions) * len(speeds), seconds=min(3, sessions) * len(speeds) * duration)
+
+    spectra_df = read_spectra(spectra_csv)
+    freqs = spectra_df.index.to_numpy()
+    _, elapsed, peak = time_stage(bin_spectra, freqs, spectra_df.to_numpy(), linear_edges(freqs.max()), memory=memory)
+    record("plot_binning", elapsed, peak, n=len(speeds), seconds=0)
+
+    import matplotlib
+    matplotlib.use("Agg")
+    from specgramTest import plot_spectra_with_db
+    _, elapsed, peak = time_stage(plot_spectra_with_db, spectra_csv, os.path.join(root, "spectra_plot_db.png"),
+                                  reference_wav=reference_wav, memory=memory)
+    record("plot_spectra_with_db", elapsed, peak, n=len(speeds), seconds=0)
+
+    # Scaling of the process-pool driver with core count
+    if workers is None:
+        cpu_count = os.cpu_count() or 1
+        workers = sorted({2 ** i for i in range(cpu_count.bit_length()) if 2 ** i <= cpu_count} | {cpu_count})
+    scaling = {}
+    for n_workers in workers:
+        _fresh_cache(root)
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            analyze_corpus(data_dir, workers=n_workers)
+        elapsed = time.perf_counter() - start
+        scaling[str(n_workers)] = {"seconds": elapsed, "files_per_s": n_files / elapsed}
+        print(f"analyze_corpus x{n_workers:<14} {elapsed:8.3f} s  {n_files / elapsed:8.1f} files/s")
+
+    return {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "commit": _git_commit(),
+        "machine": {"platform": platform.platform(), "python": platform.python_version(),
+                    "numpy": np.__version__, "cpu_count": os.cpu_count()},
+        "params": {"sessions": sessions, "speeds": len(speeds), "duration": duration, "files": n_files},
+        "stages": stages,
+        "scaling": scaling,
+    }
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare_with_previous(results, results_file):
+    """
+    Prints the change of each stage against the last stored run with the same parameters.
+    """
+    previous = None
+    if os.path.exists(results_file):
+        with open(results_file) as f:
+            for line in f:
+                run = json.loads(line)
+                if run["params"] == results["params"]:
+                    previous = run
+    if previous is None:
+        print("No previous run with the same parameters to compare against.")
+        return
+
+    print(f"Compared with {previous['commit']} ({previous['timestamp']}):")
+    for name, stage in results["stages"].items():
+        if name in previous["stages"]:
+            change = stage["seconds"] / previous["stages"][name]["seconds"] - 1
+            flag = "  <-- slower" if change > 0.1 else ""
+            print(f"  {name:<24} {change:+7.1%}{flag}")
+
+def save_results(results, results_file):
+    with open(results_file, "a") as f:
+        f.write(json.dumps(results) + "\n")
+    print(f"Benchmark results appended to {results_file}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the analysis pipeline on a synthetic corpus.")
+    parser.add_argument("--sessions", type=int, default=5)
+    parser.add_argument("--speed-step", type=int, default=5)
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--workers", type=int, nargs="*", default=None)
+    parser.add_argument("--results", default="benchmark_results.jsonl")
+    parser.add_argument("--keep", action="store_true", help="Keep the synthetic corpus")
+    parser.add_argument("--no-memory", action="store_true", help="Skip the traced runs that measure peak memory")
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix="fanspeed_bench_")
+    try:
+        results = run_benchmarks(root, args.sessions, range(0, 101, args.speed_step), args.duration, args.workers,
+                                 memory=not args.no_memory)
+    finally:
+        if not args.keep:
+            shutil.rmtree(root, ignore_errors=True)
+    compare_with_previous(results, args.results)
+    save_results(results, args.results)
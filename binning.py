@@ -0,0 +1,79 @@
+import numpy as np
+
+def linear_edges(fmax, width=1.0, fmin=0.0):
+    """
+    Returns evenly spaced bin edges from fmin to (at least) fmax.
+    With the defaults this gives the integer-Hz bins [0, 1), [1, 2), ...
+    """
+    n_bins = int(np.floor((fmax - fmin) / width)) + 1
+    return fmin + width * np.arange(n_bins + 1)
+
+def log_edges(fmin, fmax, n_bins):
+    """
+    Returns n_bins logarithmically spaced bins between fmin and fmax.
+    """
+    return np.geomspace(fmin, fmax, n_bins + 1)
+
+def octave_edges(fmin=20.0, fmax=20000.0, fraction=1, reference=1000.0):
+    """
+    Returns the edges of 1/fraction-octave bands (fraction=1 for octaves, 3 for third-octaves),
+    with band centers at reference * 2**(k / fraction) as in IEC 61260.
+    """
+    k_min = int(np.floor(fraction * np.log2(fmin / reference)))
+    k_max = int(np.ceil(fraction * np.log2(fmax / reference)))
+    centers = reference * 2.0 ** (np.arange(k_min, k_max + 1) / fraction)
+    half_band = 2.0 ** (1 / (2 * fraction))
+    return np.append(centers / half_band, centers[-1] * half_band)
+
+def bin_spectra(freqs, spectra, edges, reducer="mean"):
+    """
+    Bins spectra into frequency bands in one vectorized pass.
+
+    Parameters:
+    - freqs (array): Ascending frequency of each spectrum sample.
+    - spectra (array): A single spectrum of shape (n_freqs,), or a matrix of shape
+      (n_freqs, n_spectra) with one spectrum per column (e.g. one per fan speed).
+    - edges (array): Ascending bin edges; bin i covers [edges[i], edges[i + 1]).
+    - reducer (str): How samples within a bin are combined: "mean", "max", "rms" or "sum".
+
+    Returns:
+    - binned (array): Shape (n_bins,) or (n_bins, n_spectra). Empty bins are NaN.
+    - counts (array): Number of samples that fell into each bin.
+    """
+    freqs = np.asarray(freqs)
+    spectra = np.asarray(spectra, dtype=np.float64)
+    edges = np.asarray(edges)
+    n_bins = len(edges) - 1
+
+    # Find each sample's bin and drop the ones outside the edges
+    bin_index = np.searchsorted(edges, freqs, side="right") - 1
+    valid = (bin_index >= 0) & (bin_index < n_bins)
+    bin_index = bin_index[valid]
+    values = spectra[valid]
+
+    counts = np.bincount(bin_index, minlength=n_bins)
+    out_shape = (n_bins,) + spectra.shape[1:]
+    if len(values) == 0:
+        return np.full(out_shape, np.nan), counts
+
+    # Frequencies are sorted, so each non-empty bin is a contiguous run that reduceat can collapse
+    filled = np.flatnonzero(counts)
+    starts = np.searchsorted(bin_index, filled)
+    if reducer in ("mean", "sum"):
+        reduced = np.add.reduceat(values, starts, axis=0)
+    elif reducer == "max":
+        reduced = np.maximum.reduceat(values, starts, axis=0)
+    elif reducer == "rms":
+        reduced = np.add.reduceat(values ** 2, starts, axis=0)
+    else:
+        raise ValueError(f"Unknown reducer: {reducer}")
+
+    filled_counts = counts[filled].reshape((-1,) + (1,) * (values.ndim - 1))
+    if reducer == "mean":
+        reduced = reduced / filled_counts
+    elif reducer == "rms":
+        reduced = np.sqrt(reduced / filled_counts)
+
+    binned = np.full(out_shape, np.nan)
+    binned[filled] = reduced
+    return binned, counts
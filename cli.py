@@ -0,0 +1,263 @@
+import os
+import sys
+import argparse
+
+# Every subcommand imports what it needs when it runs, so "--help" and the light jobs never
+# pay for matplotlib, seaborn or sounddevice.
+
+def run_record(args):
+    from sweep import sweep_plan
+
+    plans = sweep_plan(args.order, args.start, args.stop, args.step, repeats=args.sessions)
+    if args.mode == "pipelined":
+        import asyncio
+        from live import LiveRecorder, SoundDeviceSource
+        from sweep import FileFanController, LiveCapture, run_sweeps
+
+        with LiveRecorder(SoundDeviceSource(sample_rate=44100, channels=args.channels)) as recorder:
+            asyncio.run(run_sweeps(plans, FileFanController(), LiveCapture(recorder), args.data_dir,
+                                   settle_time=args.settle, duration=args.duration, archive=args.archive))
+        return
+
+    from main import recording_script
+    if args.mode == "live":
+        from live import LiveRecorder, SoundDeviceSource
+        with LiveRecorder(SoundDeviceSource(sample_rate=44100, channels=args.channels)) as recorder:
+            for values in plans:
+                recording_script(recorder=recorder, data_dir=args.data_dir, archive=args.archive, values=values,
+                                 settle_time=args.settle, duration=args.duration)
+    else:
+        for values in plans:
+            recording_script(data_dir=args.data_dir, archive=args.archive, channels=args.channels, values=values,
+                             settle_time=args.settle, duration=args.duration)
+
+def run_analyze(args):
+    from manifest import Manifest
+
+    manifest_path = None if args.full else os.path.join(args.data_path, "manifest.json")
+    if args.workers == 1 and args.store is None:
+        from analyze import analyze_folder
+        from session_archive import find_sessions
+
+        manifest = Manifest(manifest_path) if manifest_path else None
+        for session in find_sessions(args.data_path):
+            analyze_folder(session, manifest=manifest, clean=args.clean)
+    else:
+        if args.clean:
+            raise SystemExit("--clean is only supported with -j 1")
+        from batch_analyze import analyze_corpus
+        analyze_corpus(args.data_path, workers=args.workers, store_path=args.store, manifest_path=manifest_path)
+
+    if args.channels:
+        from analyze import analyze_folder_channels
+        from session_archive import find_sessions
+
+        for session in find_sessions(args.data_path):
+            analyze_folder_channels(session, reference=args.reference_channel)
+
+def run_pack(args):
+    from session_archive import convert_corpus
+
+    convert_corpus(args.data_dir, compress=args.compress, remove=args.remove)
+
+def run_shard(args):
+    import sharded
+
+    queue_path = args.queue or os.path.join(args.data_dir, "queue")
+    if args.action == "enqueue":
+        sharded.enqueue_corpus(sharded.open_queue(queue_path), args.data_dir, args.unit)
+    elif args.action == "work":
+        sharded.run_worker(queue_path, lease_seconds=args.lease)
+    elif args.action == "reduce":
+        sharded.reduce_partials(sharded.open_queue(queue_path).partials_dir, os.path.join(args.data_dir, "all_volumes.csv"),
+                                os.path.join(args.data_dir, "all_spectra.csv"))
+    elif args.action == "status":
+        queue = sharded.open_queue(queue_path)
+        print(queue.counts())
+        for name, error in queue.errors():
+            print(f"{name}: {error}")
+    else:
+        sharded.run_local(args.data_dir, queue_path, args.workers, args.unit, args.lease)
+
+def run_aggregate_volumes(args):
+    from manifest import Manifest
+    from volume_aggregation import aggregate_volumes
+
+    output = args.output or os.path.join(args.data_dir, "all_volumes.csv")
+    manifest = None if args.full else Manifest(os.path.join(args.data_dir, "manifest.json"))
+    aggregate_volumes(args.data_dir, output, manifest=manifest)
+
+def run_aggregate_spectra(args):
+    from manifest import Manifest
+    from spectra_aggregation import generate_spectra_csv
+
+    volumes = args.volumes or os.path.join(args.data_dir, "all_volumes.csv")
+    output = args.output or os.path.join(args.data_dir, "all_spectra.csv")
+    manifest = None if args.full else Manifest(os.path.join(args.data_dir, "manifest.json"))
+    generate_spectra_csv(volumes, args.data_dir, output, manifest=manifest)
+
+def run_harmonics(args):
+    from harmonics import generate_harmonics_csv
+
+    output = args.output or os.path.join(os.path.dirname(args.spectra) or ".", "harmonics.csv")
+    generate_harmonics_csv(args.spectra, output, args.points, prominence_db=args.prominence)
+
+def run_model(args):
+    from noise_model import benchmark_lookup, build_noise_model
+
+    spectra = os.path.join(args.data_dir, "all_spectra.csv")
+    model = build_noise_model(os.path.join(args.data_dir, "all_volumes.csv"), spectra if os.path.exists(spectra) else None,
+                              statistic=args.statistic, curve=args.curve)
+    model.save(args.output or os.path.join(args.data_dir, "noise_model.npz"))
+    print(f"Lookup time: {benchmark_lookup(model):.2f} us")
+
+def run_control(args):
+    from noise_model import NoiseModel, WmiTemperatureSource, control_loop
+    from sweep import FANCONTROL_SENSOR_FILE, FileFanController
+
+    model = NoiseModel.load(args.model)
+    control_loop(model, WmiTemperatureSource(args.sensors), args.budget,
+                 controller=FileFanController(args.sensor_file or FANCONTROL_SENSOR_FILE), interval=args.interval)
+
+def run_plot(args):
+    import matplotlib
+    matplotlib.use("Agg")
+
+    if args.kind == "spectra":
+        from specgramTest import ZERO_NOISE_REFERENCE, plot_spectra_with_db
+
+        spectra = args.input or os.path.join(args.data_dir, "all_spectra.csv")
+        output = args.output or os.path.join(args.data_dir, "avgSpectra_plot_db.png")
+        plot_spectra_with_db(spectra, output, reference_wav=args.reference or ZERO_NOISE_REFERENCE,
+                             reference_library=args.silence_dir)
+    elif args.kind == "volumes":
+        from dataViz import plot_volume_curves
+
+        plot_volume_curves(args.data_dir, args.output or os.path.join(args.data_dir, "volumes_plot.png"))
+    elif args.kind == "histogram":
+        from dataViz import plot_volume_histogram
+
+        plot_volume_histogram(args.data_dir, args.output or os.path.join(args.data_dir, "volumes_histogram.png"))
+    elif args.kind == "report":
+        from render import generate_report
+
+        generate_report(args.data_dir, args.output or "Assets", reference_wav=args.reference, silence_dir=args.silence_dir)
+    elif args.kind == "background":
+        from noise_reference import plot_background_removed
+
+        output = args.output or os.path.join(args.data_dir, "avgSpectraBkgdRemoved_plot_db.png")
+        plot_background_removed(args.data_dir, output, args.silence_dir or "dataSilence", mode=args.mode)
+    elif args.kind == "spectrogram":
+        from stft import render_spectrogram, session_spectrogram
+
+        if args.input is None:
+            raise SystemExit("plot spectrogram needs --input <Recordings_* folder>")
+        from session_archive import is_archive, session_folder
+
+        times, freqs, magnitudes, boundaries = session_spectrogram(args.input)
+        folder = session_folder(args.input) if is_archive(args.input) else args.input
+        output = args.output or os.path.join(folder, "spectrogram.png")
+        render_spectrogram(times, freqs, magnitudes, output, boundaries=boundaries, fmax=5000)
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="fanspeed", description="Fan noise recording and analysis pipeline.")
+    parser.add_argument("--metrics", default=None, help="Append stage timings and counters to this JSON lines file")
+    parser.add_argument("--prometheus", default=None, help="Write the metrics to this Prometheus text file")
+    parser.add_argument("--profile", default=None, help="Run under cProfile and save the stats to this file")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    record = commands.add_parser("record", help="Record fan speed sweeps")
+    record.add_argument("--data-dir", default="dataSilence", help="Directory the session folders are created in")
+    record.add_argument("--mode", choices=["simple", "live", "pipelined"], default="simple")
+    record.add_argument("--sessions", type=int, default=1, help="Number of sweeps to record")
+    record.add_argument("--order", default="ascending", help="Sweep order (see sweep.sweep_plan)")
+    record.add_argument("--start", type=float, default=0)
+    record.add_argument("--stop", type=float, default=100)
+    record.add_argument("--step", type=float, default=1)
+    record.add_argument("--settle", type=float, default=3.0, help="Settle time in seconds")
+    record.add_argument("--duration", type=float, default=5.0, help="Recording length in seconds")
+    record.add_argument("--archive", action="store_true", help="Write each session into one .session archive")
+    record.add_argument("--channels", type=int, default=1, help="Number of microphones recorded per clip")
+    record.set_defaults(handler=run_record)
+
+    analyze = commands.add_parser("analyze", help="Analyze every Recordings_* folder or session archive")
+    analyze.add_argument("data_path", nargs="?", default="data3")
+    analyze.add_argument("-j", "--workers", type=int, default=None, help="Worker processes (default: all cores)")
+    analyze.add_argument("--store", default=None, help="Write spectra into a SpectraStore at this path")
+    analyze.add_argument("--full", action="store_true", help="Re-analyze every folder, even if unchanged")
+    analyze.add_argument("--clean", action="store_true", help="Leave out interrupted frames (with -j 1)")
+    analyze.add_argument("--channels", action="store_true", help="Also analyze every microphone separately")
+    analyze.add_argument("--reference-channel", type=int, default=0, help="Channel the others are compared with")
+    analyze.set_defaults(handler=run_analyze)
+
+    pack = commands.add_parser("pack", help="Pack Recordings_* folders into session archives")
+    pack.add_argument("data_dir", nargs="?", default="data3")
+    pack.add_argument("--compress", action="store_true", help="Losslessly compress the samples")
+    pack.add_argument("--remove", action="store_true", help="Delete the .wav files once packed")
+    pack.set_defaults(handler=run_pack)
+
+    shard = commands.add_parser("shard", help="Sharded analysis over a shared lease queue (see sharded.py)")
+    shard.add_argument("action", choices=["enqueue", "work", "reduce", "status", "local"])
+    shard.add_argument("data_dir", nargs="?", default="data3")
+    shard.add_argument("--queue", default=None, help="Queue directory, or a .db file (default: <data_dir>/queue)")
+    shard.add_argument("--unit", choices=["session", "speed"], default="session")
+    shard.add_argument("-j", "--workers", type=int, default=None, help="Worker processes for 'local'")
+    shard.add_argument("--lease", type=float, default=300.0, help="Lease length in seconds")
+    shard.set_defaults(handler=run_shard)
+
+    volumes = commands.add_parser("aggregate-volumes", help="Build all_volumes.csv")
+    volumes.add_argument("data_dir", nargs="?", default="data3")
+    volumes.add_argument("-o", "--output", default=None, help="Default: <data_dir>/all_volumes.csv")
+    volumes.add_argument("--full", action="store_true", help="Ignore the manifest and rebuild everything")
+    volumes.set_defaults(handler=run_aggregate_volumes)
+
+    spectra = commands.add_parser("aggregate-spectra", help="Build all_spectra.csv")
+    spectra.add_argument("data_dir", nargs="?", default="data3")
+    spectra.add_argument("--volumes", default=None, help="Default: <data_dir>/all_volumes.csv")
+    spectra.add_argument("-o", "--output", default=None, help="Default: <data_dir>/all_spectra.csv")
+    spectra.add_argument("--full", action="store_true", help="Ignore the manifest and rebuild everything")
+    spectra.set_defaults(handler=run_aggregate_spectra)
+
+    harmonics = commands.add_parser("harmonics", help="Track the blade-pass harmonics in all_spectra.csv")
+    harmonics.add_argument("spectra", nargs="?", default=os.path.join("data3", "all_spectra.csv"))
+    harmonics.add_argument("-o", "--output", default=None, help="Default: harmonics.csv next to the spectra")
+    harmonics.add_argument("--points", default=None, help="Also save every ridge's peaks to this CSV")
+    harmonics.add_argument("--prominence", type=float, default=10.0)
+    harmonics.set_defaults(handler=run_harmonics)
+
+    model = commands.add_parser("model", help="Build the speed -> noise model (see noise_model.py)")
+    model.add_argument("data_dir", nargs="?", default="data3")
+    model.add_argument("-o", "--output", default=None, help="Default: <data_dir>/noise_model.npz")
+    model.add_argument("--statistic", choices=["min", "median"], default="min")
+    model.add_argument("--curve", choices=["envelope", "isotonic"], default="envelope")
+    model.set_defaults(handler=run_model)
+
+    control = commands.add_parser("control", help="Run the fan controller within a noise budget")
+    control.add_argument("budget", type=float, help="Noise budget in dB")
+    control.add_argument("--model", default=os.path.join("data3", "noise_model.npz"))
+    control.add_argument("--sensors", nargs="*", default=None, help="Temperature sensors to watch (default: all)")
+    control.add_argument("--sensor-file", default=None, help="FanControl sensor file to write")
+    control.add_argument("--interval", type=float, default=2.0, help="Seconds between readings")
+    control.set_defaults(handler=run_control)
+
+    plot = commands.add_parser("plot", help="Render a figure to a file")
+    plot.add_argument("kind", choices=["spectra", "volumes", "histogram", "spectrogram", "background", "report"])
+    plot.add_argument("--data-dir", default="data3")
+    plot.add_argument("--input", default=None, help="Spectra file, or the session folder or archive for a spectrogram")
+    plot.add_argument("-o", "--output", default=None, help="Output image (output directory for a report)")
+    plot.add_argument("--reference", default=None, help="Zero noise recording for the spectra plot")
+    plot.add_argument("--silence-dir", default=None, help="Calibration sessions to use as the background reference")
+    plot.add_argument("--mode", choices=["ratio", "subtract"], default="ratio", help="Background removal for 'background'")
+    plot.set_defaults(handler=run_plot)
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.metrics or args.prometheus or args.profile:
+        import metrics
+        metrics.enable(jsonl=args.metrics, prometheus=args.prometheus, profile=args.profile)
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,224 @@
+import os
+import json
+import hashlib
+import tempfile
+from collections import OrderedDict
+
+import numpy as np
+
+import metrics
+
+# Bump this whenever the cached analysis output changes so stale entries are never reused
+CACHE_VERSION = 2
+
+DEFAULT_CACHE_DIR = os.environ.get("FFT_CACHE_DIR", ".fft_cache")
+DEFAULT_MAX_BYTES = int(os.environ.get("FFT_CACHE_MAX_BYTES", 2 * 1024**3))
+
+# The directory is only rescanned every RESCAN_PUTS puts (to pick up other processes' entries)
+# or once the tracked size passes max_bytes, and eviction then frees down to EVICT_TARGET of
+# max_bytes so that a full cache is not rescanned on every put
+RESCAN_PUTS = 256
+EVICT_TARGET = 0.9
+
+def file_digest(file_path, chunk_size=1 << 20):
+    """
+    Returns the SHA-1 hex digest of a file's contents, read in chunks.
+    """
+    digest = hashlib.sha1()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class SpectrumCache:
+    """
+    Persistent cache of per-file analysis results (e.g. volume, frequency bins and FFT magnitudes).
+
+    Entries are keyed by the file's content hash, its modification time and the analysis
+    parameters, and stored as .npz files in cache_dir. A small in-memory LRU sits in front of
+    the disk cache, and the least recently used files are evicted once the cache grows past
+    max_bytes. The cache's size is tracked in memory between directory scans.
+
+    Parameters:
+    - cache_dir (str): Directory holding the cached .npz entries.
+    - max_bytes (int): Size limit of the on-disk cache.
+    - memory_items (int): Number of entries kept in memory.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES, memory_items=32):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.memory_items = memory_items
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._digests = {}  # (path, size, mtime) -> content hash, so unchanged files are hashed once
+        self._total_bytes = None  # Size of the on-disk entries as of the last scan plus later puts
+        self._puts_since_scan = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, file_path, params=None):
+        stat = os.stat(file_path)
+        stat_key = (os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)
+        digest = self._digests.get(stat_key)
+        if digest is None:
+            digest = self._digests[stat_key] = file_digest(file_path)
+        payload = json.dumps({
+            "digest": digest,
+            "mtime": stat.st_mtime_ns,
+            "params": params or {},
+            "version": CACHE_VERSION,
+        }, sort_keys=True)
+        return hashlib.sha1(payload.encode()).hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, key + ".npz")
+
+    def _remember(self, key, result):
+        self._memory[key] = result
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def get(self, file_path, params=None):
+        """
+        Returns the cached result for file_path and params, or None on a miss.
+        """
+        key = self.key(file_path, params)
+
+        if key in self._memory:
+            self.hits += 1
+            metrics.increment("cache.hits")
+            self._memory.move_to_end(key)
+            return self._memory[key]
+
+        entry_path = self._entry_path(key)
+        if os.path.exists(entry_path):
+            try:
+                with np.load(entry_path) as entry:
+                    result = tuple(_freeze(entry[f"arr_{i}"]) for i in range(len(entry.files)))
+                os.utime(entry_path)  # Mark as recently used for eviction
+                self.hits += 1
+                metrics.increment("cache.hits")
+                self._remember(key, result)
+                return result
+            except (OSError, ValueError, KeyError):
+                # Corrupt or partially written entry, treat it as a miss
+                pass
+
+        self.misses += 1
+        metrics.increment("cache.misses")
+        return None
+
+    def put(self, file_path, result, params=None):
+        """
+        Stores a result (a tuple of arrays and/or scalars) for file_path and params and returns
+        it with its arrays made read-only.
+        """
+        key = self.key(file_path, params)
+        result = tuple(_freeze(np.asarray(item)) for item in result)
+        added = self._write_entry(self._entry_path(key), result)
+        self._remember(key, result)
+        self._puts_since_scan += 1
+        if self._total_bytes is None or self._puts_since_scan >= RESCAN_PUTS:
+            self.evict()
+        else:
+            self._total_bytes += added
+            if self._total_bytes > self.max_bytes:
+                self.evict()
+        return result
+
+    def get_or_compute(self, file_path, compute, params=None):
+        """
+        Returns the cached result of compute(file_path), computing and storing it on a miss.
+
+        compute must return a tuple of arrays and/or scalars. Returned arrays are read-only,
+        since they are shared between callers.
+        """
+        result = self.get(file_path, params)
+        if result is None:
+            result = self.put(file_path, compute(file_path), params)
+        return result
+
+    def _write_entry(self, entry_path, result):
+        # Write to a temporary file first so concurrent readers never see a partial entry.
+        # Returns how many bytes the cache grew by.
+        try:
+            replaced = os.path.getsize(entry_path)
+        except OSError:
+            replaced = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, *result)
+            written = os.path.getsize(tmp_path)
+            os.replace(tmp_path, entry_path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return 0
+        return written - replaced
+
+    def evict(self):
+        """
+        Rescans the cache directory and, if it is over max_bytes, removes the least recently used
+        entries until it is under EVICT_TARGET of max_bytes.
+        """
+        entries = []
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".npz"):
+                path = os.path.join(self.cache_dir, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+
+        if total > self.max_bytes:
+            for _, size, path in sorted(entries):
+                if total <= EVICT_TARGET * self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    pass
+        self._total_bytes = total
+        self._puts_since_scan = 0
+
+    def clear(self):
+        """
+        Removes every cached entry, in memory and on disk.
+        """
+        self._memory.clear()
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".npz"):
+                os.remove(os.path.join(self.cache_dir, name))
+        self._total_bytes = 0
+        self._puts_since_scan = 0
+
+def _freeze(array):
+    if array.ndim == 0:
+        return array[()]
+    array.flags.writeable = False
+    return array
+
+_default_cache = None
+
+def get_default_cache():
+    """
+    Returns the process-wide SpectrumCache, creating it on first use.
+    """
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = SpectrumCache()
+    return _default_cache
+
+def set_default_cache(cache):
+    """
+    Replaces the process-wide SpectrumCache, e.g. to point it at a scratch directory.
+    """
+    global _default_cache
+    _default_cache = cache
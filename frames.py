@@ -0,0 +1,141 @@
+import numpy as np
+
+from fft_cache import get_default_cache
+from fft_kernel import cached_window, read_mono
+
+def frame_view(data, frame_length, hop=None):
+    """
+    Returns a (frames, frame_length) view of a 1-D signal without copying it.
+    Samples after the last full frame are left out.
+    """
+    hop = hop or frame_length
+    if len(data) < frame_length:
+        return np.empty((0, frame_length), dtype=data.dtype)
+    if hop == frame_length:
+        return data[:len(data) // frame_length * frame_length].reshape(-1, frame_length)
+    return np.lib.stride_tricks.sliding_window_view(data, frame_length)[::hop]
+
+def frame_levels(data, frame_length, hop=None, chunk_samples=1 << 16):
+    """
+    Computes the abs-mean and RMS level of every frame of a clip.
+
+    The frames are strided views of the clip in its own dtype, converted to float a block of
+    about chunk_samples samples at a time, so no full-length float copy of the clip is made.
+
+    Returns:
+    - abs_mean, rms: arrays with one value per frame.
+    """
+    frames = frame_view(np.asarray(data), frame_length, hop)
+    abs_mean = np.empty(len(frames))
+    rms = np.empty(len(frames))
+    step = max(1, chunk_samples // frame_length)
+    for start in range(0, len(frames), step):
+        block = frames[start:start + step].astype(np.float64)
+        rms[start:start + step] = np.sqrt(np.einsum("ij,ij->i", block, block) / frame_length)
+        np.abs(block, out=block)
+        abs_mean[start:start + step] = block.mean(axis=1)
+    return abs_mean, rms
+
+def interruption_mask(levels, threshold=3.5, min_db=3.0, pad_frames=1):
+    """
+    Flags frames that are much louder than the rest of the clip, e.g. someone talking or a door.
+
+    Levels are compared in dB against the clip's median using the median absolute deviation
+    (a robust z-score of 0.6745 * (level - median) / MAD), so a few loud frames do not shift
+    the threshold. Only the loud side is rejected, frames must also be at least min_db above the
+    median (so the small fluctuations of a very steady clip are kept), and flagged runs are
+    widened by pad_frames on both sides to catch the edges of a burst.
+
+    Parameters:
+    - levels (array): Per-frame levels, e.g. the RMS from frame_levels.
+    - threshold (float): Robust z-score above which a frame is rejected. Default is 3.5.
+    - min_db (float): Minimum level above the median for a frame to be rejected. Default is 3 dB.
+    - pad_frames (int): Frames rejected on each side of a flagged frame. Default is 1.
+
+    Returns:
+    - keep (array): Boolean mask, True for the frames to keep.
+    """
+    level_db = 20 * np.log10(np.asarray(levels, dtype=np.float64) + 1e-12)
+    median = np.median(level_db)
+    mad = np.median(np.abs(level_db - median))
+    flagged = level_db - median >= min_db
+    if mad > 0:
+        flagged &= 0.6745 * (level_db - median) / mad > threshold
+    if pad_frames and flagged.any():
+        # Dilate the flags with a running maximum over 2 * pad_frames + 1 frames
+        padded = np.concatenate([np.zeros(pad_frames, bool), flagged, np.zeros(pad_frames, bool)])
+        flagged = frame_view(padded, 2 * pad_frames + 1, 1).any(axis=1)
+    return ~flagged
+
+def clean_spectrum(data, sample_rate, frame_length, keep, mode="gated", window="hann"):
+    """
+    Averaged magnitude spectrum of the kept frames of a clip.
+
+    - "gated": the rejected frames are zeroed and the whole clip is transformed, rescaled by the
+      kept fraction. The bins match analyze.analyze_audio, so the result can stand in for it.
+    - "welch": windowed rfft of each kept frame, averaged (coarser bins, less leakage from the gaps).
+
+    Returns:
+    - freqs, fft_magnitude
+    """
+    frames = frame_view(data, frame_length)
+    if mode == "gated":
+        n = len(data)
+        samples = np.asarray(data, dtype=np.float64).copy()
+        gated = frame_view(samples, frame_length)
+        gated[~keep] = 0
+        samples[len(keep) * frame_length:] = 0
+        kept = max(int(keep.sum()) * frame_length, 1)
+        freqs = np.fft.rfftfreq(n, d=1/sample_rate)
+        return freqs, np.abs(np.fft.rfft(samples)) / kept
+    if mode == "welch":
+        weights = cached_window(window, frame_length)
+        kept_frames = frames[keep].astype(np.float32) * weights
+        freqs = np.fft.rfftfreq(frame_length, d=1/sample_rate)
+        if len(kept_frames) == 0:
+            return freqs, np.zeros(len(freqs))
+        magnitudes = np.abs(np.fft.rfft(kept_frames, axis=1)) / weights.sum()
+        return freqs, magnitudes.mean(axis=0)
+    raise ValueError(f"Unknown spectrum mode: {mode}")
+
+def analyze_clip_clean(data, sample_rate, frame_seconds=0.1, threshold=3.5, spectrum="gated"):
+    """
+    Frame-level counterpart of analyze.analyze_audio that leaves out interrupted frames.
+
+    The clip is cut into frame_seconds frames, loud outlier frames are rejected with
+    interruption_mask on their RMS level, and the volume and spectrum are computed from the
+    remaining frames only.
+
+    Returns:
+    - clean_volume, freqs, fft_magnitude, kept_fraction
+    """
+    frame_length = max(1, int(round(frame_seconds * sample_rate)))
+    abs_mean, rms = frame_levels(data, frame_length)
+    if len(rms) == 0:
+        # Clip shorter than one frame: nothing to reject
+        freqs = np.fft.rfftfreq(len(data), d=1/sample_rate)
+        return np.mean(np.abs(data)), freqs, np.abs(np.fft.rfft(data)) / max(len(data), 1), 1.0
+
+    keep = interruption_mask(rms, threshold)
+    clean_volume = abs_mean[keep].mean() if keep.any() else np.nan
+    freqs, fft_magnitude = clean_spectrum(data, sample_rate, frame_length, keep, spectrum)
+    return clean_volume, freqs, fft_magnitude, keep.mean()
+
+def _analyze_file_clean(file_path, frame_seconds, threshold, spectrum):
+    sample_rate, data = read_mono(file_path)
+    return analyze_clip_clean(data, sample_rate, frame_seconds, threshold, spectrum)
+
+def analyze_audio_clean(file_path, frame_seconds=0.1, threshold=3.5, spectrum="gated", use_cache=True):
+    """
+    Computes the interruption-free volume and spectrum of a .wav file (see analyze_clip_clean),
+    through the shared spectrum cache.
+
+    Returns:
+    - clean_volume, freqs, fft_magnitude, kept_fraction
+    """
+    params = {"analysis": "analyze_audio_clean", "frame_seconds": frame_seconds,
+              "threshold": threshold, "spectrum": spectrum}
+    compute = lambda path: _analyze_file_clean(path, frame_seconds, threshold, spectrum)
+    if use_cache:
+        return get_default_cache().get_or_compute(file_path, compute, params=params)
+    return compute(file_path)
@@ -0,0 +1,273 @@
+import os
+import time
+import argparse
+
+import numpy as np
+import pandas as pd
+from scipy.ndimage import maximum_filter1d, uniform_filter1d
+
+from analyze import parse_speed
+from spectra_store import read_spectra
+
+def to_matrix(spectra_df):
+    """
+    Returns (speeds, freqs, spectra) from an all_spectra table, with the speed columns in
+    ascending numeric order (CSV columns come back as strings, e.g. "0", "10", "100", "20").
+    """
+    speeds = np.array([parse_speed(str(col)) for col in spectra_df.columns], dtype=float)
+    order = np.argsort(speeds, kind="stable")
+    freqs = spectra_df.index.to_numpy(dtype=float)
+    return speeds[order], freqs, spectra_df.to_numpy(dtype=float)[:, order]
+
+def find_peaks(freqs, spectra, prominence_db=10.0, separation_hz=5.0, background_hz=50.0,
+               min_freq=20.0, max_peaks=20):
+    """
+    Finds the spectral peaks of every spectrum in a matrix in one vectorized pass.
+
+    A bin is a peak if it is the largest within +-separation_hz and stands at least
+    prominence_db above the running mean level over background_hz around it.
+
+    Parameters:
+    - freqs (array): Ascending frequency of each row.
+    - spectra (array): Magnitudes of shape (n_freqs, n_spectra), one spectrum per column.
+    - prominence_db (float): Minimum height above the local background. Default is 10 dB.
+    - separation_hz (float): Minimum distance between two peaks. Default is 5 Hz.
+    - background_hz (float): Width of the background estimate. Default is 50 Hz.
+    - min_freq (float): Peaks below this frequency are ignored. Default is 20 Hz.
+    - max_peaks (int): Only the most prominent peaks of each spectrum are kept. Default is 20.
+
+    Returns:
+    - columns, rows, prominence, level: one entry per peak, sorted by column and then by
+      descending prominence. level is in dB.
+    """
+    resolution = freqs[1] - freqs[0]
+    level = 20 * np.log10(np.asarray(spectra, dtype=float) + 1e-12)
+
+    # Running maximum and mean along the frequency axis, for every column at once
+    separation = max(3, int(round(2 * separation_hz / resolution)) | 1)
+    width = max(separation, int(round(background_hz / resolution)) | 1)
+    local_max = maximum_filter1d(level, separation, axis=0, mode="nearest")
+    background = uniform_filter1d(level, width, axis=0, mode="nearest")
+    prominence = level - background
+
+    mask = (level == local_max) & (prominence >= prominence_db)
+    mask[freqs < min_freq] = False
+    rows, columns = np.nonzero(mask)
+
+    # Keep the max_peaks most prominent peaks per column
+    heights = prominence[rows, columns]
+    order = np.lexsort((-heights, columns))
+    rows, columns, heights = rows[order], columns[order], heights[order]
+    starts = np.searchsorted(columns, columns, side="left")
+    keep = np.arange(len(columns)) - starts < max_peaks
+    rows, columns, heights = rows[keep], columns[keep], heights[keep]
+    return columns, rows, heights, level[rows, columns]
+
+def link_ridges(speeds, columns, peak_freqs, tolerance_hz=3.0, tolerance_fraction=0.03, max_gap=3):
+    """
+    Links peaks of neighbouring fan speeds into ridges (the diagonal streaks of the spectra plot).
+
+    Speeds are visited in ascending order. Each open ridge predicts where it continues: a ridge
+    with one point either stays put or scales with the speed (the blade-pass frequency is
+    proportional to the fan's rotation rate), longer ridges are extrapolated from their last two
+    points. Peaks are then matched to the closest prediction within
+    tolerance_hz + tolerance_fraction * frequency; the remaining peaks start new ridges.
+
+    Parameters:
+    - speeds (array): Ascending fan speed of each column.
+    - columns (array): Column index of each peak, as returned by find_peaks.
+    - peak_freqs (array): Frequency of each peak.
+    - tolerance_hz, tolerance_fraction (float): Matching tolerance. Defaults are 3 Hz and 3%.
+    - max_gap (int): Number of consecutive speeds a ridge may miss before it is closed.
+
+    Returns:
+    - list of ridges, each an array of peak indices in ascending speed order.
+    """
+    ridges = []  # [peak indices, last column]
+    column_starts = np.searchsorted(columns, np.arange(len(speeds) + 1))
+
+    for column in range(len(speeds)):
+        peaks = np.arange(column_starts[column], column_starts[column + 1])
+        open_ridges = [ridge for ridge in ridges if column - ridge[1] <= max_gap + 1]
+        matched = np.zeros(len(peaks), dtype=bool)
+
+        if len(peaks) and open_ridges:
+            # Distance of every peak to every open ridge's prediction
+            distance = np.empty((len(open_ridges), len(peaks)))
+            candidates = peak_freqs[peaks]
+            for i, (indices, _) in enumerate(open_ridges):
+                last = indices[-1]
+                last_speed, last_freq = speeds[columns[last]], peak_freqs[last]
+                if len(indices) == 1:
+                    predictions = [last_freq]
+                    if last_speed > 0:
+                        predictions.append(last_freq * speeds[column] / last_speed)
+                    distance[i] = np.min([np.abs(candidates - p) for p in predictions], axis=0)
+                else:
+                    previous = indices[-2]
+                    slope = (last_freq - peak_freqs[previous]) / (last_speed - speeds[columns[previous]])
+                    distance[i] = np.abs(candidates - (last_freq + slope * (speeds[column] - last_speed)))
+            allowed = tolerance_hz + tolerance_fraction * candidates
+
+            # Greedy assignment, closest pairs first
+            taken = np.zeros(len(open_ridges), dtype=bool)
+            for flat in np.argsort(distance, axis=None):
+                i, j = divmod(flat, len(peaks))
+                if distance[i, j] > allowed[j]:
+                    break
+                if taken[i] or matched[j]:
+                    continue
+                open_ridges[i][0].append(peaks[j])
+                open_ridges[i][1] = column
+                taken[i] = matched[j] = True
+
+        for peak in peaks[~matched]:
+            ridges.append([[peak], column])
+
+    return [np.array(indices) for indices, _ in ridges]
+
+def _explained(slopes, fundamentals, max_order, tolerance):
+    # Harmonic order of every slope for every candidate fundamental, and whether it fits
+    ratio = slopes[None, :] / np.asarray(fundamentals, dtype=float)[:, None]
+    orders = np.round(ratio)
+    explained = (np.abs(ratio - orders) <= tolerance * orders) & (orders >= 1) & (orders <= max_order)
+    return orders, explained
+
+def fundamental_slope(slopes, weights=None, max_order=12, tolerance=0.05, iterations=3):
+    """
+    Estimates the Hz-per-percent slope of the fundamental from the slopes of several ridges.
+
+    Every slope / k (k = 1..max_order) is a candidate; the candidates that explain the most
+    (weighted) slopes as integer multiples within tolerance are kept. Each of them is then
+    refined by weighted least squares over the slopes it explains (slope / order against the
+    fundamental), so one stray ridge cannot drag the estimate to its own slope / k. The
+    largest refined fundamental wins, so subharmonics are not picked.
+
+    Parameters:
+    - slopes (array): Ridge slopes in Hz/%.
+    - weights (array): Weight of every slope, e.g. the ridge's prominence. Default is equal.
+    - max_order (int): Highest harmonic order considered. Default is 12.
+    - tolerance (float): Allowed relative deviation from an integer multiple. Default is 5%.
+    - iterations (int): Refinement passes. Default is 3.
+    """
+    slopes = np.asarray(slopes, dtype=float)
+    if len(slopes) == 0:
+        return np.nan
+    weights = np.ones(len(slopes)) if weights is None else np.asarray(weights, dtype=float)
+    candidates = (slopes[:, None] / np.arange(1, max_order + 1)).ravel()
+
+    _, explained = _explained(slopes, candidates, max_order, tolerance)
+    scores = explained @ weights
+    best = candidates[np.flatnonzero(scores >= scores.max() - 1e-9)]
+
+    for _ in range(iterations):
+        orders, explained = _explained(slopes, best, max_order, tolerance)
+        fit_weights = explained * weights
+        best = (fit_weights * slopes / np.maximum(orders, 1)).sum(axis=1) / fit_weights.sum(axis=1)
+    return best.max()
+
+def track_harmonics(spectra_df, prominence_db=10.0, min_points=5, min_slope=0.05, max_order=12,
+                    min_ridge_prominence_db=15.0, min_r2=0.95, **kwargs):
+    """
+    Extracts the blade-pass harmonics from an all_spectra table.
+
+    Peaks are picked in every speed's spectrum, linked across speeds into ridges and each ridge
+    is fitted with a line freq = slope * speed + intercept. Ridges whose slope is below
+    min_slope Hz/% are tones that do not follow the fan speed (e.g. another fan) and get order 0;
+    the others are numbered as multiples of the fundamental slope, which is fitted with the
+    ridges' prominence as weights (see fundamental_slope). Faint ridges (mean prominence below
+    min_ridge_prominence_db) and moving ridges that are not straight (R2 below min_r2) are
+    usually chains of noise peaks and are dropped before any order is assigned.
+
+    Parameters:
+    - spectra_df (DataFrame): Average spectra with frequency rows and fan speed columns.
+    - prominence_db (float): Peak prominence threshold (see find_peaks). Default is 10 dB.
+    - min_points (int): Ridges with fewer peaks are dropped. Default is 5.
+    - min_slope (float): Slope below which a ridge counts as stationary. Default is 0.05 Hz/%.
+    - max_order (int): Highest harmonic order considered. Default is 12.
+    - min_ridge_prominence_db (float): Ridges with a lower mean prominence are dropped. Default is 15 dB.
+    - min_r2 (float): Moving ridges whose line fit has a lower R2 are dropped. Default is 0.95.
+    - **kwargs: Passed on to find_peaks and link_ridges.
+
+    Returns:
+    - harmonics (DataFrame): One row per ridge, by order and then slope.
+    - points (DataFrame): The peaks of every ridge (Ridge, Fan Speed, Frequency (Hz), Level (dB)).
+    """
+    peak_options = {k: kwargs.pop(k) for k in ("separation_hz", "background_hz", "min_freq", "max_peaks") if k in kwargs}
+    speeds, freqs, spectra = to_matrix(spectra_df)
+    columns, rows, prominence, level = find_peaks(freqs, spectra, prominence_db, **peak_options)
+    peak_freqs = freqs[rows]
+    ridges = [ridge for ridge in link_ridges(speeds, columns, peak_freqs, **kwargs) if len(ridge) >= min_points]
+
+    records = []
+    points = []
+    for ridge in ridges:
+        x, y = speeds[columns[ridge]], peak_freqs[ridge]
+        slope, intercept = np.polyfit(x, y, 1)
+        residual = y - (slope * x + intercept)
+        total = np.sum((y - y.mean()) ** 2)
+        records.append({
+            "Slope (Hz/%)": slope,
+            "Intercept (Hz)": intercept,
+            "R2": 1 - np.sum(residual ** 2) / total if total > 0 else 1.0,
+            "Speed Min": x.min(),
+            "Speed Max": x.max(),
+            "Points": len(ridge),
+            "Prominence (dB)": prominence[ridge].mean(),
+            "Peak Level (dB)": level[ridge].max(),
+        })
+        points.append((x, y, level[ridge]))
+
+    harmonics = pd.DataFrame(records, columns=["Slope (Hz/%)", "Intercept (Hz)", "R2", "Speed Min", "Speed Max",
+                                               "Points", "Prominence (dB)", "Peak Level (dB)"])
+
+    # Drop noise ridges before they can take part in the fundamental fit or get an order
+    moving = (harmonics["Slope (Hz/%)"] >= min_slope).to_numpy()
+    keep = (harmonics["Prominence (dB)"] >= min_ridge_prominence_db).to_numpy() & (~moving | (harmonics["R2"] >= min_r2).to_numpy())
+    harmonics = harmonics[keep].reset_index(drop=True)
+    points = [point for point, kept in zip(points, keep) if kept]
+    moving = moving[keep]
+
+    fundamental = fundamental_slope(harmonics.loc[moving, "Slope (Hz/%)"], harmonics.loc[moving, "Prominence (dB)"],
+                                    max_order)
+    order = np.zeros(len(harmonics), dtype=int)
+    if moving.any():
+        order[moving] = np.clip(np.round(harmonics.loc[moving, "Slope (Hz/%)"] / fundamental), 1, None)
+    harmonics.insert(0, "Order", order)
+    harmonics.insert(0, "Ridge", np.arange(len(harmonics)))
+    harmonics["Order Error"] = np.where(moving, harmonics["Slope (Hz/%)"] / fundamental - order, np.nan)
+
+    points_df = pd.DataFrame({
+        "Ridge": np.repeat(np.arange(len(points)), [len(x) for x, _, _ in points]),
+        "Fan Speed": np.concatenate([x for x, _, _ in points]) if points else [],
+        "Frequency (Hz)": np.concatenate([y for _, y, _ in points]) if points else [],
+        "Level (dB)": np.concatenate([l for _, _, l in points]) if points else [],
+    })
+    harmonics = harmonics.sort_values(["Order", "Slope (Hz/%)"]).reset_index(drop=True)
+    return harmonics, points_df
+
+def generate_harmonics_csv(spectra_path, output_csv, points_csv=None, **kwargs):
+    """
+    Runs track_harmonics on "all_spectra.csv" (or a SpectraStore) and saves the harmonics table.
+    """
+    start = time.perf_counter()
+    harmonics, points = track_harmonics(read_spectra(spectra_path), **kwargs)
+    harmonics.to_csv(output_csv, index=False)
+    if points_csv is not None:
+        points.to_csv(points_csv, index=False)
+    moving = harmonics[harmonics["Order"] > 0]
+    print(f"Found {len(moving)} harmonic ridges and {len(harmonics) - len(moving)} stationary tones "
+          f"in {time.perf_counter() - start:.2f} s")
+    print(f"Harmonics table saved to {output_csv}")
+    return harmonics
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Track the blade-pass harmonics in the speed x frequency spectra.")
+    parser.add_argument("spectra", nargs="?", default=os.path.join("data3", "all_spectra.csv"),
+                        help="all_spectra.csv or a SpectraStore directory")
+    parser.add_argument("-o", "--output", default=os.path.join("data3", "harmonics.csv"))
+    parser.add_argument("--points", default=None, help="Also save every ridge's peaks to this CSV")
+    parser.add_argument("--prominence", type=float, default=10.0, help="Peak prominence threshold in dB")
+    args = parser.parse_args()
+    generate_harmonics_csv(args.spectra, args.output, args.points, prominence_db=args.prominence)
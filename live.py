@@ -0,0 +1,398 @@
+import time
+import wave
+import queue
+import threading
+
+import numpy as np
+from scipy.io import wavfile
+
+from binning import bin_spectra, linear_edges
+from tones import track_tones
+
+class RingBuffer:
+    """
+    Fixed-size, thread-safe ring buffer of int16 audio frames.
+
+    The audio callback writes into it, and readers address samples by their absolute position
+    in the stream, so they can pick up everything written since their last read as long as they
+    keep up within one buffer length. The source closes it when a finite stream (e.g. a .wav
+    file played once) runs out, which wakes every waiting reader.
+
+    Parameters:
+    - capacity (int): Number of frames held.
+    - channels (int): Number of channels per frame. Default is 1.
+    """
+
+    def __init__(self, capacity, channels=1):
+        self.capacity = capacity
+        self.channels = channels
+        self._data = np.zeros((capacity, channels), dtype=np.int16)
+        self._written = 0
+        self._cond = threading.Condition()
+        self.closed = False
+
+    @property
+    def written(self):
+        return self._written
+
+    def write(self, block):
+        block = np.asarray(block, dtype=np.int16).reshape(-1, self.channels)
+        if len(block) > self.capacity:
+            block = block[-self.capacity:]
+        with self._cond:
+            start = self._written % self.capacity
+            end = start + len(block)
+            if end <= self.capacity:
+                self._data[start:end] = block
+            else:
+                split = self.capacity - start
+                self._data[start:] = block[:split]
+                self._data[:end - self.capacity] = block[split:]
+            self._written += len(block)
+            self._cond.notify_all()
+
+    def close(self):
+        """
+        Marks the end of the stream: no more frames will be written.
+        """
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+    def read(self, position, count=None):
+        """
+        Returns a copy of the frames from absolute position onwards (at most count frames),
+        and the position after them. Raises OverflowError if they were already overwritten.
+        """
+        with self._cond:
+            if position < self._written - self.capacity:
+                raise OverflowError(f"Ring buffer overrun: frames from {position} were overwritten")
+            end = self._written if count is None else min(self._written, position + count)
+            indices = np.arange(position, end) % self.capacity
+            return self._data[indices], end
+
+    def latest(self, count):
+        """
+        Returns a copy of the most recent count frames (fewer if not enough were written yet).
+        """
+        with self._cond:
+            count = min(count, self._written, self.capacity)
+            indices = np.arange(self._written - count, self._written) % self.capacity
+            return self._data[indices]
+
+    def wait(self, position, timeout=1.0):
+        """
+        Blocks until frames beyond position have been written, the buffer is closed or the
+        timeout expires.
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: self._written > position or self.closed, timeout)
+
+class SoundDeviceSource:
+    """
+    Audio source backed by a callback-based sounddevice input stream.
+    """
+
+    def __init__(self, sample_rate=44100, channels=1, blocksize=1024, device=None):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.blocksize = blocksize
+        self.device = device
+        self._stream = None
+
+    def start(self, callback, on_end=None):
+        import sounddevice as sd
+
+        def _callback(indata, frames, time_info, status):
+            if status:
+                print(f"Input stream status: {status}")
+            callback(indata)
+
+        self._stream = sd.InputStream(samplerate=self.sample_rate, channels=self.channels, dtype='int16',
+                                      blocksize=self.blocksize, device=self.device, callback=_callback,
+                                      finished_callback=on_end)
+        self._stream.start()
+
+    def stop(self):
+        if self._stream is not None:
+            self._stream.stop()
+            self._stream.close()
+            self._stream = None
+
+class _ThreadedSource:
+    """
+    Base class for sources that stand in for the sound card: a background thread calls
+    the callback with blocks from _blocks(), optionally paced in real time.
+    """
+
+    def __init__(self, sample_rate, channels, blocksize, realtime):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.blocksize = blocksize
+        self.realtime = realtime
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _blocks(self):
+        raise NotImplementedError
+
+    def _run(self, callback, on_end):
+        block_time = self.blocksize / self.sample_rate
+        next_time = time.perf_counter()
+        try:
+            for block in self._blocks():
+                if self._stop.is_set():
+                    break
+                callback(block)
+                if self.realtime:
+                    next_time += block_time
+                    time.sleep(max(0.0, next_time - time.perf_counter()))
+        finally:
+            if on_end is not None:
+                on_end()
+
+    def start(self, callback, on_end=None):
+        """
+        Starts calling callback with every block; on_end, if given, is called once the blocks
+        run out or the source is stopped.
+        """
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(callback, on_end), daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+class WavFileSource(_ThreadedSource):
+    """
+    Plays a .wav file as if it were a microphone, looping at the end.
+    """
+
+    def __init__(self, file_path, blocksize=1024, realtime=True, loop=True):
+        sample_rate, self._data = wavfile.read(file_path, mmap=True)
+        channels = 1 if len(self._data.shape) == 1 else self._data.shape[1]
+        super().__init__(sample_rate, channels, blocksize, realtime)
+        self.loop = loop
+
+    def _blocks(self):
+        while not self._stop.is_set():
+            for start in range(0, len(self._data), self.blocksize):
+                yield np.asarray(self._data[start:start + self.blocksize]).reshape(-1, self.channels)
+            if not self.loop:
+                return
+
+class SyntheticSource(_ThreadedSource):
+    """
+    Generates sine tones plus white noise, e.g. to mimic fan blade-pass harmonics.
+
+    Parameters:
+    - tones (list): (frequency in Hz, amplitude) pairs.
+    - noise (float): Standard deviation of the added white noise.
+    """
+
+    def __init__(self, sample_rate=44100, channels=1, tones=((440.0, 1000.0),), noise=100.0,
+                 blocksize=1024, realtime=True, seed=None):
+        super().__init__(sample_rate, channels, blocksize, realtime)
+        self.tones = list(tones)
+        self.noise = noise
+        self._rng = np.random.default_rng(seed)
+
+    def _blocks(self):
+        position = 0
+        while not self._stop.is_set():
+            t = (position + np.arange(self.blocksize)) / self.sample_rate
+            signal = np.zeros(self.blocksize)
+            for frequency, amplitude in self.tones:
+                signal += amplitude * np.sin(2 * np.pi * frequency * t)
+            block = signal[:, None] + self._rng.normal(0, self.noise, (self.blocksize, self.channels))
+            position += self.blocksize
+            yield np.clip(block, -32768, 32767).astype(np.int16)
+
+class BackgroundWavWriter:
+    """
+    Writes int16 frames to a .wav file from a background thread, so disk I/O never stalls
+    the capture loop. The output is equivalent to scipy.io.wavfile.write.
+    """
+
+    def __init__(self, filename, sample_rate, channels=1):
+        self.filename = filename
+        self._queue = queue.Queue()
+        self._wav = wave.open(filename, "wb")
+        self._wav.setnchannels(channels)
+        self._wav.setsampwidth(2)
+        self._wav.setframerate(sample_rate)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            block = self._queue.get()
+            if block is None:
+                break
+            self._wav.writeframes(np.ascontiguousarray(block, dtype='<i2').tobytes())
+        self._wav.close()
+
+    def write(self, block):
+        self._queue.put(block)
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+class LiveRecorder:
+    """
+    Captures from an audio source into a ring buffer and analyzes it while recording.
+
+    Use as a context manager so the source runs for the whole sweep, then call settle() after
+    each speed change and record() to capture a clip.
+
+    Parameters:
+    - source: SoundDeviceSource, WavFileSource, SyntheticSource or anything with
+      sample_rate, channels, start(callback, on_end) and stop().
+    - buffer_seconds (float): Ring buffer length. Default is 30 seconds.
+    - window_seconds (float): Length of the rolling analysis window. Default is 0.5 seconds.
+    """
+
+    def __init__(self, source, buffer_seconds=30.0, window_seconds=0.5):
+        self.source = source
+        self.sample_rate = source.sample_rate
+        self.window = int(window_seconds * self.sample_rate)
+        self.buffer = RingBuffer(int(buffer_seconds * self.sample_rate), source.channels)
+        self._band_edges = linear_edges(5000, width=50)
+
+    def __enter__(self):
+        self.buffer.closed = False
+        self.source.start(self.buffer.write, on_end=self.buffer.close)
+        return self
+
+    def __exit__(self, *exc):
+        self.source.stop()
+
+    def rolling_volume(self):
+        """
+        Average volume of the most recent analysis window.
+        """
+        return np.mean(np.abs(_mono(self.buffer.latest(self.window))))
+
+    def rolling_spectrum(self):
+        """
+        FFT magnitude spectrum of the most recent analysis window, normalized like analyze_audio.
+        """
+        data = _mono(self.buffer.latest(self.window))
+        freqs = np.fft.rfftfreq(len(data), d=1/self.sample_rate)
+        return freqs, np.abs(np.fft.rfft(data)) / max(len(data), 1)
+
+    def rolling_tones(self, freqs, band_hz=0.0, resolution_hz=0.5):
+        """
+        Magnitudes of a few known tones in the most recent analysis window (see tones.track_tones),
+        much cheaper than rolling_spectrum when only the fan's harmonics are of interest.
+        """
+        return track_tones(_mono(self.buffer.latest(self.window)), self.sample_rate, freqs, band_hz, resolution_hz)
+
+    def _band_levels(self):
+        freqs, magnitude = self.rolling_spectrum()
+        levels, _ = bin_spectra(freqs, magnitude, self._band_edges)
+        return 20 * np.log10(np.nan_to_num(levels) + 1e-12)
+
+    def settle(self, max_wait=3.0, min_wait=0.5, tolerance_db=1.0, checks=3):
+        """
+        Waits for the fan noise to settle after a speed change.
+
+        Returns as soon as the rolling spectrum has changed by less than tolerance_db (median over
+        50 Hz bands) for the given number of consecutive half-window checks, but not before
+        min_wait or after max_wait seconds of audio, or when a finite source runs out. Returns
+        the time waited in seconds.
+        """
+        start = self.buffer.written
+        step = self.window // 2
+        position = start
+        previous = None
+        stable = 0
+        while True:
+            position += step
+            while self.buffer.written < position:
+                if self.buffer.closed:
+                    # The source ran out; nothing more can change
+                    return (self.buffer.written - start) / self.sample_rate
+                self.buffer.wait(position - 1)
+            elapsed = (position - start) / self.sample_rate
+            if elapsed >= max_wait:
+                return elapsed
+
+            levels = self._band_levels()
+            if previous is not None and np.median(np.abs(levels - previous)) < tolerance_db:
+                stable += 1
+            else:
+                stable = 0
+            previous = levels
+
+            if stable >= checks and elapsed >= min_wait:
+                return elapsed
+
+    def capture(self, duration=5.0, on_block=None, writer=None):
+        """
+        Captures the next duration seconds of audio and returns them as an int16 array of
+        shape (frames, channels). Blocks are passed to writer as they arrive, and on_block, if
+        given, is called with the rolling volume after every block.
+
+        If a finite source runs out, the frames captured so far are returned (a shorter clip);
+        EOFError is raised if it had already run out before the clip started.
+        """
+        n_frames = int(duration * self.sample_rate)
+        clip = np.zeros((n_frames, self.buffer.channels), dtype=np.int16)
+
+        position = self.buffer.written
+        filled = 0
+        while filled < n_frames:
+            self.buffer.wait(position)
+            block, position = self.buffer.read(position, n_frames - filled)
+            if not len(block):
+                if self.buffer.closed:
+                    break
+                continue
+            clip[filled:filled + len(block)] = block
+            filled += len(block)
+            if writer is not None:
+                writer.write(block)
+            if on_block is not None:
+                on_block(self.rolling_volume())
+        if filled < n_frames:
+            if filled == 0:
+                raise EOFError("The audio source ended before the clip started")
+            clip = clip[:filled]
+        return clip
+
+    def record(self, filename, duration=5.0, on_block=None):
+        """
+        Records a clip to filename while analyzing it.
+
+        The clip is written in the background as it arrives. on_block, if given, is called with
+        the rolling volume after every block. Returns the same (average_volume, freqs,
+        fft_magnitude) as analyze.analyze_audio on the written file.
+        """
+        writer = BackgroundWavWriter(filename, self.sample_rate, self.buffer.channels)
+        try:
+            clip = self.capture(duration, on_block=on_block, writer=writer)
+        finally:
+            writer.close()
+        return analyze_clip(clip, self.sample_rate)
+
+def analyze_clip(clip, sample_rate):
+    """
+    Analyzes an in-memory int16 clip of shape (frames, channels) exactly like analyze.analyze_audio.
+    """
+    data = _mono(clip)
+    n = len(data)
+    average_volume = np.mean(np.abs(data))
+    freqs = np.fft.rfftfreq(n, d=1/sample_rate)
+    fft_magnitude = np.abs(np.fft.rfft(data)) / n
+    return average_volume, freqs, fft_magnitude
+
+def _mono(frames):
+    # Same conversion as analyze_audio: int16 mono stays as is, multi-channel is averaged
+    if frames.shape[1] == 1:
+        return frames[:, 0]
+    return frames.mean(axis=1)
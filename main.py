@@ -1,11 +1,29 @@
 import os
+import sys
 import time
-import numpy as np
 from datetime import datetime
-import sounddevice as sd
 from scipy.io.wavfile import write
 
-def record_audio(filename, duration=10, sample_rate=44100):
+import metrics
+from analyze import format_speed
+from live import LiveRecorder, SoundDeviceSource, analyze_clip
+from session_archive import SessionArchiveWriter, archive_path_for
+from sweep import FANCONTROL_SENSOR_FILE, FileFanController, LiveCapture, run_sweeps, sweep_plan
+
+def capture_audio(duration=10, sample_rate=44100, channels=1):
+    """
+    Records an audio clip and returns it as an int16 array of shape (frames, channels), with
+    the channels interleaved as the device delivers them.
+    """
+    import sounddevice as sd
+
+    print("Recording...")
+    audio_data = sd.rec(int(duration * sample_rate), samplerate=sample_rate, channels=channels, dtype='int16')
+    sd.wait()  # Wait for the recording to complete
+    return audio_data
+
+@metrics.timed("record_audio")
+def record_audio(filename, duration=10, sample_rate=44100, channels=1):
     """
     Records an audio clip and saves it with the given filename.
 
@@ -13,59 +31,116 @@ def record_audio(filename, duration=10, sample_rate=44100):
     - filename (str): The name of the file to save the audio as (e.g., 'output.wav').
     - duration (int): The duration of the recording in seconds. Default is 10 seconds.
     - sample_rate (int): The sample rate for recording. Default is 44100 Hz.
+    - channels (int): Number of microphones recorded into the file. Default is 1.
     """
-    print("Recording...")
-    audio_data = sd.rec(int(duration * sample_rate), samplerate=sample_rate, channels=1, dtype='int16')
-    sd.wait()  # Wait for the recording to complete
+    audio_data = capture_audio(duration, sample_rate, channels)
     write(filename, sample_rate, audio_data)  # Save as .wav file
     print(f"Recording saved to {filename}")
 
-def create_recordings_folder():
+def settle_and_record(filename, recorder=None, settle_time=3, duration=5, archive=None, value=None, channels=1):
+    """
+    Waits for the fan to settle at a new speed, then records a clip.
+
+    Parameters:
+    - filename (str): The name of the file to save the audio as.
+    - recorder (LiveRecorder): If given, the clip is captured and analyzed from a running input
+      stream, and the settle wait ends early once the rolling spectrum is stable.
+    - settle_time (float): Maximum settle time in seconds. Default is 3 seconds.
+    - duration (float): The duration of the recording in seconds. Default is 5 seconds.
+    - archive (SessionArchiveWriter): If given, the clip is added to this session archive under
+      the fan speed value instead of being saved to filename.
+    - value (float): Fan speed of the clip, for the archive.
+    - channels (int): Number of microphones to record without a recorder (a recorder records
+      the channels of its source). Default is 1.
+    """
+    metrics.increment("recordings")
+    metrics.increment("audio_seconds_recorded", duration)
+    if recorder is None:
+        with metrics.timer("settle"):
+            time.sleep(settle_time)
+        if archive is None:
+            record_audio(filename, duration=duration, channels=channels)
+        else:
+            with metrics.timer("record_audio"):
+                archive.add(value, capture_audio(duration, channels=channels), 44100)
+            print(f"Recording of fan speed {value} added to {archive.path}")
+        return
+
+    with metrics.timer("settle"):
+        waited = recorder.settle(max_wait=settle_time)
+    print(f"Settled after {waited:.2f} s, recording...")
+    with metrics.timer("record_audio"):
+        if archive is None:
+            average_volume, _, _ = recorder.record(filename, duration=duration)
+        else:
+            clip = recorder.capture(duration)
+            archive.add(value, clip, recorder.sample_rate)
+            average_volume, _, _ = analyze_clip(clip, recorder.sample_rate)
+            filename = f"{archive.path} (fan speed {value})"
+    print(f"Recording saved to {filename} (average volume {average_volume:.2f})")
+
+def create_recordings_folder(data_dir="dataSilence"):
     # Create a folder to save recordings with current date and time
-    folder_name = f"dataSilence\\Recordings_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    folder_name = os.path.join(data_dir, f"Recordings_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
     os.makedirs(folder_name, exist_ok=True)
     return folder_name
 
-def recording_script():
-    folder_name = create_recordings_folder()
-    step = 1
-    values = np.zeros((0,100)) # list(range(100, 0 - step, -step))
-    # print(values)
-    text_file = "C:\\Users\\Denis\\Downloads\\Apps\\FanControl\\Configurations\\testing.sensor"
-
-    for value in values:
-        # Write the current value to the text file
-        with open(text_file, 'w') as file:
-            file.write(str(value))
-        
-        print(f"Value {value} written to {text_file}")
-        
-        # Wait for 3 seconds
-        time.sleep(3)
-        
-        # Record audio with the value as part of the filename
-        filename = os.path.join(folder_name, f"audio_{value}.wav")
-        record_audio(filename, duration=5)
-
-    folder_name = create_recordings_folder()
-    values = list(range(0,100 + step, step))
-    for value in values:
-        # Write the current value to the text file
-        with open(text_file, 'w') as file:
-            file.write(str(value))
-        
-        print(f"Value {value} written to {text_file}")
-        
-        # Wait for 3 seconds
-        time.sleep(3)
-        
-        # Record audio with the value as part of the filename
-        filename = os.path.join(folder_name, f"audio_{value}.wav")
-        record_audio(filename, duration=5)
+def recording_script(recorder=None, data_dir="dataSilence", archive=False, channels=1, values=None, settle_time=3,
+                     duration=5):
+    """
+    Records one sweep of fan speeds into a new session folder (see settle_and_record).
+
+    Parameters:
+    - values (list): Fan speeds in the order they are recorded (see sweep.sweep_plan). Default is
+      0 to 100 in steps of 1.
+    - settle_time (float): Maximum settle time in seconds. Default is 3 seconds.
+    - duration (float): The duration of each recording in seconds. Default is 5 seconds.
+    - The other parameters are as for settle_and_record.
+    """
+    folder_name = create_recordings_folder(data_dir)
+    if values is None:
+        step = 1
+        values = list(range(0,100 + step, step)) # list(range(100, 0 - step, -step))
+    text_file = FANCONTROL_SENSOR_FILE
+
+    # With archive=True the whole sweep goes into one "Recordings_<timestamp>.session" file
+    # (see session_archive.py); the folder stays for the analysis results
+    writer = SessionArchiveWriter(archive_path_for(folder_name)) if archive else None
+    try:
+        for value in values:
+            # Write the current value to the text file
+            with open(text_file, 'w') as file:
+                file.write(str(value))
+
+            print(f"Value {value} written to {text_file}")
+
+            # Wait for the fan to settle, then record audio with the value as part of the filename
+            filename = os.path.join(folder_name, f"audio_{format_speed(value)}.wav")
+            with metrics.timer("recording_step"):
+                settle_and_record(filename, recorder=recorder, settle_time=settle_time, duration=duration, archive=writer,
+                                  value=value, channels=channels)
+    finally:
+        # An interrupted sweep keeps the speeds recorded so far, as the .wav folder would
+        if writer is not None:
+            writer.close()
 
 if __name__ == "__main__":
+    # "--channels N" records N microphones into every file (see analyze.analyze_folder_channels)
+    channels = int(sys.argv[sys.argv.index("--channels") + 1]) if "--channels" in sys.argv else 1
+    if "--pipelined" in sys.argv:
+        # Overlap disk writes and analysis of each step with settling and capture of the next
+        import asyncio
+        with LiveRecorder(SoundDeviceSource(sample_rate=44100, channels=channels)) as recorder:
+            while True:
+                asyncio.run(run_sweeps(sweep_plan("ascending", 0, 100, 1), FileFanController(),
+                                       LiveCapture(recorder), "dataSilence"))
+    if "--live" in sys.argv:
+        # Keep one input stream open for all sweeps and analyze while recording
+        with LiveRecorder(SoundDeviceSource(sample_rate=44100, channels=channels)) as recorder:
+            while True:
+                recording_script(recorder=recorder, archive="--archive" in sys.argv)
     while True:
-        recording_script()
+        recording_script(archive="--archive" in sys.argv, channels=channels)
 
 
 
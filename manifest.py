@@ -0,0 +1,99 @@
+import os
+import json
+import tempfile
+
+from fft_cache import file_digest
+
+# Bump this whenever an analysis stage changes its output, so every input is processed again
+ANALYSIS_VERSION = 1
+
+class Manifest:
+    """
+    Index of the inputs each pipeline stage has already processed.
+
+    For every stage ("analyze", "volumes", "spectra", ...) the manifest records each input
+    file's size, modification time, content hash and the analysis version it was processed
+    with. A stage can then skip inputs that are unchanged since its last run. A file whose
+    mtime changed but whose contents did not (e.g. after a copy) still counts as unchanged.
+
+    Parameters:
+    - path (str): Path of the manifest JSON file. Paths inside it are stored relative to it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.root = os.path.dirname(os.path.abspath(path))
+        self.data = {"stages": {}, "spectra": {}}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.data = json.load(f)
+            self.data.setdefault("stages", {})
+            self.data.setdefault("spectra", {})
+
+    def _key(self, file_path):
+        return os.path.relpath(os.path.abspath(file_path), self.root).replace(os.sep, "/")
+
+    def is_current(self, file_path, stage):
+        """
+        Returns True if file_path is unchanged since the given stage last recorded it.
+        """
+        entry = self.data["stages"].get(stage, {}).get(self._key(file_path))
+        if entry is None or entry.get("version") != ANALYSIS_VERSION or not os.path.exists(file_path):
+            return False
+
+        stat = os.stat(file_path)
+        if stat.st_size != entry["size"]:
+            return False
+        if stat.st_mtime_ns == entry["mtime"]:
+            return True
+
+        # Same size but touched since: only rehash in this case
+        if file_digest(file_path) != entry["hash"]:
+            return False
+        entry["mtime"] = stat.st_mtime_ns
+        return True
+
+    def record(self, file_path, stage, family=None):
+        """
+        Marks file_path as processed by the given stage in its current state.
+
+        Parameters:
+        - file_path (str): The processed input.
+        - stage (str): The stage that processed it.
+        - family (str): If given, file_path is dropped from every other stage whose name starts
+          with this prefix. For stages that write the same outputs with different settings.
+        """
+        stat = os.stat(file_path)
+        key = self._key(file_path)
+        if family is not None:
+            for other, records in self.data["stages"].items():
+                if other != stage and other.startswith(family):
+                    records.pop(key, None)
+        self.data["stages"].setdefault(stage, {})[key] = {
+            "size": stat.st_size,
+            "mtime": stat.st_mtime_ns,
+            "hash": file_digest(file_path),
+            "version": ANALYSIS_VERSION,
+        }
+
+    def forget(self, stage):
+        """
+        Drops everything recorded for a stage, forcing it to process all inputs again.
+        """
+        self.data["stages"].pop(stage, None)
+
+    def spectra_inputs(self, fan_speed):
+        """
+        Returns the recorded inputs of the average spectrum for a fan speed, or None.
+        """
+        return self.data["spectra"].get(str(fan_speed))
+
+    def record_spectra_inputs(self, fan_speed, inputs):
+        self.data["spectra"][str(fan_speed)] = inputs
+
+    def save(self):
+        # Write atomically so an interrupted run never leaves a truncated manifest
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(self.data, f)
+        os.replace(tmp_path, self.path)
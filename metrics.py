@@ -0,0 +1,232 @@
+import os
+import json
+import time
+import atexit
+import functools
+import threading
+from datetime import datetime
+
+# Metrics are off unless FANSPEED_METRICS is set; FANSPEED_METRICS=profile also runs cProfile.
+# When off, timers and counters return immediately, so instrumented code pays a flag check only.
+METRICS_ENV = "FANSPEED_METRICS"
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL_TIMER = _NullTimer()
+
+class _Timer:
+    def __init__(self, registry, name):
+        self.registry = registry
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.registry.observe(self.name, time.perf_counter() - self.start)
+        return False
+
+class Metrics:
+    """
+    Process-wide registry of counters and timers.
+
+    Counters are plain running totals (files, bytes, audio seconds, cache hits...). Timers keep
+    the count, total and maximum duration of a stage. Both can be exported as a JSON line or in
+    the Prometheus text format. Updates are thread-safe; worker processes hand their metrics
+    to the parent with take() and merge().
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.counters = {}
+        self.timers = {}
+        self.started = time.time()
+        self._profiler = None
+        self._lock = threading.Lock()
+
+    def increment(self, name, value=1):
+        if self.enabled:
+            with self._lock:
+                self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, seconds):
+        if self.enabled:
+            with self._lock:
+                self._observe(name, 1, seconds, seconds)
+
+    def _observe(self, name, count, seconds, longest):
+        old_count, old_total, old_longest = self.timers.get(name, (0, 0.0, 0.0))
+        self.timers[name] = (old_count + count, old_total + seconds, max(old_longest, longest))
+
+    def timer(self, name):
+        """
+        Context manager that adds the duration of its block to the timer called name.
+        """
+        return _Timer(self, name) if self.enabled else _NULL_TIMER
+
+    def timed(self, name=None):
+        """
+        Decorator that times every call of a function (under its qualified name by default).
+        """
+        def decorate(function):
+            timer_name = name or f"{function.__module__}.{function.__qualname__}"
+
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    self.observe(timer_name, time.perf_counter() - start)
+            return wrapper
+        return decorate
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.timers.clear()
+            self.started = time.time()
+
+    def snapshot(self):
+        with self._lock:
+            counters = dict(self.counters)
+            timers = dict(self.timers)
+        return {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "pid": os.getpid(),
+            "uptime_s": time.time() - self.started,
+            "counters": counters,
+            "timers": {name: {"count": count, "total_s": total, "max_s": longest}
+                       for name, (count, total, longest) in timers.items()},
+        }
+
+    def take(self):
+        """
+        Returns the snapshot of everything recorded since the last take() and clears it, for a
+        worker process to send back with its result. Returns None when metrics are off.
+        """
+        if not self.enabled:
+            return None
+        snapshot = self.snapshot()
+        with self._lock:
+            self.counters.clear()
+            self.timers.clear()
+        return snapshot
+
+    def merge(self, snapshot):
+        """
+        Adds a snapshot from another process (see take) to this registry.
+        """
+        if not self.enabled or not snapshot:
+            return
+        with self._lock:
+            for name, value in snapshot["counters"].items():
+                self.counters[name] = self.counters.get(name, 0) + value
+            for name, timer in snapshot["timers"].items():
+                self._observe(name, timer["count"], timer["total_s"], timer["max_s"])
+
+    def write_jsonl(self, path):
+        """
+        Appends the current metrics to a JSON lines file.
+        """
+        with open(path, "a") as f:
+            f.write(json.dumps(self.snapshot()) + "\n")
+
+    def write_prometheus(self, path, prefix="fanspeed"):
+        """
+        Writes the current metrics in the Prometheus text exposition format (e.g. for the node
+        exporter's textfile collector). The file is replaced atomically.
+        """
+        lines = []
+        for name, value in sorted(self.counters.items()):
+            metric = f"{prefix}_{_metric_name(name)}_total"
+            lines += [f"# TYPE {metric} counter", f"{metric} {value}"]
+        for name, (count, total, longest) in sorted(self.timers.items()):
+            metric = f"{prefix}_{_metric_name(name)}_seconds"
+            lines += [f"# TYPE {metric} summary", f"{metric}_sum {total}", f"{metric}_count {count}",
+                      f"# TYPE {metric}_max gauge", f"{metric}_max {longest}"]
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, path)
+
+    def start_profile(self):
+        """
+        Starts a cProfile run covering everything until stop_profile.
+        """
+        import cProfile
+
+        self._profiler = cProfile.Profile()
+        self._profiler.enable()
+
+    def stop_profile(self, path=None, top=25):
+        """
+        Stops the cProfile run, saves the raw stats to path (for snakeviz or pstats) if given, and
+        prints the functions with the largest cumulative time.
+        """
+        if self._profiler is None:
+            return
+        import pstats
+
+        self._profiler.disable()
+        if path is not None:
+            self._profiler.dump_stats(path)
+            print(f"Profile saved to {path}")
+        pstats.Stats(self._profiler).sort_stats("cumulative").print_stats(top)
+        self._profiler = None
+
+def _metric_name(name):
+    return "".join(c if c.isalnum() else "_" for c in name).strip("_").lower()
+
+metrics = Metrics(enabled=bool(os.environ.get(METRICS_ENV)))
+
+# Shorthands for instrumented modules
+increment = metrics.increment
+timer = metrics.timer
+timed = metrics.timed
+
+def init_worker(enabled):
+    """
+    ProcessPoolExecutor initializer: turns metrics on or off like the parent and starts the
+    worker's registry empty (a forked worker would otherwise inherit the parent's totals).
+    """
+    metrics.enabled = enabled
+    metrics.reset()
+
+def enable(jsonl=None, prometheus=None, profile=None):
+    """
+    Turns metrics on for this process and exports them at exit.
+
+    Parameters:
+    - jsonl (str): JSON lines file the metrics are appended to.
+    - prometheus (str): Prometheus text file the metrics are written to.
+    - profile (str): If given, the process also runs under cProfile and its stats are saved here.
+    """
+    metrics.enabled = True
+    if profile is not None:
+        metrics.start_profile()
+
+    def export():
+        if jsonl is not None:
+            metrics.write_jsonl(jsonl)
+            print(f"Metrics appended to {jsonl}")
+        if prometheus is not None:
+            metrics.write_prometheus(prometheus)
+            print(f"Metrics written to {prometheus}")
+        if profile is not None:
+            metrics.stop_profile(profile)
+    atexit.register(export)
+
+if metrics.enabled:
+    # Environment-enabled runs export next to the working directory unless told otherwise
+    enable(jsonl=os.environ.get("FANSPEED_METRICS_FILE", "metrics.jsonl"),
+           prometheus=os.environ.get("FANSPEED_METRICS_PROM"),
+           profile="profile.pstats" if os.environ.get(METRICS_ENV) == "profile" else None)
@@ -0,0 +1,333 @@
+import os
+import json
+import time
+import argparse
+
+import numpy as np
+
+from binning import bin_spectra, octave_edges
+
+# The noise model turns the measured sweeps into lookup tables for a fan controller:
+#
+# - a monotone speed -> dB curve, fitted to a per-speed statistic of "all_volumes.csv",
+# - the level of every frequency band at every speed, from "all_spectra.csv",
+# - the inverse of the curve: the highest speed whose noise stays within a budget.
+#
+# All three are tabulated on fixed grids when the model is built, so a lookup is one index
+# computation and one array read.
+
+def isotonic_fit(values, weights=None):
+    """
+    Least-squares non-decreasing fit of a sequence (pool adjacent violators).
+
+    Parameters:
+    - values (array): Values in the order of increasing fan speed.
+    - weights (array): Optional weight of every value (e.g. the number of sessions).
+
+    Returns:
+    - array of fitted values, the same length as values.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    weights = np.ones_like(values) if weights is None else np.asarray(weights, dtype=np.float64)
+
+    # Each block is (mean, total weight, number of values); merge while a block is above the next
+    means, totals, sizes = [], [], []
+    for value, weight in zip(values, weights):
+        means.append(value)
+        totals.append(weight)
+        sizes.append(1)
+        while len(means) > 1 and means[-2] > means[-1]:
+            weight = totals[-2] + totals[-1]
+            means[-2] = (means[-2] * totals[-2] + means[-1] * totals[-1]) / weight
+            totals[-2] = weight
+            sizes[-2] += sizes[-1]
+            del means[-1], totals[-1], sizes[-1]
+    return np.repeat(means, sizes)
+
+class NoiseModel:
+    """
+    Tabulated speed -> noise model with constant-time lookups.
+
+    Build one with build_noise_model, or load a saved one with NoiseModel.load.
+
+    Attributes:
+    - speeds, levels_db: the per-speed statistic the curve was fitted to (in dB).
+    - speed_grid, curve_db: the fitted curve, tabulated every speed_step percent.
+    - band_edges, band_db: band edges in Hz and the level of every band at every grid speed,
+      shaped (len(speed_grid), n_bands).
+    - budget_min_db, budget_step_db, max_speeds: max_speeds[i] is the highest grid speed such
+      that neither the curve nor any measured level up to it exceeds budget_min_db + i * budget_step_db.
+    """
+
+    def __init__(self, speeds, levels_db, speed_grid, curve_db, band_edges, band_db,
+                 budget_min_db, budget_step_db, max_speeds, metadata=None):
+        self.speeds = np.asarray(speeds)
+        self.levels_db = np.asarray(levels_db)
+        self.speed_grid = np.asarray(speed_grid)
+        self.curve_db = np.asarray(curve_db)
+        self.band_edges = np.asarray(band_edges)
+        self.band_db = np.asarray(band_db)
+        self.budget_min_db = float(budget_min_db)
+        self.budget_step_db = float(budget_step_db)
+        self.max_speeds = np.asarray(max_speeds)
+        self.metadata = dict(metadata or {})
+        self._speed_min = float(self.speed_grid[0])
+        self._speed_step = float(self.speed_grid[1] - self.speed_grid[0]) if len(self.speed_grid) > 1 else 1.0
+        # Python lists index faster than numpy arrays for single elements
+        self._curve = self.curve_db.tolist()
+        self._max_speeds = self.max_speeds.tolist()
+
+    def _speed_index(self, speed):
+        index = int(round((speed - self._speed_min) / self._speed_step))
+        return min(max(index, 0), len(self._curve) - 1)
+
+    def noise_at(self, speed):
+        """
+        Returns the fitted noise level in dB at a fan speed (clamped to the measured range).
+        """
+        return self._curve[self._speed_index(speed)]
+
+    def band_levels(self, speed):
+        """
+        Returns the level in dB of every band (see band_edges) at a fan speed.
+        """
+        return self.band_db[self._speed_index(speed)]
+
+    def max_speed(self, budget_db):
+        """
+        Returns the highest fan speed whose noise is within budget_db, with the budget rounded
+        down to the table's budget_step_db. Budgets below the quietest measured level give the
+        lowest measured speed.
+        """
+        index = int((budget_db - self.budget_min_db) / self.budget_step_db)
+        if index < 0:
+            return self._max_speeds[0]
+        return self._max_speeds[min(index, len(self._max_speeds) - 1)]
+
+    def save(self, path):
+        """
+        Saves the model as a compressed .npz file.
+        """
+        np.savez_compressed(path, speeds=self.speeds, levels_db=self.levels_db, speed_grid=self.speed_grid,
+                            curve_db=self.curve_db, band_edges=self.band_edges, band_db=self.band_db.astype(np.float32),
+                            budget=np.array([self.budget_min_db, self.budget_step_db]), max_speeds=self.max_speeds,
+                            metadata=json.dumps(self.metadata))
+        print(f"Noise model saved to {path}")
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data["speeds"], data["levels_db"], data["speed_grid"], data["curve_db"],
+                       data["band_edges"], data["band_db"], data["budget"][0], data["budget"][1],
+                       data["max_speeds"], json.loads(str(data["metadata"])))
+
+def build_noise_model(volumes_csv, spectra_csv=None, statistic="min", curve="envelope", speed_step=0.1,
+                      budget_step_db=0.01, band_edges=None):
+    """
+    Fits the speed -> noise model from the aggregated sweep results.
+
+    Parameters:
+    - volumes_csv (str): "all_volumes.csv", a SpectraStore, or the wide volume table.
+    - spectra_csv (str): "all_spectra.csv" or a SpectraStore, for the band levels. Optional.
+    - statistic (str): Per-speed statistic over the sessions, "min" (the quietest take, as
+      in dataViz.plot_volume_curves) or "median". Default is "min".
+    - curve (str): "envelope" for the running maximum of the measured levels, or "isotonic" for
+      the least-squares monotone fit. The envelope is conservative: a bump such as the lip
+      around 70-75% caps every faster speed at the bump's level instead of being averaged
+      with its neighbours. Default is "envelope". Either way, the budget table never allows a
+      speed at or beyond a measured level above the budget.
+    - speed_step (float): Resolution of the tabulated curve in percent. Default is 0.1.
+    - budget_step_db (float): Resolution of the budget lookup table in dB. Default is 0.01.
+    - band_edges (array): Band edges in Hz. Default is octave bands up to 3500 Hz.
+
+    Returns:
+    - NoiseModel
+    """
+    from spectra_store import read_spectra, read_volumes
+
+    volumes_df = read_volumes(volumes_csv)
+    if statistic == "min":
+        levels = volumes_df.min(axis=1)
+    elif statistic == "median":
+        levels = volumes_df.median(axis=1)
+    else:
+        raise ValueError(f"Unknown statistic: {statistic}")
+    levels = levels.dropna().sort_index()
+    speeds = levels.index.to_numpy(dtype=np.float64)
+    levels_db = 20 * np.log10(levels.to_numpy())
+    counts = volumes_df.loc[levels.index].count(axis=1).to_numpy()
+
+    if curve == "isotonic":
+        fitted = isotonic_fit(levels_db, counts)
+    elif curve == "envelope":
+        fitted = np.maximum.accumulate(levels_db)
+    else:
+        raise ValueError(f"Unknown curve: {curve}")
+
+    # Tabulate the curve; linear interpolation keeps it non-decreasing
+    speed_grid = np.round(speeds[0] + speed_step * np.arange(int(round((speeds[-1] - speeds[0]) / speed_step)) + 1), 6)
+    curve_db = np.interp(speed_grid, speeds, fitted)
+
+    # The budget table uses the louder of the curve and the measured levels on either side of
+    # each grid speed, so a fitted curve that averages away a bump (PAVA pools the lip with the
+    # quieter speeds above it) cannot put the controller inside it
+    above = np.clip(np.searchsorted(speeds, speed_grid, side="left"), 0, len(speeds) - 1)
+    below = np.clip(np.searchsorted(speeds, speed_grid, side="right") - 1, 0, len(speeds) - 1)
+    ceiling_db = np.maximum.accumulate(np.maximum(curve_db, np.maximum(levels_db[below], levels_db[above])))
+
+    # Highest speed within every budget on the budget grid
+    budget_min_db = float(np.floor(ceiling_db[0] / budget_step_db) * budget_step_db)
+    n_budgets = int(np.ceil((ceiling_db[-1] - budget_min_db) / budget_step_db)) + 1
+    budgets = budget_min_db + budget_step_db * np.arange(n_budgets)
+    # Tiny tolerance so a budget equal to a tabulated level still allows that speed
+    indices = np.searchsorted(ceiling_db, budgets + 1e-9, side="right") - 1
+    max_speeds = speed_grid[np.clip(indices, 0, None)]
+
+    # Band levels at every measured speed, then on the speed grid
+    band_edges = octave_edges(31.5, 3500) if band_edges is None else np.asarray(band_edges)
+    band_db = np.full((len(speed_grid), len(band_edges) - 1), np.nan)
+    if spectra_csv is not None:
+        spectra_df = read_spectra(spectra_csv)
+        spectra_speeds = np.array([float(col) for col in spectra_df.columns])
+        order = np.argsort(spectra_speeds)
+        power, _ = bin_spectra(spectra_df.index.to_numpy(), spectra_df.to_numpy()[:, order] ** 2, band_edges, reducer="sum")
+        power_db = 10 * np.log10(power + 1e-20)
+        for band in range(power_db.shape[0]):
+            band_db[:, band] = np.interp(speed_grid, spectra_speeds[order], power_db[band])
+
+    metadata = {"volumes": str(volumes_csv) if isinstance(volumes_csv, str) else None,
+                "spectra": spectra_csv, "statistic": statistic, "curve": curve}
+    return NoiseModel(speeds, levels_db, speed_grid, curve_db, band_edges, band_db,
+                      budget_min_db, budget_step_db, max_speeds, metadata)
+
+class WmiTemperatureSource:
+    """
+    Reads temperatures from OpenHardwareMonitor over WMI, as wmiTest.py does (Windows only).
+
+    Parameters:
+    - sensors (list): Sensor names to watch, e.g. ["CPU Package"]. Default is every
+      temperature sensor; the hottest one is returned.
+    """
+
+    def __init__(self, sensors=None):
+        self.sensors = sensors
+
+    def read(self):
+        from wmiTest import read_temperatures
+
+        temperatures = read_temperatures()
+        if self.sensors is not None:
+            temperatures = {name: value for name, value in temperatures.items() if name in self.sensors}
+        return max(temperatures.values())
+
+class FakeTemperatureSource:
+    """
+    Replays a fixed sequence of temperatures (then holds the last one), for tests and dry runs.
+    """
+
+    def __init__(self, readings):
+        self.readings = list(readings)
+        self.position = 0
+
+    def read(self):
+        value = self.readings[min(self.position, len(self.readings) - 1)]
+        self.position += 1
+        return value
+
+def temperature_curve(points=((40, 20), (60, 50), (80, 100))):
+    """
+    Returns a function mapping a temperature to the fan speed it calls for, interpolating
+    linearly between (temperature, speed) points and holding the end values outside them.
+    """
+    temperatures = np.array([temperature for temperature, _ in points], dtype=np.float64)
+    speeds = np.array([speed for _, speed in points], dtype=np.float64)
+    return lambda temperature: float(np.interp(temperature, temperatures, speeds))
+
+def choose_speed(model, temperature, budget_db, curve, critical_temperature=90):
+    """
+    Picks the fan speed for one temperature reading: what the temperature curve asks for,
+    capped at the highest speed within the noise budget, unless the temperature is critical.
+    """
+    wanted = curve(temperature)
+    if temperature >= critical_temperature:
+        return max(wanted, float(model.speed_grid[-1]))
+    return min(wanted, model.max_speed(budget_db))
+
+def control_loop(model, source, budget_db, controller=None, curve=None, interval=2.0, iterations=None,
+                 hysteresis=1.0, critical_temperature=90):
+    """
+    Keeps the fan as fast as the temperature needs but within a noise budget.
+
+    Every interval seconds the source is read, choose_speed picks the speed, and the speed is
+    written through the controller when it moved by at least hysteresis percent.
+
+    Parameters:
+    - model (NoiseModel): Built with build_noise_model or loaded with NoiseModel.load.
+    - source: WmiTemperatureSource, FakeTemperatureSource or anything with read().
+    - budget_db (float): Noise budget, in the dB of the model's curve.
+    - controller: Anything with set_speed(value). Default is sweep.FileFanController, which
+      writes the FanControl sensor file like main.recording_script.
+    - curve: Temperature -> speed function. Default is temperature_curve().
+    - interval (float): Seconds between readings. Default is 2 seconds.
+    - iterations (int): Stop after this many readings. Default is to run forever.
+    - hysteresis (float): Minimum change in percent before a new speed is written.
+    - critical_temperature (float): At or above this, the budget is ignored.
+
+    Returns:
+    - list of (temperature, speed written or None) for every reading.
+    """
+    if controller is None:
+        from sweep import FileFanController
+        controller = FileFanController()
+    curve = curve or temperature_curve()
+
+    history = []
+    current = None
+    iteration = 0
+    while iterations is None or iteration < iterations:
+        temperature = source.read()
+        speed = choose_speed(model, temperature, budget_db, curve, critical_temperature)
+        written = None
+        if current is None or abs(speed - current) >= hysteresis:
+            # Whole percentages are written as integers, as main.recording_script does
+            written = int(round(speed)) if abs(speed - round(speed)) < 1e-9 else round(speed, 1)
+            controller.set_speed(written)
+            current = speed
+            print(f"{temperature:.1f} C -> fan speed {written} (noise {model.noise_at(speed):.2f} dB)")
+        history.append((temperature, written))
+        iteration += 1
+        if iterations is None or iteration < iterations:
+            time.sleep(interval)
+    return history
+
+def benchmark_lookup(model, n=100000):
+    """
+    Returns the average time of one max_speed lookup in microseconds.
+    """
+    budgets = np.random.default_rng(0).uniform(model.curve_db[0] - 1, model.curve_db[-1] + 1, n).tolist()
+    start = time.perf_counter()
+    for budget in budgets:
+        model.max_speed(budget)
+    return (time.perf_counter() - start) / n * 1e6
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the speed -> noise model, or run the fan controller with it.")
+    parser.add_argument("data_dir", nargs="?", default="data3", help="Directory with all_volumes.csv and all_spectra.csv")
+    parser.add_argument("-o", "--output", default=None, help="Model file (default: <data_dir>/noise_model.npz)")
+    parser.add_argument("--statistic", choices=["min", "median"], default="min")
+    parser.add_argument("--curve", choices=["envelope", "isotonic"], default="envelope")
+    parser.add_argument("--control", type=float, default=None, metavar="BUDGET_DB",
+                        help="Run the controller with this noise budget instead of building")
+    args = parser.parse_args()
+
+    model_path = args.output or os.path.join(args.data_dir, "noise_model.npz")
+    if args.control is None:
+        spectra_csv = os.path.join(args.data_dir, "all_spectra.csv")
+        model = build_noise_model(os.path.join(args.data_dir, "all_volumes.csv"),
+                                  spectra_csv if os.path.exists(spectra_csv) else None,
+                                  statistic=args.statistic, curve=args.curve)
+        model.save(model_path)
+        print(f"Lookup time: {benchmark_lookup(model):.2f} us")
+    else:
+        control_loop(NoiseModel.load(model_path), WmiTemperatureSource(), args.control)
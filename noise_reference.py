@@ -0,0 +1,285 @@
+import os
+import re
+import json
+import argparse
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from analyze import analyze_recordings, format_speed, list_recordings, parse_speed
+from binning import bin_spectra, linear_edges
+from fft_kernel import analyze_clips
+from session_archive import SessionArchive, find_sessions, is_archive, session_folder
+from spectra_store import SpectraStore, build_store, is_store
+
+# Background removal against calibration ("silence") sessions. Every calibration session in
+# dataSilence/ becomes one binned reference spectrum in a ReferenceLibrary, and each recording
+# session is compared with the reference recorded closest to it in time, so a change in room
+# noise between days is not mistaken for fan noise.
+
+SESSION_TIME_PATTERN = re.compile(r"Recordings_(\d{8}_\d{6})")
+DEFAULT_LIBRARY = "reference_library.npz"
+
+def session_time(name):
+    """
+    Returns the start time encoded in a "Recordings_YYYYMMDD_HHMMSS" session name (folder,
+    archive or path), or None if there is none.
+    """
+    match = SESSION_TIME_PATTERN.search(os.path.basename(os.path.normpath(name)))
+    return datetime.strptime(match.group(1), "%Y%m%d_%H%M%S") if match else None
+
+class ReferenceLibrary:
+    """
+    Binned background spectra of calibration sessions, with their recording times.
+
+    Attributes:
+    - names (list): Calibration session names, in time order.
+    - times (array): Their start times as POSIX timestamps.
+    - edges (array): Frequency bin edges of the profiles (see binning.py).
+    - profiles (array): Mean magnitude in every bin, shape (len(names), len(edges) - 1).
+    - volumes (array): Average volume of every calibration session.
+    - speeds (list): Recordings averaged per session (see build_reference_library), or None for all.
+    """
+
+    def __init__(self, names, times, edges, profiles, volumes, speeds=None):
+        order = np.argsort(times, kind="stable")
+        self.names = [names[i] for i in order]
+        self.times = np.asarray(times, dtype=np.float64)[order]
+        self.edges = np.asarray(edges)
+        self.profiles = np.asarray(profiles)[order]
+        self.volumes = np.asarray(volumes)[order]
+        self.speeds = None if speeds is None else sorted(parse_speed(speed) for speed in speeds)
+        self.stale = False  # Set for libraries saved without their build parameters
+
+    def closest(self, sessions):
+        """
+        Returns the index of the reference recorded closest in time to each session, or -1 for
+        sessions without a timestamp in their name.
+        """
+        times = np.array([(t.timestamp() if t is not None else np.nan)
+                          for t in (session_time(session) for session in sessions)])
+        if len(self.times) == 1:
+            indices = np.zeros(len(times), dtype=int)
+        else:
+            # Compare the neighbours on either side of each session's time
+            after = np.clip(np.searchsorted(self.times, times), 1, len(self.times) - 1)
+            before = after - 1
+            indices = np.where(np.abs(times - self.times[before]) <= np.abs(self.times[after] - times), before, after)
+        return np.where(np.isnan(times), -1, indices)
+
+    def _binned(self, edges):
+        # Profiles re-binned onto other edges, if needed
+        if edges is None or np.array_equal(edges, self.edges):
+            return self.profiles
+        centers = (self.edges[:-1] + self.edges[1:]) / 2
+        profiles, _ = bin_spectra(centers, self.profiles.T, edges, "mean")
+        return profiles.T
+
+    def profiles_for(self, sessions, edges=None):
+        """
+        Returns one reference profile per session, shape (len(sessions), n_bins): the closest
+        reference in time, or the mean of all references for sessions without a timestamp.
+        """
+        profiles = self._binned(edges)
+        table = np.vstack([profiles, np.nanmean(profiles, axis=0)])
+        return table[self.closest(sessions)]
+
+    def mean_profile(self, edges=None):
+        """
+        Returns the mean of all reference profiles, e.g. for spectra averaged over sessions
+        recorded at different times.
+        """
+        return np.nanmean(self._binned(edges), axis=0)
+
+    def matches(self, speeds=None, edges=None, max_freq=3500):
+        """
+        Returns True if the library was built with these build_reference_library parameters.
+        """
+        edges = linear_edges(max_freq) if edges is None else np.asarray(edges)
+        if speeds is not None:
+            speeds = sorted(parse_speed(speed) for speed in speeds)
+        return not self.stale and speeds == self.speeds and np.array_equal(edges, self.edges)
+
+    def save(self, path):
+        np.savez_compressed(path, names=np.array(self.names), times=self.times, edges=self.edges,
+                            profiles=self.profiles.astype(np.float32), volumes=self.volumes,
+                            build=json.dumps({"speeds": self.speeds}))
+        print(f"Reference library of {len(self.names)} sessions saved to {path}")
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            build = json.loads(str(data["build"])) if "build" in data.files else None
+            library = cls(list(data["names"]), data["times"], data["edges"], data["profiles"], data["volumes"],
+                          speeds=build["speeds"] if build else None)
+        library.stale = build is None
+        return library
+
+def _session_spectra(session, speeds):
+    # Mean magnitude spectrum and volume of a calibration session's recordings
+    if is_archive(session):
+        with SessionArchive(session) as archive:
+            values = [value for value in archive.speeds if speeds is None or value in speeds]
+            results = analyze_clips([archive.read(value) for value in values])
+    else:
+        results = analyze_recordings([file_path for value, file_path in list_recordings(session)
+                                      if speeds is None or value in speeds])
+    if not results:
+        return None
+    lengths = {len(freqs) for _, freqs, _ in results}
+    if len(lengths) > 1:
+        # Recordings of different lengths have different bins; keep the most common length
+        length = max(lengths, key=lambda n: sum(len(freqs) == n for _, freqs, _ in results))
+        results = [result for result in results if len(result[1]) == length]
+    magnitude = np.mean([fft_magnitude for _, _, fft_magnitude in results], axis=0)
+    return np.mean([volume for volume, _, _ in results]), results[0][1], magnitude
+
+def build_reference_library(silence_dir="dataSilence", speeds=None, edges=None, max_freq=3500):
+    """
+    Builds the reference library from the calibration sessions in silence_dir.
+
+    Parameters:
+    - silence_dir (str): Directory of "Recordings_*" calibration folders or archives.
+    - speeds (list): Only average these recordings of each session, e.g. [1] for the single
+      "audio_1.wav" reference used before. Default is every recording.
+    - edges (array): Frequency bin edges. Default is integer-Hz bins up to max_freq.
+    - max_freq (float): Highest frequency of the default edges. Default is 3500 Hz.
+
+    Returns:
+    - ReferenceLibrary
+    """
+    edges = linear_edges(max_freq) if edges is None else np.asarray(edges)
+    names, times, profiles, volumes = [], [], [], []
+    for session in find_sessions(silence_dir):
+        name = os.path.basename(session_folder(session) if is_archive(session) else session)
+        start = session_time(name)
+        if start is None:
+            print(f"Skipping {session}: no timestamp in its name")
+            continue
+        result = _session_spectra(session, speeds)
+        if result is None:
+            print(f"Skipping {session}: no recordings found")
+            continue
+        volume, freqs, magnitude = result
+        binned, _ = bin_spectra(freqs, magnitude, edges, "mean")
+        names.append(name)
+        times.append(start.timestamp())
+        profiles.append(binned)
+        volumes.append(volume)
+    if not names:
+        raise FileNotFoundError(f"No calibration sessions found in {silence_dir}")
+    return ReferenceLibrary(names, times, edges, np.array(profiles), volumes, speeds)
+
+def load_reference_library(silence_dir="dataSilence", path=None, **kwargs):
+    """
+    Loads the library saved in silence_dir, rebuilding and saving it first if it is missing,
+    older than any calibration session, or built with other parameters than the given
+    build_reference_library keyword arguments (speeds, edges, max_freq).
+    """
+    path = path or os.path.join(silence_dir, DEFAULT_LIBRARY)
+    if os.path.exists(path):
+        built = os.path.getmtime(path)
+        if all(os.path.getmtime(session) < built for session in find_sessions(silence_dir)):
+            library = ReferenceLibrary.load(path)
+            if library.matches(**kwargs):
+                return library
+            print(f"Rebuilding {path}: it was built with other parameters")
+    library = build_reference_library(silence_dir, **kwargs)
+    library.save(path)
+    return library
+
+def remove_background(spectra, references, mode="ratio", floor=1e-12):
+    """
+    Removes the background from binned spectra in one broadcast operation.
+
+    Parameters:
+    - spectra (array): Binned magnitudes, shape (sessions, speeds, bins).
+    - references (array): One reference profile per session, shape (sessions, bins)
+      (see ReferenceLibrary.profiles_for).
+    - mode (str): "ratio" divides by the reference, so 20 * log10 of the result is the level
+      above the background in dB; "subtract" is power spectral subtraction,
+      sqrt(max(S^2 - R^2, 0)), which keeps magnitudes in their original units.
+    - floor (float): Smallest magnitude kept, so the dB conversion stays finite.
+    """
+    references = references[:, None, :]
+    if mode == "ratio":
+        return (spectra + floor) / (references + floor)
+    if mode == "subtract":
+        return np.sqrt(np.maximum(spectra ** 2 - references ** 2, floor ** 2))
+    raise ValueError(f"Unknown mode: {mode}")
+
+def background_removed_spectra(data_dir, library, mode="ratio", k=3, edges=None, chunk_sessions=64):
+    """
+    Background-removed counterpart of "all_spectra.csv": every session's spectra are binned,
+    cleaned against the reference closest to that session, and the k quietest sessions of every
+    fan speed are averaged.
+
+    Parameters:
+    - data_dir (str): A SpectraStore, or a directory of analyzed sessions, in which case a
+      store is built at <data_dir>/spectra_store first (see spectra_store.build_store).
+    - library (ReferenceLibrary): Calibration references.
+    - mode (str): "ratio" or "subtract" (see remove_background).
+    - k (int): Number of quietest sessions averaged per fan speed. Default is 3.
+    - edges (array): Frequency bins. Default is the library's.
+    - chunk_sessions (int): Sessions binned at a time, to bound memory on large corpora.
+
+    Returns:
+    - DataFrame with one row per frequency bin (lower edge) and one column per fan speed.
+    """
+    if not is_store(data_dir):
+        store_path = os.path.join(data_dir, "spectra_store")
+        store = SpectraStore(store_path) if is_store(store_path) else build_store(data_dir, store_path)
+    else:
+        store = SpectraStore(data_dir)
+    edges = library.edges if edges is None else np.asarray(edges)
+    sessions, speeds = list(store.sessions), store.speeds
+    volumes = store.volumes_frame()[sessions].to_numpy().T  # (sessions, speeds)
+
+    # The k quietest sessions of every speed (NaN volumes last; ties keep session order)
+    order = np.argsort(np.where(np.isnan(volumes), np.inf, volumes), axis=0, kind="stable")[:k]
+    quiet = np.zeros(volumes.shape, dtype=bool)
+    np.put_along_axis(quiet, order, True, axis=0)
+    quiet &= ~np.isnan(volumes)
+
+    references = library.profiles_for(sessions, edges)
+    total = np.zeros((len(speeds), len(edges) - 1))
+    for start in range(0, len(sessions), chunk_sessions):
+        chunk = slice(start, start + chunk_sessions)
+        _, _, freqs, spectra = store.spectra(sessions=sessions[chunk])
+        # Bin all sessions and speeds at once: frequency first, as bin_spectra expects
+        binned, _ = bin_spectra(freqs, np.moveaxis(spectra, 2, 0), edges, "mean")
+        cleaned = remove_background(np.moveaxis(binned, 0, 2), references[chunk], mode)
+        total += np.where(quiet[chunk, :, None], np.nan_to_num(cleaned), 0).sum(axis=0)
+    counts = quiet.sum(axis=0)
+    average = total / np.maximum(counts, 1)[:, None]
+    average[counts == 0] = np.nan
+
+    df = pd.DataFrame(average.T, index=pd.Index(edges[:-1], name="Frequency (Hz)"),
+                      columns=[format_speed(speed) for speed in speeds])
+    return df.dropna(how="all")
+
+def plot_background_removed(data_dir, output_image, silence_dir="dataSilence", mode="ratio", k=3):
+    """
+    Renders the background-removed average spectra (Assets/avgSpectraBkgdRemoved_plot_db.png in
+    the README) and saves the table next to it as "<output_image without extension>.csv".
+    """
+    from render import render_heatmap
+
+    library = load_reference_library(silence_dir)
+    spectra_df = background_removed_spectra(data_dir, library, mode=mode, k=k)
+    spectra_df.to_csv(os.path.splitext(output_image)[0] + ".csv")
+    label = "Power Ratio (dB)" if mode == "ratio" else "Magnitude (dB)"
+    render_heatmap(spectra_df.to_numpy(), [parse_speed(col) for col in spectra_df.columns], spectra_df.index.to_numpy(),
+                   output_image, reducer="max", db=True, cmap="viridis", xlabel="Fan Speed", ylabel="Frequency (Hz)",
+                   title="Average Spectra with Background Removed", cbar_label=label)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the calibration reference library and remove the background.")
+    parser.add_argument("data_dir", nargs="?", default="data3", help="Analyzed sessions or a SpectraStore")
+    parser.add_argument("--silence-dir", default="dataSilence", help="Directory of calibration sessions")
+    parser.add_argument("--mode", choices=["ratio", "subtract"], default="ratio")
+    parser.add_argument("-o", "--output", default=os.path.join("Assets", "avgSpectraBkgdRemoved_plot_db.png"))
+    args = parser.parse_args()
+    plot_background_removed(args.data_dir, args.output, args.silence_dir, args.mode)
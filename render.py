@@ -0,0 +1,183 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+def use_headless():
+    """
+    Switches matplotlib to the non-interactive Agg backend, for rendering straight to files.
+    """
+    import matplotlib
+    matplotlib.use("Agg")
+
+def pool_axis(values, n_out, axis=0, reducer="max"):
+    """
+    Reduces an array along one axis to at most n_out groups of neighbouring samples.
+
+    With "max" a narrow peak (e.g. one harmonic in a single frequency bin) survives however
+    many bins share a pixel; "mean" gives the average level of each group.
+
+    Returns:
+    - pooled (array), starts (array): the pooled values and the first index of every group.
+    """
+    values = np.asarray(values)
+    n = values.shape[axis]
+    if n <= n_out:
+        return values, np.arange(n)
+    starts = np.unique(np.linspace(0, n, n_out + 1).astype(int)[:-1])
+    if reducer == "max":
+        pooled = np.maximum.reduceat(values, starts, axis=axis)
+    elif reducer == "mean":
+        counts = np.diff(np.append(starts, n))
+        shape = [1] * values.ndim
+        shape[axis] = len(starts)
+        pooled = np.add.reduceat(values, starts, axis=axis, dtype=np.float64) / counts.reshape(shape)
+    else:
+        raise ValueError(f"Unknown reducer: {reducer}")
+    return pooled, starts
+
+def pool_coordinates(coordinates, starts):
+    """
+    Returns the mean coordinate of every group from pool_axis.
+    """
+    coordinates = np.asarray(coordinates, dtype=np.float64)
+    counts = np.diff(np.append(starts, len(coordinates)))
+    return np.add.reduceat(coordinates, starts) / counts
+
+def render_heatmap(matrix, x, y, output_image=None, width_px=1200, height_px=800, dpi=100, reducer="max",
+                   db=False, log_y=False, cmap="viridis", xlabel=None, ylabel=None, title=None, cbar_label=None):
+    """
+    Draws a (len(y), len(x)) matrix as an image, pooled down to the figure's pixel resolution first.
+
+    The axes get ordinary numeric ticks instead of one label per row, so drawing time and memory
+    depend on the output size rather than the number of frequency bins.
+
+    Parameters:
+    - matrix (array): Values with one row per y and one column per x (e.g. frequency x fan speed).
+    - x, y (array): Coordinates of the columns and rows; y must be ascending, columns are
+      sorted by x if needed.
+    - output_image (str): File to save to. If None, the figure is shown instead.
+    - width_px, height_px, dpi: Output size. Default is 1200 x 800 pixels.
+    - reducer (str): "max" (keeps narrow peaks) or "mean" pooling. Default is "max".
+    - db (bool): Convert magnitudes to dB after pooling. Default is False.
+    - log_y (bool): Logarithmic y axis (drawn with pcolormesh at the pooled coordinates).
+    """
+    import matplotlib.pyplot as plt
+
+    # Columns may come in filename order ("audio_0", "audio_1", "audio_10", ...)
+    x = np.asarray(x, dtype=np.float64)
+    if np.any(np.diff(x) < 0):
+        order = np.argsort(x, kind="stable")
+        x, matrix = x[order], np.asarray(matrix)[:, order]
+
+    matrix, rows = pool_axis(matrix, height_px, axis=0, reducer=reducer)
+    matrix, columns = pool_axis(matrix, width_px, axis=1, reducer=reducer)
+    y, x = pool_coordinates(y, rows), pool_coordinates(x, columns)
+    if db:
+        matrix = 20 * np.log10(np.asarray(matrix, dtype=np.float64) + 1e-12)
+
+    fig = plt.figure(figsize=(width_px / dpi, height_px / dpi), dpi=dpi)
+    if log_y:
+        image = plt.pcolormesh(x, y, matrix, cmap=cmap, shading="nearest")
+        plt.yscale("log")
+    else:
+        # Cells are centered on their coordinates
+        half_x = (x[-1] - x[0]) / (2 * max(len(x) - 1, 1))
+        half_y = (y[-1] - y[0]) / (2 * max(len(y) - 1, 1))
+        image = plt.imshow(matrix, aspect="auto", origin="lower", cmap=cmap, interpolation="nearest",
+                           extent=[x[0] - half_x, x[-1] + half_x, y[0] - half_y, y[-1] + half_y])
+    plt.colorbar(image, label=cbar_label)
+    if xlabel:
+        plt.xlabel(xlabel)
+    if ylabel:
+        plt.ylabel(ylabel)
+    if title:
+        plt.title(title)
+    plt.tight_layout()
+
+    if output_image is None:
+        plt.show()
+    else:
+        fig.savefig(output_image, dpi=dpi)
+        plt.close(fig)
+        print(f"Figure saved to {output_image}")
+
+def render_histogram2d(x, y, x_bins, y_bins, output_image=None, xlabel=None, ylabel=None, title=None,
+                       width_px=1200, height_px=800, dpi=100):
+    """
+    Draws a 2-D histogram as one colour-mapped image (a single draw call instead of a bar per cell).
+    """
+    hist, x_edges, y_edges = np.histogram2d(x, y, bins=[x_bins, y_bins])
+    x_centers = (x_edges[:-1] + x_edges[1:]) / 2
+    y_centers = (y_edges[:-1] + y_edges[1:]) / 2
+    render_heatmap(hist.T, x_centers, y_centers, output_image, width_px, height_px, dpi, reducer="max",
+                   xlabel=xlabel, ylabel=ylabel, title=title, cbar_label="Count")
+
+def _render_job(job):
+    # Runs in a worker process: render one figure headless and time it
+    use_headless()
+    function, kwargs = job
+    start = time.perf_counter()
+    function(**kwargs)
+    return time.perf_counter() - start
+
+def render_all(jobs, workers=None):
+    """
+    Renders figures in parallel worker processes.
+
+    Parameters:
+    - jobs (list): (function, kwargs) pairs; every function is a module-level plotting function
+      that saves its figure to a file, e.g. dataViz.plot_volume_curves with an output_image.
+    - workers (int): Number of processes. Default is one per job, up to os.cpu_count().
+
+    Returns:
+    - list of render times in seconds, in the order of jobs.
+    """
+    if not jobs:
+        return []
+    workers = workers or min(len(jobs), os.cpu_count() or 1)
+    if workers == 1:
+        return [_render_job(job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(_render_job, jobs))
+
+def report_jobs(data_dir, output_dir="Assets", reference_wav=None, silence_dir=None):
+    """
+    Returns the render jobs of the report figures in Assets/ for a data directory that has been
+    analyzed and aggregated (analysis_results.csv files and all_spectra.csv). With a directory
+    of calibration sessions, the background-removed spectra figure is included as well.
+    """
+    from dataViz import plot_volume_curves, plot_volume_histogram
+    from specgramTest import ZERO_NOISE_REFERENCE, plot_spectra_with_db
+
+    jobs = [
+        (plot_volume_curves, {"data_path": data_dir, "output_image": os.path.join(output_dir, "volumeScatterFinal.png")}),
+        (plot_volume_histogram, {"data_path": data_dir, "output_image": os.path.join(output_dir, "volumeHistogram2D.png")}),
+        (plot_spectra_with_db, {"spectra_csv": os.path.join(data_dir, "all_spectra.csv"),
+                                "output_image": os.path.join(output_dir, "spectra_plot_db.png"),
+                                "reference_wav": reference_wav or ZERO_NOISE_REFERENCE,
+                                "reference_library": silence_dir if reference_wav is None else None}),
+    ]
+    if silence_dir is not None:
+        from noise_reference import plot_background_removed
+        jobs.append((plot_background_removed, {"data_dir": data_dir, "silence_dir": silence_dir,
+                                               "output_image": os.path.join(output_dir, "avgSpectraBkgdRemoved_plot_db.png")}))
+    return jobs
+
+def generate_report(data_dir="data3", output_dir="Assets", reference_wav=None, workers=None, silence_dir=None):
+    """
+    Regenerates the report figures in parallel and prints how long each one took.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    jobs = report_jobs(data_dir, output_dir, reference_wav, silence_dir)
+    start = time.perf_counter()
+    times = render_all(jobs, workers)
+    for (_, kwargs), seconds in zip(jobs, times):
+        print(f"{kwargs['output_image']}: {seconds:.2f} s")
+    print(f"Rendered {len(jobs)} figures in {time.perf_counter() - start:.2f} s")
+    return times
+
+
+if __name__ == "__main__":
+    generate_report()
@@ -0,0 +1,324 @@
+import os
+import json
+import zlib
+import struct
+import argparse
+import threading
+
+import numpy as np
+
+import metrics
+
+# A session archive packs every recording of a "Recordings_*" session into one file:
+#
+#   offset 0   magic (8 bytes) | index offset (uint64) | index length (uint64)
+#   offset 24  payloads, each starting on a 64-byte boundary
+#   index      UTF-8 JSON: {"version", "metadata", "entries": [{"speed", "offset", "nbytes",
+#              "length", "channels", "sample_rate", "codec"}, ...]}
+#
+# Payloads are little-endian int16 frames, either "raw" (memory-mapped and read without a copy)
+# or "delta-zlib" (sample-to-sample differences, deflated; lossless). Reading a session is two
+# small reads plus one mapping, instead of a directory listing and a header parse per speed.
+ARCHIVE_SUFFIX = ".session"
+ARCHIVE_MAGIC = b"FANSESS1"
+ARCHIVE_VERSION = 1
+_HEADER = struct.Struct("<8sQQ")
+_ALIGNMENT = 64
+
+def is_archive(path):
+    """
+    Returns True if path is a session archive file.
+    """
+    if not os.path.isfile(path):
+        return False
+    with open(path, "rb") as f:
+        return f.read(len(ARCHIVE_MAGIC)) == ARCHIVE_MAGIC
+
+def archive_path_for(folder_path):
+    """
+    Returns the archive path of a session folder: "data/Recordings_X" -> "data/Recordings_X.session".
+    """
+    return os.path.normpath(folder_path) + ARCHIVE_SUFFIX
+
+def session_folder(archive_path):
+    """
+    Returns the session folder an archive's analysis results are written to (the archive path
+    without its suffix).
+    """
+    if archive_path.endswith(ARCHIVE_SUFFIX):
+        return archive_path[:-len(ARCHIVE_SUFFIX)]
+    return os.path.splitext(archive_path)[0]
+
+def find_sessions(data_dir):
+    """
+    Lists the recording sessions in data_dir, one entry per session.
+
+    A session is a "Recordings_*" folder or a "Recordings_*.session" archive. When both exist
+    (e.g. a converted folder that still holds its analysis results), the archive is returned.
+
+    Returns:
+    - sorted list of folder or archive paths.
+    """
+    sessions = {}
+    for name in sorted(os.listdir(data_dir)):
+        path = os.path.join(data_dir, name)
+        if name.endswith(ARCHIVE_SUFFIX) and name.startswith("Recordings_"):
+            sessions[name[:-len(ARCHIVE_SUFFIX)]] = path
+        elif name.startswith("Recordings_") and os.path.isdir(path):
+            sessions.setdefault(name, path)
+    return [sessions[name] for name in sorted(sessions)]
+
+def _encode(data, compress, level):
+    frames = np.ascontiguousarray(data, dtype="<i2")
+    if not compress:
+        return "raw", frames.tobytes()
+    # int16 differences wrap around, and the cumulative sum in decode wraps back exactly
+    deltas = np.diff(frames, axis=0, prepend=np.zeros((1,) + frames.shape[1:], dtype="<i2"))
+    return "delta-zlib", zlib.compress(deltas.tobytes(), level)
+
+def _decode(payload, entry):
+    deltas = np.frombuffer(zlib.decompress(payload), dtype="<i2")
+    if entry["channels"] > 1:
+        deltas = deltas.reshape(-1, entry["channels"])
+    return np.cumsum(deltas, axis=0, dtype="<i2")
+
+class SessionArchiveWriter:
+    """
+    Writes recordings into a new session archive, one speed at a time.
+
+    The archive is written to "<path>.partial" and moved into place by close(), so an
+    interrupted session never leaves a truncated archive behind. add() may be called from
+    several threads.
+
+    Parameters:
+    - path (str): Path of the archive, normally archive_path_for(<session folder>).
+    - compress (bool): Store payloads as "delta-zlib" instead of "raw". Compressed payloads
+      are about half the size but are decoded (copied) when read. Default is False.
+    - level (int): zlib compression level. Default is 6.
+    - metadata (dict): Anything JSON-serializable to keep in the index (device, settings...).
+    """
+
+    def __init__(self, path, compress=False, level=6, metadata=None):
+        self.path = path
+        self.compress = compress
+        self.level = level
+        self.metadata = dict(metadata or {})
+        self.entries = []
+        self._lock = threading.Lock()
+        self._partial = path + ".partial"
+        self._file = open(self._partial, "wb")
+        self._file.write(_HEADER.pack(ARCHIVE_MAGIC, 0, 0))
+        self._position = _HEADER.size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+    def add(self, speed, data, sample_rate):
+        """
+        Adds one recording.
+
+        Parameters:
+        - speed (float): Fan speed of the recording; each speed can only be added once.
+        - data (array): int16 samples, shaped (n,) for mono or (n, channels).
+        - sample_rate (int): Sample rate in Hz.
+        """
+        data = np.asarray(data)
+        if data.dtype != np.int16:
+            raise ValueError(f"Session archives hold int16 samples, got {data.dtype}")
+        codec, payload = _encode(data, self.compress, self.level)
+        with self._lock:
+            if any(entry["speed"] == speed for entry in self.entries):
+                raise ValueError(f"Fan speed {speed} is already in {self.path}")
+            # Pad so that every payload can be viewed as int16 (and starts on a cache line)
+            padding = -self._position % _ALIGNMENT
+            self._file.write(b"\0" * padding)
+            offset = self._position + padding
+            self._file.write(payload)
+            self._position = offset + len(payload)
+            self.entries.append({
+                "speed": speed,
+                "offset": offset,
+                "nbytes": len(payload),
+                "length": int(data.shape[0]),
+                "channels": int(data.shape[1]) if data.ndim == 2 else 1,
+                "sample_rate": int(sample_rate),
+                "codec": codec,
+            })
+
+    def close(self):
+        """
+        Writes the index and moves the finished archive into place.
+        """
+        if self._file.closed:
+            return
+        index = json.dumps({"version": ARCHIVE_VERSION, "metadata": self.metadata,
+                            "entries": self.entries}).encode("utf-8")
+        self._file.write(index)
+        self._file.seek(0)
+        self._file.write(_HEADER.pack(ARCHIVE_MAGIC, self._position, len(index)))
+        self._file.close()
+        os.replace(self._partial, self.path)
+
+    def abort(self):
+        """
+        Discards the partially written archive.
+        """
+        if not self._file.closed:
+            self._file.close()
+            os.remove(self._partial)
+
+class SessionArchive:
+    """
+    Read access to a session archive.
+
+    Raw payloads are returned as read-only int16 views of one memory map of the file, so
+    reading a speed costs no copy until the samples are used; "delta-zlib" payloads are
+    decoded on read.
+
+    Parameters:
+    - path (str): Path of the archive.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            magic, index_offset, index_length = _HEADER.unpack(f.read(_HEADER.size))
+            if magic != ARCHIVE_MAGIC:
+                raise ValueError(f"{path} is not a session archive")
+            f.seek(index_offset)
+            index = json.loads(f.read(index_length).decode("utf-8"))
+        if index.get("version") != ARCHIVE_VERSION:
+            raise ValueError(f"{path} has unsupported archive version {index.get('version')}")
+        self.metadata = index.get("metadata", {})
+        self.entries = {entry["speed"]: entry for entry in index["entries"]}
+        self._map = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    @property
+    def speeds(self):
+        """
+        Fan speeds in the archive, in ascending order.
+        """
+        return sorted(self.entries)
+
+    def read(self, speed):
+        """
+        Returns (sample_rate, data) for one fan speed, like scipy.io.wavfile.read: data is int16,
+        shaped (n,) for mono or (n, channels).
+        """
+        entry = self.entries[speed]
+        start, stop = entry["offset"], entry["offset"] + entry["nbytes"]
+        if entry["codec"] == "raw":
+            if self._map is None:
+                self._map = np.memmap(self.path, dtype=np.uint8, mode="r")
+            data = self._map[start:stop].view("<i2")
+            if entry["channels"] > 1:
+                data = data.reshape(-1, entry["channels"])
+        elif entry["codec"] == "delta-zlib":
+            with open(self.path, "rb") as f:
+                f.seek(start)
+                data = _decode(f.read(entry["nbytes"]), entry)
+        else:
+            raise ValueError(f"Unknown codec {entry['codec']} in {self.path}")
+        metrics.increment("archive.recordings")
+        metrics.increment("bytes", data.nbytes)
+        metrics.increment("audio_seconds", entry["length"] / entry["sample_rate"])
+        return entry["sample_rate"], data
+
+    def recordings(self, speeds=None):
+        """
+        Iterates over (speed, sample_rate, data) in the given order (default: ascending speed).
+        """
+        for speed in self.speeds if speeds is None else speeds:
+            sample_rate, data = self.read(speed)
+            yield speed, sample_rate, data
+
+    def close(self):
+        # Views handed out keep the mapping alive until they are released
+        self._map = None
+
+def convert_folder(folder_path, archive_path=None, compress=False, remove=False):
+    """
+    Packs the "audio_<speed>.wav" recordings of a session folder into a session archive.
+
+    Every recording is read back from the finished archive and compared with its .wav file
+    before anything is removed.
+
+    Parameters:
+    - folder_path (str): Path to a "Recordings_*" folder.
+    - archive_path (str): Output path. Default is archive_path_for(folder_path).
+    - compress (bool): Store "delta-zlib" payloads. Default is False.
+    - remove (bool): Delete the .wav files once the archive is verified. Analysis results and
+      logs in the folder are kept. Default is False.
+
+    Returns:
+    - archive_path, or None if the folder holds no recordings.
+    """
+    from scipy.io import wavfile
+    from analyze import list_recordings
+
+    recordings = list_recordings(folder_path)
+    if not recordings:
+        print(f"Skipping {folder_path}: no recordings found.")
+        return None
+    archive_path = archive_path or archive_path_for(folder_path)
+
+    with SessionArchiveWriter(archive_path, compress=compress,
+                              metadata={"source": os.path.basename(os.path.normpath(folder_path))}) as writer:
+        for value, file_path in recordings:
+            sample_rate, data = wavfile.read(file_path, mmap=True)
+            writer.add(value, data, sample_rate)
+
+    # Check the round trip before the originals can go
+    with SessionArchive(archive_path) as archive:
+        for value, file_path in recordings:
+            sample_rate, data = wavfile.read(file_path, mmap=True)
+            archived_rate, archived = archive.read(value)
+            if archived_rate != sample_rate or not np.array_equal(archived, data):
+                raise ValueError(f"{archive_path}: fan speed {value} does not match {file_path}")
+
+    wav_bytes = sum(os.path.getsize(file_path) for _, file_path in recordings)
+    print(f"Packed {len(recordings)} recordings from {folder_path} into {archive_path} "
+          f"({os.path.getsize(archive_path) / wav_bytes:.0%} of the .wav size)")
+    if remove:
+        for _, file_path in recordings:
+            os.remove(file_path)
+    return archive_path
+
+def convert_corpus(data_dir, compress=False, remove=False):
+    """
+    Converts every "Recordings_*" folder in data_dir that has no archive yet.
+
+    Returns:
+    - list of archives written.
+    """
+    written = []
+    for session in find_sessions(data_dir):
+        if session.endswith(ARCHIVE_SUFFIX):
+            continue
+        archive_path = convert_folder(session, compress=compress, remove=remove)
+        if archive_path is not None:
+            written.append(archive_path)
+    return written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pack Recordings_* folders into session archives.")
+    parser.add_argument("data_dir", nargs="?", default="data3", help="Directory of Recordings_* folders")
+    parser.add_argument("--compress", action="store_true", help="Losslessly compress the samples")
+    parser.add_argument("--remove", action="store_true", help="Delete the .wav files once packed")
+    args = parser.parse_args()
+    convert_corpus(args.data_dir, compress=args.compress, remove=args.remove)
@@ -0,0 +1,508 @@
+import os
+import json
+import time
+import glob
+import socket
+import sqlite3
+import sys
+import threading
+import multiprocessing
+
+import numpy as np
+import pandas as pd
+
+import metrics
+from analyze import analyze_recordings, archive_values, format_speed, list_recordings, save_folder_results
+from fft_kernel import analyze_clips
+from session_archive import SessionArchive, find_sessions, is_archive, session_folder
+from spectra_store import write_spectra
+from streaming_stats import QuietestTakes, RunningSpectrum
+from volume_aggregation import to_wide
+
+# Sharded analysis: a coordinator puts one work unit per session (or per session and fan speed)
+# into a lease queue on shared storage, any number of workers on any number of machines claim
+# units and write one partial summary per unit, and a reduce step merges the partials into
+# "all_volumes.csv" and "all_spectra.csv". A partial is written atomically under the unit's
+# name, so a unit that is retried after its lease expired just overwrites the same file.
+
+class SQLiteQueue:
+    """
+    Lease queue in a SQLite database, for workers on one machine (SQLite's locking is not
+    reliable over network filesystems; use DirectoryQueue there).
+
+    Parameters:
+    - path (str): Database file; created if it does not exist.
+    - max_attempts (int): Claims per unit before it is marked failed. Default is 3.
+    """
+
+    def __init__(self, path, max_attempts=3):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.partials_dir = os.path.splitext(path)[0] + "_partials"
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS units (id TEXT PRIMARY KEY, payload TEXT NOT NULL, "
+            "state TEXT NOT NULL DEFAULT 'pending', owner TEXT, expires REAL, "
+            "attempts INTEGER NOT NULL DEFAULT 0, error TEXT)")
+
+    def put(self, unit_id, payload):
+        with self._lock:
+            self._connection.execute("INSERT OR IGNORE INTO units (id, payload) VALUES (?, ?)",
+                                     (unit_id, json.dumps(payload)))
+
+    def claim(self, worker, lease_seconds):
+        """
+        Leases the next pending unit (or one whose lease expired) to worker.
+
+        Returns:
+        - (unit_id, payload), or None if nothing can be claimed right now.
+        """
+        with self._lock:
+            now = time.time()
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                # Expired leases that used up their attempts are given up on
+                self._connection.execute(
+                    "UPDATE units SET state = 'failed', owner = NULL, error = 'lease expired' "
+                    "WHERE state = 'leased' AND expires < ? AND attempts >= ?", (now, self.max_attempts))
+                row = self._connection.execute(
+                    "SELECT id, payload FROM units WHERE state = 'pending' OR (state = 'leased' AND expires < ?) "
+                    "ORDER BY rowid LIMIT 1", (now,)).fetchone()
+                if row is not None:
+                    self._connection.execute(
+                        "UPDATE units SET state = 'leased', owner = ?, expires = ?, attempts = attempts + 1 "
+                        "WHERE id = ?", (worker, now + lease_seconds, row[0]))
+                self._connection.execute("COMMIT")
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+        return None if row is None else (row[0], json.loads(row[1]))
+
+    def renew(self, unit_id, worker, lease_seconds):
+        with self._lock:
+            cursor = self._connection.execute(
+                "UPDATE units SET expires = ? WHERE id = ? AND owner = ? AND state = 'leased'",
+                (time.time() + lease_seconds, unit_id, worker))
+        return cursor.rowcount == 1
+
+    def complete(self, unit_id, worker):
+        # The partial is valid even if the lease was lost in the meantime
+        with self._lock:
+            self._connection.execute("UPDATE units SET state = 'done', owner = ?, error = NULL WHERE id = ?",
+                                     (worker, unit_id))
+
+    def release(self, unit_id, worker, error=None):
+        """
+        Gives a unit back after a failure; it is retried until it runs out of attempts.
+        """
+        with self._lock:
+            self._connection.execute(
+                "UPDATE units SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                "owner = NULL, expires = NULL, error = ? WHERE id = ? AND owner = ? AND state = 'leased'",
+                (self.max_attempts, error, unit_id, worker))
+
+    def counts(self):
+        """
+        Returns the number of units in each state ("pending", "leased", "done", "failed").
+        """
+        with self._lock:
+            rows = self._connection.execute("SELECT state, COUNT(*) FROM units GROUP BY state").fetchall()
+        counts = {state: 0 for state in ("pending", "leased", "done", "failed")}
+        counts.update(dict(rows))
+        return counts
+
+    def errors(self):
+        with self._lock:
+            return self._connection.execute(
+                "SELECT id, error FROM units WHERE error IS NOT NULL AND state != 'done'").fetchall()
+
+class DirectoryQueue:
+    """
+    Lease queue made of files on a shared directory (NFS, SMB, ...), needing nothing but
+    atomic renames.
+
+    Every unit is a "<unit_id>.json" file in one of the pending/, leased/, done/ and failed/
+    subdirectories. A worker claims a unit by renaming it from pending/ to leased/, which only
+    one worker can win. The lease expiry is the leased file's modification time, pushed
+    forward by renew(); an expired unit is renamed back to pending/ by whichever worker
+    notices first. Expiry compares against the local clock, so keep the nodes' clocks in sync
+    (or leases comfortably longer than the skew).
+
+    Parameters:
+    - root (str): Queue directory; created if it does not exist.
+    - max_attempts (int): Claims per unit before it is moved to failed/. Default is 3.
+    """
+
+    STATES = ("pending", "leased", "done", "failed")
+    CLAIM_GRACE_SECONDS = 30
+
+    def __init__(self, root, max_attempts=3):
+        self.root = root
+        self.max_attempts = max_attempts
+        self.partials_dir = os.path.join(root, "partials")
+        for name in self.STATES + ("tmp",):
+            os.makedirs(os.path.join(root, name), exist_ok=True)
+
+    def _path(self, state, unit_id):
+        return os.path.join(self.root, state, unit_id + ".json")
+
+    def _write(self, state, unit_id, record):
+        # Written under a unique temporary name, then renamed into place
+        tmp_path = os.path.join(self.root, "tmp", f"{unit_id}.{socket.gethostname()}.{os.getpid()}.{threading.get_ident()}")
+        with open(tmp_path, "w") as f:
+            json.dump(record, f)
+        os.replace(tmp_path, self._path(state, unit_id))
+
+    def _read(self, state, unit_id):
+        with open(self._path(state, unit_id)) as f:
+            return json.load(f)
+
+    def put(self, unit_id, payload):
+        if any(os.path.exists(self._path(state, unit_id)) for state in self.STATES):
+            return
+        self._write("pending", unit_id, {"id": unit_id, "payload": payload, "attempts": 0, "owner": None, "error": None})
+
+    def _requeue_expired(self):
+        now = time.time()
+        for name in sorted(os.listdir(os.path.join(self.root, "leased"))):
+            unit_id = name[:-len(".json")]
+            try:
+                # A unit claimed a moment ago still has its old mtime until the claimer sets the
+                # lease; the rename itself updated its ctime, so give it a grace period
+                stat = os.stat(self._path("leased", unit_id))
+                if stat.st_mtime >= now or stat.st_ctime >= now - self.CLAIM_GRACE_SECONDS:
+                    continue
+                record = self._read("leased", unit_id)
+                target = "failed" if record["attempts"] >= self.max_attempts else "pending"
+                os.rename(self._path("leased", unit_id), self._path(target, unit_id))
+            except (FileNotFoundError, ValueError):
+                # Completed, released or requeued by another worker in the meantime
+                continue
+            print(f"Lease on {unit_id} held by {record['owner']} expired, moved to {target}")
+
+    def claim(self, worker, lease_seconds):
+        for attempt in range(2):
+            for name in sorted(os.listdir(os.path.join(self.root, "pending"))):
+                unit_id = name[:-len(".json")]
+                try:
+                    os.rename(self._path("pending", unit_id), self._path("leased", unit_id))
+                except FileNotFoundError:
+                    continue  # Claimed by another worker first
+                record = self._read("leased", unit_id)
+                record.update(attempts=record["attempts"] + 1, owner=worker)
+                self._write("leased", unit_id, record)
+                self.renew(unit_id, worker, lease_seconds)
+                return unit_id, record["payload"]
+            if attempt == 0:
+                self._requeue_expired()
+        return None
+
+    def renew(self, unit_id, worker, lease_seconds):
+        try:
+            record = self._read("leased", unit_id)
+        except (FileNotFoundError, ValueError):
+            return False
+        if record["owner"] != worker:
+            # Expired and claimed by another worker since
+            return False
+        expires = time.time() + lease_seconds
+        try:
+            os.utime(self._path("leased", unit_id), (expires, expires))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def complete(self, unit_id, worker):
+        try:
+            record = self._read("leased", unit_id)
+        except (FileNotFoundError, ValueError):
+            record = {"id": unit_id, "payload": None, "attempts": None}
+        record.update(owner=worker, error=None)
+        self._write("done", unit_id, record)
+        for state in ("leased", "pending", "failed"):
+            # A requeued or given-up copy of a unit that did finish is not run or reported again
+            try:
+                os.remove(self._path(state, unit_id))
+            except FileNotFoundError:
+                pass
+
+    def release(self, unit_id, worker, error=None):
+        try:
+            record = self._read("leased", unit_id)
+        except (FileNotFoundError, ValueError):
+            return
+        if record["owner"] != worker:
+            return
+        record.update(owner=None, error=error)
+        target = "failed" if record["attempts"] >= self.max_attempts else "pending"
+        self._write(target, unit_id, record)
+        os.remove(self._path("leased", unit_id))
+
+    def counts(self):
+        return {state: sum(name.endswith(".json") for name in os.listdir(os.path.join(self.root, state)))
+                for state in self.STATES}
+
+    def errors(self):
+        errors = []
+        for state in ("pending", "failed"):
+            for name in sorted(os.listdir(os.path.join(self.root, state))):
+                record = self._read(state, name[:-len(".json")])
+                if record.get("error"):
+                    errors.append((record["id"], record["error"]))
+        return errors
+
+def open_queue(path, max_attempts=3):
+    """
+    Opens a SQLiteQueue for a ".db" or ".sqlite" path and a DirectoryQueue for anything else.
+    """
+    if path.endswith((".db", ".sqlite")):
+        return SQLiteQueue(path, max_attempts)
+    return DirectoryQueue(path, max_attempts)
+
+def unit_id(session_path, speed=None):
+    """
+    Name of a work unit (and of its partial): the session name, plus "@<speed>" for a
+    single-speed unit.
+    """
+    name = os.path.basename(session_folder(session_path) if is_archive(session_path) else os.path.normpath(session_path))
+    return name if speed is None else f"{name}@{format_speed(speed)}"
+
+def enqueue_corpus(queue, data_dir, unit="session"):
+    """
+    Puts every session of data_dir into the queue. Units already in the queue are left alone,
+    so the same corpus can be enqueued again after new sessions were recorded.
+
+    Parameters:
+    - queue: SQLiteQueue or DirectoryQueue.
+    - data_dir (str): Directory of "Recordings_*" folders and archives. Use a path that is the
+      same on every node.
+    - unit (str): "session" (one unit per session, the default) or "speed" (one unit per
+      recording, for corpora with fewer sessions than workers).
+
+    Returns:
+    - number of units offered.
+    """
+    offered = 0
+    for session in find_sessions(data_dir):
+        if unit == "session":
+            speeds = [None]
+        elif unit == "speed":
+            if is_archive(session):
+                with SessionArchive(session) as archive:
+                    speeds = archive.speeds
+            else:
+                speeds = [value for value, _ in list_recordings(session)]
+        else:
+            raise ValueError(f"Unknown unit: {unit}")
+        for speed in speeds:
+            queue.put(unit_id(session, speed), {"session": session, "speed": speed})
+            offered += 1
+    print(f"Offered {offered} units from {data_dir}: {queue.counts()}")
+    return offered
+
+def analyze_unit(payload, partials_dir, max_freq=3500):
+    """
+    Analyzes one work unit and writes its partial summary.
+
+    A whole-session unit also writes the folder's "analysis_results.csv" and
+    "spectral_data.npz", as analyze.analyze_folder would.
+
+    Returns:
+    - path of the partial (.npz with the session name, fan speeds, volumes, frequencies up to
+      max_freq and float32 spectra).
+    """
+    session_path, speed = payload["session"], payload["speed"]
+    if is_archive(session_path):
+        folder_path = session_folder(session_path)
+        with SessionArchive(session_path) as archive:
+            values = archive_values(archive) if speed is None else [speed]
+            results = analyze_clips([archive.read(value) for value in values])
+    else:
+        folder_path = session_path
+        recordings = [(value, file_path) for value, file_path in list_recordings(session_path)
+                      if speed is None or value == speed]
+        values = [value for value, _ in recordings]
+        results = analyze_recordings([file_path for _, file_path in recordings])
+    if not results:
+        raise FileNotFoundError(f"No recordings found for {unit_id(session_path, speed)}")
+
+    volumes = [average_volume for average_volume, _, _ in results]
+    freqs = results[0][1]
+    if speed is None:
+        os.makedirs(folder_path, exist_ok=True)
+        save_folder_results(folder_path, values, volumes, freqs, [fft_magnitude for _, _, fft_magnitude in results])
+
+    mask = freqs <= max_freq
+    spectra = np.stack([fft_magnitude[mask] for _, _, fft_magnitude in results]).astype(np.float32)
+    os.makedirs(partials_dir, exist_ok=True)
+    name = unit_id(session_path, speed)
+    partial_path = os.path.join(partials_dir, name + ".npz")
+    tmp_path = os.path.join(partials_dir, f".{name}.{socket.gethostname()}.{os.getpid()}.tmp")
+    with open(tmp_path, "wb") as f:
+        np.savez(f, session=os.path.basename(os.path.normpath(folder_path)), values=np.array(values, dtype=np.float64),
+                 volumes=np.array(volumes, dtype=np.float64), freqs=freqs[mask], spectra=spectra)
+    os.replace(tmp_path, partial_path)
+    return partial_path
+
+def _keep_lease(queue, unit_id, worker, lease_seconds, stop):
+    # Renew the lease well before it runs out, until the unit is finished
+    while not stop.wait(lease_seconds / 3):
+        if not queue.renew(unit_id, worker, lease_seconds):
+            print(f"Lost the lease on {unit_id}")
+            return
+
+def run_worker(queue_path, worker=None, lease_seconds=300, poll_seconds=2.0, max_units=None, max_freq=3500):
+    """
+    Claims and analyzes units until the queue has nothing left to do.
+
+    The worker keeps its lease alive from a background thread while a unit is being analyzed;
+    if the worker dies, the lease expires and another worker retries the unit. When nothing can
+    be claimed but other workers still hold leases, it waits for them to finish or expire.
+
+    Parameters:
+    - queue_path (str): Queue to work on (see open_queue).
+    - worker (str): Worker name. Default is "<hostname>:<pid>".
+    - lease_seconds (float): Lease length. Default is 300 seconds.
+    - poll_seconds (float): Wait between claims when all remaining units are leased.
+    - max_units (int): Stop after this many units.
+
+    Returns:
+    - number of units completed.
+    """
+    queue = open_queue(queue_path)
+    worker = worker or f"{socket.gethostname()}:{os.getpid()}"
+    completed = 0
+    start = time.perf_counter()
+    while max_units is None or completed < max_units:
+        claimed = queue.claim(worker, lease_seconds)
+        if claimed is None:
+            counts = queue.counts()
+            if counts["pending"] == 0 and counts["leased"] == 0:
+                break
+            time.sleep(poll_seconds)
+            continue
+
+        name, payload = claimed
+        stop = threading.Event()
+        keeper = threading.Thread(target=_keep_lease, args=(queue, name, worker, lease_seconds, stop), daemon=True)
+        keeper.start()
+        unit_start = time.perf_counter()
+        try:
+            with metrics.timer("shard_unit"):
+                analyze_unit(payload, queue.partials_dir, max_freq)
+        except Exception as e:
+            print(f"[{worker}] {name} failed: {e!r}")
+            metrics.increment("shard.failed")
+            queue.release(name, worker, error=repr(e))
+            continue
+        finally:
+            stop.set()
+            keeper.join()
+        queue.complete(name, worker)
+        metrics.increment("shard.units")
+        completed += 1
+        print(f"[{worker}] {name} done in {time.perf_counter() - unit_start:.2f} s")
+
+    print(f"[{worker}] Completed {completed} units in {time.perf_counter() - start:.1f} s")
+    return completed
+
+def reduce_partials(partials_dir, volumes_csv, spectra_csv, k=3):
+    """
+    Merges the partial summaries into "all_volumes.csv" and "all_spectra.csv".
+
+    The volume table has the same layout as volume_aggregation.aggregate_volumes. For the
+    spectra, the k quietest takes of every fan speed are picked from the volumes of all partials
+    (as spectra_aggregation.generate_spectra_csv does), then only the partials holding one of
+    them are opened a second time to average their spectra.
+
+    Returns:
+    - the wide volume table and the spectra table.
+    """
+    partial_paths = sorted(glob.glob(os.path.join(partials_dir, "*.npz")))
+    if not partial_paths:
+        raise FileNotFoundError(f"No partial summaries found in {partials_dir}")
+
+    # First pass: volumes only (arrays in an .npz are only read when accessed)
+    volumes = {}
+    sources = {}
+    for partial_path in partial_paths:
+        with np.load(partial_path) as partial:
+            session = str(partial["session"])
+            for row, (value, volume) in enumerate(zip(partial["values"], partial["volumes"])):
+                volumes[(session, value)] = volume
+                sources[(session, value)] = (partial_path, row)
+
+    long_df = pd.DataFrame([(session, value, volume) for (session, value), volume in volumes.items()],
+                           columns=["Session", "Value", "Average Volume"])
+    if (long_df["Value"] % 1 == 0).all():
+        long_df["Value"] = long_df["Value"].astype(int)
+    volumes_df = to_wide(long_df, sessions=sorted(long_df["Session"].unique()))
+    volumes_df.to_csv(volumes_csv)
+    print(f"Aggregated data of {volumes_df.shape[1]} sessions saved to {volumes_csv}")
+
+    quietest = QuietestTakes(k)
+    for fan_speed, row in volumes_df.iterrows():
+        quietest.add_row(fan_speed, row)
+
+    # Second pass: read each needed partial's spectra once
+    needed = {}
+    for fan_speed in volumes_df.index:
+        for rank, (_, session) in enumerate(quietest.quietest(fan_speed)):
+            partial_path, row = sources[(session, float(fan_speed))]
+            needed.setdefault(partial_path, []).append((fan_speed, rank, row))
+    takes = {}
+    freqs = None
+    for partial_path, rows in needed.items():
+        with np.load(partial_path) as partial:
+            spectra = partial["spectra"]
+            freqs = partial["freqs"]
+        for fan_speed, rank, row in rows:
+            takes[(fan_speed, rank)] = spectra[row]
+
+    # Averaged quietest first, like generate_spectra_csv
+    spectra_data = {}
+    for fan_speed in volumes_df.index:
+        average = RunningSpectrum()
+        for rank in range(len(quietest.quietest(fan_speed))):
+            average.add(takes[(fan_speed, rank)])
+        if average.count:
+            spectra_data[fan_speed] = average.mean
+    spectra_df = pd.DataFrame(spectra_data, index=freqs)
+    spectra_df.index.name = "Frequency (Hz)"
+    write_spectra(spectra_csv, spectra_df)
+    print(f"Spectrum data saved to {spectra_csv}")
+    return volumes_df, spectra_df
+
+def run_local(data_dir, queue_path, workers=None, unit="session", lease_seconds=300):
+    """
+    Runs the whole sharded pipeline on one machine: enqueue, several worker processes and the
+    reduce step into data_dir's "all_volumes.csv" and "all_spectra.csv". Also useful to try out
+    a queue before pointing workers on other machines at it.
+    """
+    queue = open_queue(queue_path)
+    enqueue_corpus(queue, data_dir, unit)
+    workers = workers or os.cpu_count() or 1
+
+    start = time.perf_counter()
+    processes = [multiprocessing.Process(target=run_worker, args=(queue_path,),
+                                         kwargs={"lease_seconds": lease_seconds, "poll_seconds": 0.5})
+                 for _ in range(workers)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    counts = queue.counts()
+    print(f"{workers} workers finished in {time.perf_counter() - start:.1f} s: {counts}")
+    for name, error in queue.errors():
+        print(f"{name}: {error}")
+
+    return reduce_partials(queue.partials_dir, os.path.join(data_dir, "all_volumes.csv"),
+                           os.path.join(data_dir, "all_spectra.csv"))
+
+
+if __name__ == "__main__":
+    # Same as "python cli.py shard ..."
+    import cli
+    cli.main(["shard"] + sys.argv[1:])
@@ -1,74 +1,79 @@
-import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
 
-from utils import cmap_map
-from analyze import analyze_audio
+from analyze import analyze_audio, parse_speed
+from binning import bin_spectra, linear_edges
+from spectra_store import read_spectra
 
-def plot_spectra_with_db(spectra_csv, output_image):
+ZERO_NOISE_REFERENCE = "dataSilence//Recordings_20241209_092922//audio_1.wav"
+
+def plot_spectra_with_db(spectra_csv, output_image, edges=None, reducer="mean", reference_wav=ZERO_NOISE_REFERENCE,
+                         reference_library=None):
     """
     Plots the spectrum data as an image with fan speed on the x-axis and frequency on the y-axis,
     converting magnitudes to decibel ratios (dB) relative to zero noise reference.
 
     Parameters:
-    - spectra_csv (str): Path to the "all_spectra.csv" file.
+    - spectra_csv (str): Path to the "all_spectra.csv" file, or a SpectraStore directory.
     - output_image (str): Path to save the output image.
+    - edges (array): Frequency bin edges (see binning.py). Default is integer-Hz bins.
+    - reducer (str): How magnitudes within a bin are combined: "mean", "max" or "rms".
+    - reference_wav (str): Zero noise recording used as the dB reference.
+    - reference_library (ReferenceLibrary or str): Calibration references (see noise_reference.py),
+      or the directory of calibration sessions to load them from. When given, the mean of its
+      profiles is the dB reference instead of reference_wav.
     """
+    import matplotlib.pyplot as plt
+
     # Load the spectra data
-    spectra_df = pd.read_csv(spectra_csv, index_col="Frequency (Hz)")
+    spectra_df = read_spectra(spectra_csv)
 
     # Prepare the output data structure
-    fan_speeds = sorted([int(col) for col in spectra_df.columns])  # Ascending fan speeds
+    # Ascending fan speeds (sub-percent sweeps have columns such as "12.5")
+    columns = sorted(spectra_df.columns, key=parse_speed)
+    fan_speeds = [parse_speed(col) for col in columns]
     frequencies = spectra_df.index.to_numpy()
-    max_frequency = int(frequencies.max()) + 1
-
-    # Initialize arrays to hold binned spectrum data
-    binned_spectra = np.zeros((max_frequency, len(fan_speeds)))
-    bin_counts = np.zeros(max_frequency)  # To count how many values contribute to each bin
-
-    # Analyze zero noise reference
-    zeroVol, zfreqs, zAmps = analyze_audio("dataSilence//Recordings_20241209_092922//audio_1.wav")
-
-    # Bin the zero noise amplitudes
-    binned_zAmps = np.zeros(max_frequency)
-    for freq, amplitude in zip(zfreqs, zAmps):
-        bin_index = int(freq)  # Integer frequency bins
-        if bin_index < max_frequency:
-            binned_zAmps[bin_index] += amplitude
-            bin_counts[bin_index] += 1
-
-    # Normalize the binned zero noise reference
-    bin_counts[bin_counts == 0] = 1  # Avoid division by zero
-    binned_zAmps /= bin_counts
-
-    # Process each fan speed column
-    for i, fan_speed in enumerate(fan_speeds):
-        spectrum = spectra_df[str(fan_speed)].to_numpy()
-
-        # Bin the spectrum into integer frequency increments
-        for freq, magnitude in zip(frequencies, spectrum):
-            bin_index = int(freq)  # Integer frequency bins
-            if bin_index < max_frequency:
-                binned_spectra[bin_index, i] += magnitude
-
-    # Convert summed magnitudes to averages and calculate dB ratios
-    averaged_spectra = binned_spectra / bin_counts[:, None]
+    if edges is None:
+        edges = linear_edges(frequencies.max())
+
+    if reference_library is not None:
+        # Precomputed calibration profiles, re-binned onto these edges if needed
+        if isinstance(reference_library, str):
+            from noise_reference import load_reference_library
+            reference_library = load_reference_library(reference_library)
+        binned_zAmps = reference_library.mean_profile(edges)
+    else:
+        # Analyze zero noise reference
+        zeroVol, zfreqs, zAmps = analyze_audio(reference_wav)
+        binned_zAmps, _ = bin_spectra(zfreqs, zAmps, edges, reducer)
+
+    # Bin every fan speed column, each with its own bin counts
+    spectrum_matrix = spectra_df[columns].to_numpy()
+    averaged_spectra, bin_counts = bin_spectra(frequencies, spectrum_matrix, edges, reducer)
+
+    # Calculate dB ratios
     spectra_db = 20 * np.log10((averaged_spectra + 1e-12) / (binned_zAmps[:, None] + 1e-12))
 
     # Trim the array to only include bins with data
-    used_bins = np.any(spectra_db > -np.inf, axis=1)
+    used_bins = (bin_counts > 0) & ~np.isnan(binned_zAmps)
     spectra_db = spectra_db[used_bins, :]
-    binned_frequencies = np.arange(max_frequency)[used_bins]
+    binned_frequencies = edges[:-1][used_bins]
 
     # Plot the spectrum as an image
     plt.figure(figsize=(10, 8))
-    plt.imshow(
-        spectra_db,
-        aspect="auto",
-        cmap="viridis",
-        extent=[min(fan_speeds), max(fan_speeds), binned_frequencies[0], binned_frequencies[-1]],
-        origin="lower",  # Makes frequencies increase going upwards
-    )
+    widths = np.diff(edges)
+    if np.allclose(widths, widths[0]):
+        plt.imshow(
+            spectra_db,
+            aspect="auto",
+            cmap="viridis",
+            extent=[min(fan_speeds), max(fan_speeds), binned_frequencies[0], binned_frequencies[-1]],
+            origin="lower",  # Makes frequencies increase going upwards
+        )
+    else:
+        # Log-spaced and octave bands are drawn at their geometric centers on a log axis
+        centers = np.sqrt(edges[:-1] * edges[1:])[used_bins]
+        plt.pcolormesh(fan_speeds, centers, spectra_db, cmap="viridis", shading="nearest")
+        plt.yscale("log")
     plt.colorbar(label="Power Ratio (dB)")
     plt.xlabel("Fan Speed")
     plt.ylabel("Frequency (Hz)")
@@ -81,7 +86,8 @@ def plot_spectra_with_db(spectra_csv, output_image):
     print(f"Spectra plot saved to {output_image}")
 
 
-# Example usage
-spectra_csv = "data3//all_spectra.csv"
-output_image = "data3//avgSpectra_plot_db.png"
-plot_spectra_with_db(spectra_csv, output_image)
+if __name__ == "__main__":
+    # Example usage
+    spectra_csv = "data3//all_spectra.csv"
+    output_image = "data3//avgSpectra_plot_db.png"
+    plot_spectra_with_db(spectra_csv, output_image)
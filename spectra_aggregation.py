@@ -1,70 +1,153 @@
 import os
 import pandas as pd
 import numpy as np
-from analyze import analyze_audio
-
-def generate_spectra_csv(volumes_csv, data_dir, output_csv):
+from analyze import analyze_recordings, format_speed
+from fft_kernel import analyze_clips
+from manifest import Manifest
+from metrics import timed
+from session_archive import ARCHIVE_SUFFIX, SessionArchive, archive_path_for
+from spectra_store import SpectraStore, is_store, read_spectra, read_volumes, write_spectra
+from streaming_stats import QuietestTakes, RunningSpectrum
+
+def recording_source(data_dir, folder, fan_speed):
+    """
+    Returns the file holding a session's recording at one fan speed: its "audio_<speed>.wav"
+    file, or the session archive if the folder has been packed (see session_archive.py).
+    """
+    audio_file = os.path.join(data_dir, folder, f"audio_{format_speed(fan_speed)}.wav")
+    if not os.path.exists(audio_file):
+        archive_path = archive_path_for(os.path.join(data_dir, folder))
+        if os.path.exists(archive_path):
+            return archive_path
+    return audio_file
+
+@timed("generate_spectra_csv")
+def generate_spectra_csv(volumes_csv, data_dir, output_csv, manifest=None, k=3):
     """
-    Generates a CSV of FFT spectra for fan speeds based on the average of the 5 quietest recordings.
+    Generates a CSV of FFT spectra for fan speeds based on the average of the k quietest recordings.
 
     Parameters:
-    - volumes_csv (str): Path to the "all_volumes.csv" file.
-    - data_dir (str): Path to the root directory containing recording folders.
-    - output_csv (str): Path to save the resulting "all_spectra.csv" file.
+    - volumes_csv (str): Path to the "all_volumes.csv" file, a SpectraStore directory, or the
+      wide volume table itself (see volume_aggregation.to_wide).
+    - data_dir (str): Path to the root directory containing recording folders, or a SpectraStore
+      directory, in which case the stored spectra are used instead of re-analyzing the recordings.
+    - output_csv (str): Path to save the resulting "all_spectra.csv" file. Any path not ending
+      in ".csv" is written as a SpectraStore instead.
+    - manifest (Manifest): If given and output_csv already exists, only fan speeds whose set of
+      quietest recordings (or the recordings themselves) changed are recomputed.
+    - k (int): Number of quietest recordings averaged at each fan speed. Default is 3.
     """
     # Load the volumes CSV
-    volumes_df = pd.read_csv(volumes_csv, index_col="Fan Speed")
+    volumes_df = read_volumes(volumes_csv)
+    store = SpectraStore(data_dir) if is_store(data_dir) else None
+    if store is not None and not store.has_sessions():
+        store = None
+
+    # Previous output, for reusing fan speeds whose inputs are unchanged
+    previous = None
+    if manifest is not None:
+        if output_csv.endswith(".csv") and os.path.exists(output_csv):
+            previous = read_spectra(output_csv)
+        elif is_store(output_csv) and SpectraStore(output_csv).has_average():
+            previous = read_spectra(output_csv)
 
     # Initialize a dictionary to store FFT data
     spectra_data = {}
+    spectrum_freqs = None
+    reused = 0
 
-    for fan_speed in volumes_df.index:
-        # Sort folders by volume for the current fan speed and pick the 5 quietest
-        sorted_volumes = volumes_df.loc[fan_speed].sort_values()
-        quietest_folders = sorted_volumes.head(3).index
-
-        print(f"Fan Speed: {fan_speed}, Quietest Folders: {list(quietest_folders)}")
-
-        # Store magnitudes for averaging
-        magnitudes_list = []
+    # Keep the k quietest folders of every fan speed, one recording at a time
+    quietest = QuietestTakes(k=k)
+    for fan_speed, volumes in volumes_df.iterrows():
+        quietest.add_row(fan_speed, volumes)
 
-        for folder in quietest_folders:
-            # Construct the path to the corresponding audio file
-            audio_file = os.path.join(data_dir, folder, f"audio_{fan_speed}.wav")
-
-            # Check if the audio file exists
-            if not os.path.exists(audio_file):
-                print(f"Warning: File not found: {audio_file}")
-                continue
-
-            # Analyze the audio file
-            _, freqs, fft_magnitude = analyze_audio(audio_file)
-
-            # Filter frequencies up to 3500 Hz
-            mask = freqs <= 3500
-            magnitudes_list.append(fft_magnitude[mask])
+    for fan_speed in volumes_df.index:
+        takes = quietest.quietest(fan_speed)
+        quietest_folders = [folder for _, folder in takes]
+
+        print(f"Fan Speed: {fan_speed}, Quietest Folders: {quietest_folders}")
+
+        # The quiet set and its volumes identify the inputs of this fan speed's average
+        inputs = {
+            "folders": quietest_folders,
+            "volumes": [volume for volume, _ in takes],
+        }
+        audio_files = [recording_source(data_dir, folder, fan_speed) for folder in quietest_folders]
+        if (previous is not None and str(fan_speed) in previous.columns
+                and manifest.spectra_inputs(fan_speed) == inputs
+                and (store is not None or all(manifest.is_current(audio_file, "spectra") for audio_file in audio_files))):
+            spectra_data[fan_speed] = previous[str(fan_speed)].to_numpy()
+            spectrum_freqs = previous.index.to_numpy()
+            reused += 1
+            continue
 
-        if not magnitudes_list:
+        # Running average of the magnitudes, so no spectra are held in memory
+        average = RunningSpectrum()
+
+        if store is not None and quietest_folders:
+            # Read the quietest sessions' spectra straight from the store
+            stored_folders = [folder for folder in quietest_folders if folder in store.sessions]
+            for folder in quietest_folders:
+                if folder not in stored_folders:
+                    print(f"Warning: Session not in store: {folder}")
+            if not np.any(store.speeds == float(fan_speed)):
+                print(f"Warning: Fan speed {fan_speed} not in store")
+            elif stored_folders:
+                _, _, freqs, stored = store.spectra(sessions=stored_folders, speed_range=(fan_speed, fan_speed))
+                mask = freqs <= 3500
+                for spectrum in stored:
+                    if not np.isnan(spectrum[0, 0]):
+                        average.add(spectrum[0, mask])
+        else:
+            existing = []
+            archived = []
+            for audio_file in audio_files:
+                # Check if the audio file exists
+                if not os.path.exists(audio_file):
+                    print(f"Warning: File not found: {audio_file}")
+                    continue
+                if audio_file.endswith(ARCHIVE_SUFFIX):
+                    with SessionArchive(audio_file) as archive:
+                        if fan_speed in archive.entries:
+                            archived.append(archive.read(fan_speed))
+                    continue
+                existing.append(audio_file)
+
+            # Analyze the audio files in one batch and filter frequencies up to 3500 Hz
+            for _, freqs, fft_magnitude in analyze_recordings(existing) + analyze_clips(archived):
+                mask = freqs <= 3500
+                average.add(fft_magnitude[mask])
+
+        if average.count == 0:
             print(f"No valid audio files found for fan speed {fan_speed}.")
             continue
 
-        # Calculate the average magnitude
-        average_magnitude = np.mean(magnitudes_list, axis=0)
+        # Store the average magnitude in the dictionary
+        spectra_data[fan_speed] = average.mean
+        spectrum_freqs = freqs[mask]
 
-        # Store the result in the dictionary
-        spectra_data[fan_speed] = average_magnitude
+        if manifest is not None:
+            manifest.record_spectra_inputs(fan_speed, inputs)
+            if store is None:
+                for audio_file in audio_files:
+                    if os.path.exists(audio_file):
+                        manifest.record(audio_file, "spectra")
 
     # Convert the spectra data to a DataFrame
-    freqs_up_to_3500 = freqs[mask]
-    spectra_df = pd.DataFrame(spectra_data, index=freqs_up_to_3500)
+    spectra_df = pd.DataFrame(spectra_data, index=spectrum_freqs)
     spectra_df.index.name = "Frequency (Hz)"
 
     # Save the DataFrame to a CSV file
-    spectra_df.to_csv(output_csv)
+    write_spectra(output_csv, spectra_df)
     print(f"Spectrum data saved to {output_csv}")
 
+    if manifest is not None:
+        manifest.save()
+        print(f"Reused {reused} of {len(spectra_data)} fan speeds from the previous run")
+
 
-volumes_csv = "data3//all_volumes.csv"
-data_dir = "data3"
-output_csv = "data3//all_spectra.csv"
-generate_spectra_csv(volumes_csv, data_dir, output_csv)
+if __name__ == "__main__":
+    volumes_csv = "data3//all_volumes.csv"
+    data_dir = "data3"
+    output_csv = "data3//all_spectra.csv"
+    generate_spectra_csv(volumes_csv, data_dir, output_csv, manifest=Manifest(data_dir + "//manifest.json"))
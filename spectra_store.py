@@ -0,0 +1,250 @@
+import os
+import json
+
+import numpy as np
+import pandas as pd
+
+from analyze import format_speed, parse_speed
+
+STORE_VERSION = 1
+
+class SpectraStore:
+    """
+    Columnar, memory-mappable store for the whole recording corpus.
+
+    A store is a directory of .npy arrays plus a small JSON index:
+    - meta.json: session names and fan speeds along the first two axes
+    - freqs.npy: frequency of each spectrum bin
+    - spectra.npy: float32 magnitudes, shape (sessions, speeds, freqs), NaN where missing
+    - volumes.npy: average volumes, shape (sessions, speeds), NaN where missing
+    - average.npy, average_speeds.npy, average_freqs.npy: the per-speed average spectra
+      (the contents of "all_spectra.csv"), shape (speeds, freqs)
+
+    Every array is opened with np.load(mmap_mode=...), so partial reads by session, speed or
+    frequency range only touch the pages they need.
+
+    Parameters:
+    - path (str): Store directory.
+    - mode (str): "r" for read-only access, "r+" to write into existing arrays.
+    """
+
+    def __init__(self, path, mode="r"):
+        self.path = path
+        self.mode = mode
+        meta_path = os.path.join(path, "meta.json")
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+            self.sessions = meta["sessions"]
+            self.speeds = np.asarray(meta["speeds"], dtype=np.float64)
+        else:
+            self.sessions = []
+            self.speeds = np.zeros(0, dtype=np.float64)
+        self._session_index = {session: i for i, session in enumerate(self.sessions)}
+        self._speed_index = {speed.item(): i for i, speed in enumerate(self.speeds)}
+
+    @classmethod
+    def create(cls, path, sessions, speeds, freqs):
+        """
+        Creates a store with NaN-filled session arrays for the given sessions, speeds and
+        frequency bins, and returns it opened for writing.
+        """
+        os.makedirs(path, exist_ok=True)
+        speeds = [parse_speed(speed) for speed in speeds]
+        with open(os.path.join(path, "meta.json"), "w") as f:
+            json.dump({"version": STORE_VERSION, "sessions": list(sessions), "speeds": speeds}, f)
+        np.save(os.path.join(path, "freqs.npy"), np.asarray(freqs, dtype=np.float64))
+
+        shape = (len(sessions), len(speeds))
+        spectra = np.lib.format.open_memmap(os.path.join(path, "spectra.npy"), mode="w+",
+                                            dtype=np.float32, shape=shape + (len(freqs),))
+        spectra[:] = np.nan
+        spectra.flush()
+        del spectra
+        np.save(os.path.join(path, "volumes.npy"), np.full(shape, np.nan))
+        return cls(path, mode="r+")
+
+    def _load(self, name):
+        return np.load(os.path.join(self.path, name), mmap_mode=self.mode)
+
+    def has_sessions(self):
+        return os.path.exists(os.path.join(self.path, "spectra.npy"))
+
+    def has_average(self):
+        return os.path.exists(os.path.join(self.path, "average.npy"))
+
+    @property
+    def freqs(self):
+        return self._load("freqs.npy")
+
+    def write_session(self, session, values, volumes, freqs, spectral_data):
+        """
+        Writes one session's volumes and spectra into the store.
+        Spectra are cut down to the store's frequency bins, which must be a prefix of freqs.
+        """
+        store_freqs = self.freqs
+        n_freqs = len(store_freqs)
+        if len(freqs) < n_freqs or not np.allclose(freqs[:n_freqs], store_freqs):
+            raise ValueError(f"Frequency bins of {session} do not match the store")
+
+        i = self._session_index[session]
+        columns = [self._speed_index[value] for value in values]
+        spectra = self._load("spectra.npy")
+        spectra[i, columns, :] = np.asarray(spectral_data)[:, :n_freqs]
+        spectra.flush()
+
+        # volumes.npy is small, so rewrite it rather than keeping it mapped
+        all_volumes = np.load(os.path.join(self.path, "volumes.npy"))
+        all_volumes[i, columns] = volumes
+        np.save(os.path.join(self.path, "volumes.npy"), all_volumes)
+
+    def spectra(self, sessions=None, speed_range=None, freq_range=None):
+        """
+        Returns (sessions, speeds, freqs, spectra) for the requested subset.
+
+        Parameters:
+        - sessions (list): Session names to read. Default is all sessions.
+        - speed_range (tuple): Inclusive (min, max) fan speed. Default is all speeds.
+        - freq_range (tuple): Inclusive (min, max) frequency in Hz. Default is all bins.
+        """
+        freqs = np.asarray(self.freqs)
+        speed_slice, freq_slice = _range_slice(self.speeds, speed_range), _range_slice(freqs, freq_range)
+        spectra = self._load("spectra.npy")
+        if sessions is None:
+            sessions = self.sessions
+            data = spectra[:, speed_slice, freq_slice]
+        else:
+            # Slice each session separately so only the requested pages are read
+            data = np.stack([spectra[self._session_index[s], speed_slice, freq_slice] for s in sessions])
+        return list(sessions), self.speeds[speed_slice], freqs[freq_slice], data
+
+    def volumes_frame(self):
+        """
+        Returns the volume table in the layout of "all_volumes.csv":
+        one row per fan speed and one column per session.
+        """
+        volumes = np.load(os.path.join(self.path, "volumes.npy"))
+        df = pd.DataFrame(volumes.T, index=pd.Index([parse_speed(speed) for speed in self.speeds], name="Fan Speed"),
+                          columns=self.sessions)
+        return df
+
+    def write_average(self, speeds, freqs, average):
+        """
+        Stores the per-speed average spectra, shape (speeds, freqs).
+        """
+        os.makedirs(self.path, exist_ok=True)
+        np.save(os.path.join(self.path, "average_speeds.npy"), np.asarray(speeds, dtype=np.float64))
+        np.save(os.path.join(self.path, "average_freqs.npy"), np.asarray(freqs, dtype=np.float64))
+        np.save(os.path.join(self.path, "average.npy"), np.asarray(average, dtype=np.float32))
+
+    def average(self, speed_range=None, freq_range=None):
+        """
+        Returns (speeds, freqs, average) for the requested speed and frequency ranges.
+        """
+        speeds = self._load("average_speeds.npy")
+        freqs = self._load("average_freqs.npy")
+        speed_slice, freq_slice = _range_slice(speeds, speed_range), _range_slice(freqs, freq_range)
+        return np.asarray(speeds[speed_slice]), np.asarray(freqs[freq_slice]), self._load("average.npy")[speed_slice, freq_slice]
+
+    def average_frame(self, speed_range=None, freq_range=None):
+        """
+        Returns the average spectra in the layout of "all_spectra.csv":
+        one row per frequency and one column per fan speed.
+        """
+        speeds, freqs, average = self.average(speed_range, freq_range)
+        df = pd.DataFrame(np.asarray(average).T, index=pd.Index(freqs, name="Frequency (Hz)"),
+                          columns=[format_speed(speed) for speed in speeds])
+        return df
+
+def _range_slice(axis, value_range):
+    # Axes are sorted, so an inclusive value range maps to a contiguous slice
+    if value_range is None:
+        return slice(None)
+    low, high = value_range
+    return slice(np.searchsorted(axis, low, side="left"), np.searchsorted(axis, high, side="right"))
+
+def is_store(path):
+    """
+    Returns True if path is a SpectraStore directory.
+    """
+    return os.path.isdir(path) and (os.path.exists(os.path.join(path, "meta.json"))
+                                    or os.path.exists(os.path.join(path, "average.npy")))
+
+def read_volumes(path):
+    """
+    Reads the volume table from "all_volumes.csv" or from a SpectraStore.
+    An already loaded table (e.g. from volume_aggregation.to_wide) is returned as is.
+    """
+    if isinstance(path, pd.DataFrame):
+        return path
+    if is_store(path):
+        return SpectraStore(path).volumes_frame()
+    return pd.read_csv(path, index_col="Fan Speed")
+
+def read_spectra(path, speed_range=None, freq_range=None):
+    """
+    Reads the average spectra table from "all_spectra.csv" or from a SpectraStore.
+    """
+    if is_store(path):
+        return SpectraStore(path).average_frame(speed_range, freq_range)
+    spectra_df = pd.read_csv(path, index_col="Frequency (Hz)")
+    if speed_range is not None:
+        spectra_df = spectra_df[[col for col in spectra_df.columns if speed_range[0] <= parse_speed(col) <= speed_range[1]]]
+    if freq_range is not None:
+        spectra_df = spectra_df.loc[freq_range[0]:freq_range[1]]
+    return spectra_df
+
+def write_spectra(path, spectra_df):
+    """
+    Writes the average spectra table to a .csv file, or into a SpectraStore for any other path.
+    """
+    if path.endswith(".csv"):
+        spectra_df.to_csv(path)
+    else:
+        speeds = [parse_speed(col) for col in spectra_df.columns]
+        SpectraStore(path).write_average(speeds, spectra_df.index.to_numpy(), spectra_df.to_numpy().T)
+
+def build_store(data_dir, store_path, max_freq=3500):
+    """
+    Builds a SpectraStore from the per-folder "analysis_results.csv" and "spectral_data.npz" files.
+
+    Parameters:
+    - data_dir (str): Path to the root directory containing recording folders.
+    - store_path (str): Store directory to create.
+    - max_freq (float): Highest frequency kept in the store. Default is 3500 Hz.
+    """
+    folders = [folder for folder in sorted(os.listdir(data_dir))
+               if os.path.exists(os.path.join(data_dir, folder, "spectral_data.npz"))]
+    if not folders:
+        raise FileNotFoundError(f"No spectral_data.npz files found in {data_dir}")
+
+    # Speeds and frequency bins come from the folders themselves
+    speeds = set()
+    freqs = None
+    for folder in folders:
+        with np.load(os.path.join(data_dir, folder, "spectral_data.npz")) as npz:
+            speeds.update(parse_speed(value) for value in npz["values"])
+            if freqs is None:
+                freqs = npz["freqs"][npz["freqs"] <= max_freq]
+
+    store = SpectraStore.create(store_path, folders, sorted(speeds), freqs)
+    for folder in folders:
+        with np.load(os.path.join(data_dir, folder, "spectral_data.npz")) as npz:
+            values = npz["values"]
+            csv_path = os.path.join(data_dir, folder, "analysis_results.csv")
+            if os.path.exists(csv_path):
+                volumes = pd.read_csv(csv_path).set_index("Value").loc[values, "Average Volume"].to_numpy()
+            else:
+                volumes = np.full(len(values), np.nan)
+            try:
+                store.write_session(folder, values, volumes, npz["freqs"], npz["spectral_data"])
+            except ValueError as e:
+                print(f"Skipping {folder}: {e}")
+                continue
+        print(f"Added {folder} to {store_path}")
+    return store
+
+
+if __name__ == "__main__":
+    data_dir = "data3"
+    build_store(data_dir, os.path.join(data_dir, "spectra_store"))
@@ -1,59 +1,39 @@
-import os
-import re
 import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sns
-from scipy.io import wavfile
+
+from analyze import analyze_audio, list_recordings
+from stft import render_spectrogram, session_spectrogram
 
 def compute_fft_magnitude(file_path):
     """
     Computes the FFT magnitude spectrum for a .wav file.
     Returns the frequency bins and corresponding magnitudes.
+    Shares analyze.analyze_audio's spectrum cache, so each file is only transformed once.
     """
-    sample_rate, data = wavfile.read(file_path)
-    
-    # Convert to mono if stereo
-    if len(data.shape) == 2:
-        data = data.mean(axis=1)
-    
-    # Compute FFT
-    n = len(data)
-    fft_magnitude = np.abs(np.fft.rfft(data)) / n
-    freqs = np.fft.rfftfreq(n, d=1/sample_rate)
-    
+    _, freqs, fft_magnitude = analyze_audio(file_path)
     return freqs, fft_magnitude
 
-def analyze_folder_spectrogram(folder_path):
+def analyze_folder_spectrogram(folder_path, output_image=None):
+    from render import render_heatmap
+
     fan_speeds = []
     spectra = {}
 
-    # Loop through each .wav file in the specified folder
-    for filename in sorted(os.listdir(folder_path)):
-        if filename.endswith(".wav"):
-            # Extract fan speed from filename
-            match = re.search(r"audio_(\d+).wav", filename)
-            if match:
-                fan_speed = int(match.group(1))
-                file_path = os.path.join(folder_path, filename)
-                
-                # Compute FFT and store the spectrum
-                freqs, fft_magnitude = compute_fft_magnitude(file_path)
-                
-                # Add the fan speed and spectrum data
-                fan_speeds.append(fan_speed)
-                spectra[fan_speed] = fft_magnitude
+    # Loop through each "audio_<speed>.wav" file in the specified folder (speeds may be fractional)
+    for fan_speed, file_path in list_recordings(folder_path):
+        # Compute FFT and store the spectrum
+        freqs, fft_magnitude = compute_fft_magnitude(file_path)
+
+        # Add the fan speed and spectrum data
+        fan_speeds.append(fan_speed)
+        spectra[fan_speed] = fft_magnitude
 
     # Sort fan speeds and reformat spectra data for plotting
     fan_speeds = sorted(spectra.keys())
     spectrum_matrix = np.array([spectra[speed] for speed in fan_speeds])
 
-    # Create spectrogram plot
-    plt.figure(figsize=(12, 8))
-    sns.heatmap(spectrum_matrix.T, xticklabels=fan_speeds, yticklabels=freqs, cmap="viridis", cbar_kws={'label': 'Intensity'})
-    plt.xlabel("Fan Speed")
-    plt.ylabel("Frequency (Hz)")
-    plt.title("Spectrogram by Fan Speed")
-    plt.show()
+    # Create spectrogram plot, pooled down to the figure's resolution
+    render_heatmap(spectrum_matrix.T, fan_speeds, freqs, output_image, xlabel="Fan Speed",
+                   ylabel="Frequency (Hz)", title="Spectrogram by Fan Speed", cbar_label="Intensity")
 
 if __name__ == "__main__":
     folder_path = "data2\\Recordings_20241031_001603"  # Replace with the path to your folder
@@ -77,15 +57,6 @@ if __name__ == "__main__":
     # ax.set_aspect(abs((xright-xleft)/(ybottom-ytop))*ratio)
     # plt.show()
 
-    data = []
-
-    for recording in sorted(os.listdir(folder_path)):
-        if recording.endswith(".wav"):
-            print(f"analyzing {recording}")
-            sample_rate, tempData = wavfile.read(folder_path + "\\" + recording)
-            data = data + list(tempData)
-            
-    #sample_rate, data = wavfile.read("data2\Recordings_20241031_001603\\audio_75.wav")
-    plt.specgram(data, Fs=sample_rate, NFFT=21, noverlap=0, scale='dB')
-    plt.show()
-
+    # Stitch the whole session into one buffer and run a batched STFT over it
+    times, freqs, magnitudes, boundaries = session_spectrogram(folder_path, nperseg=4096)
+    render_spectrogram(times, freqs, magnitudes, boundaries=boundaries, fmax=5000)
@@ -0,0 +1,174 @@
+import os
+
+import numpy as np
+from scipy.io import wavfile
+from scipy.signal import get_window
+
+from analyze import list_recordings
+from session_archive import SessionArchive, is_archive, session_folder
+
+def load_session_signal(folder_path, buffer_path=None):
+    """
+    Stitches every recording of a session into one preallocated signal, in fan speed order.
+
+    Files are memory-mapped and copied straight into place, so no intermediate lists or
+    growing arrays are created. Mono int16 sessions stay int16; multi-channel recordings are
+    averaged into float32.
+
+    Parameters:
+    - folder_path (str): Path to a "Recordings_*" folder or a session archive.
+    - buffer_path (str): If given, the signal is a memory-mapped .npy file at this path rather
+      than an in-memory array, for sessions larger than RAM.
+
+    Returns:
+    - sample_rate, signal, boundaries: boundaries is a list of (fan speed, start sample) pairs.
+    """
+    # Map every recording first to size the buffer
+    if is_archive(folder_path):
+        with SessionArchive(folder_path) as archive:
+            clips = [(value, archive.read(value)) for value in archive.speeds]
+    else:
+        clips = [(value, wavfile.read(file_path, mmap=True)) for value, file_path in sorted(list_recordings(folder_path))]
+    if not clips:
+        raise FileNotFoundError(f"No recordings found in {folder_path}")
+
+    sources = []
+    sample_rate = None
+    for value, (rate, data) in clips:
+        if sample_rate is None:
+            sample_rate = rate
+        elif rate != sample_rate:
+            raise ValueError(f"Fan speed {value} in {folder_path} has sample rate {rate}, expected {sample_rate}")
+        sources.append((value, data))
+
+    total = sum(data.shape[0] for _, data in sources)
+    mono_int16 = all(len(data.shape) == 1 and data.dtype == np.int16 for _, data in sources)
+    dtype = np.int16 if mono_int16 else np.float32
+    if buffer_path is None:
+        signal = np.empty(total, dtype=dtype)
+    else:
+        signal = np.lib.format.open_memmap(buffer_path, mode="w+", dtype=dtype, shape=(total,))
+
+    boundaries = []
+    position = 0
+    for value, data in sources:
+        n = data.shape[0]
+        if len(data.shape) == 2:
+            signal[position:position + n] = data.mean(axis=1)
+        else:
+            signal[position:position + n] = data
+        boundaries.append((value, position))
+        position += n
+    return sample_rate, signal, boundaries
+
+def stft(signal, sample_rate, nperseg=4096, hop=None, nfft=None, window="hann", chunk_frames=256):
+    """
+    Batched, windowed short-time Fourier transform magnitude.
+
+    Frames are strided views into the signal (no copies); they are windowed and transformed
+    chunk_frames at a time into a preallocated float32 output, so memory is bounded by the
+    output size. Magnitudes are normalized by the window sum, so a pure tone reads the same
+    amplitude as in analyze.analyze_audio.
+
+    Parameters:
+    - signal (array): 1-D signal (int16 or float).
+    - sample_rate (int): Sample rate in Hz.
+    - nperseg (int): Window length in samples. Default is 4096.
+    - hop (int): Step between frames. Default is nperseg // 2.
+    - nfft (int): FFT size (>= nperseg, zero-padded). Default is nperseg.
+    - window (str or tuple): Any window accepted by scipy.signal.get_window. Default is "hann".
+    - chunk_frames (int): Frames transformed per batch. Default is 256.
+
+    Returns:
+    - times (frame centers in seconds), freqs, magnitudes of shape (frames, freqs) as float32.
+    """
+    hop = hop or nperseg // 2
+    nfft = nfft or nperseg
+    if len(signal) < nperseg:
+        raise ValueError(f"Signal of {len(signal)} samples is shorter than one window ({nperseg})")
+
+    window_values = get_window(window, nperseg).astype(np.float32)
+    scale = np.float32(window_values.sum())
+    frames = np.lib.stride_tricks.sliding_window_view(signal, nperseg)[::hop]
+    n_frames = len(frames)
+
+    magnitudes = np.empty((n_frames, nfft // 2 + 1), dtype=np.float32)
+    for start in range(0, n_frames, chunk_frames):
+        chunk = frames[start:start + chunk_frames].astype(np.float32) * window_values
+        magnitudes[start:start + len(chunk)] = np.abs(np.fft.rfft(chunk, n=nfft, axis=1)) / scale
+
+    times = (np.arange(n_frames) * hop + nperseg / 2) / sample_rate
+    freqs = np.fft.rfftfreq(nfft, d=1/sample_rate)
+    return times, freqs, magnitudes
+
+def session_spectrogram(folder_path, nperseg=4096, hop=None, nfft=None, window="hann", use_cache=True):
+    """
+    Computes (or loads from the folder's cache file) the spectrogram of a whole session.
+
+    The result is saved as "spectrogram_<nperseg>_<hop>_<nfft>_<window>.npz" in the folder and
+    reused as long as it is newer than every recording. For a session archive the cache file
+    goes in its session folder.
+
+    Returns:
+    - times, freqs, magnitudes (see stft), and boundaries as (fan speed, start time in seconds) pairs.
+    """
+    hop = hop or nperseg // 2
+    nfft = nfft or nperseg
+    if is_archive(folder_path):
+        cache_dir = session_folder(folder_path)
+        os.makedirs(cache_dir, exist_ok=True)
+        recordings = [(None, folder_path)]
+    else:
+        cache_dir = folder_path
+        recordings = list_recordings(folder_path)
+    cache_file = os.path.join(cache_dir, f"spectrogram_{nperseg}_{hop}_{nfft}_{window}.npz")
+    if use_cache and os.path.exists(cache_file):
+        newest = max(os.path.getmtime(file_path) for _, file_path in recordings)
+        if os.path.getmtime(cache_file) > newest:
+            with np.load(cache_file) as cached:
+                boundaries = [(value.item(), start.item()) for value, start in zip(cached["speeds"], cached["starts"])]
+                return cached["times"], cached["freqs"], cached["magnitudes"], boundaries
+
+    sample_rate, signal, boundaries = load_session_signal(folder_path)
+    times, freqs, magnitudes = stft(signal, sample_rate, nperseg, hop, nfft, window)
+    boundaries = [(value, start / sample_rate) for value, start in boundaries]
+    if use_cache:
+        np.savez(cache_file, times=times, freqs=freqs, magnitudes=magnitudes,
+                 speeds=[value for value, _ in boundaries], starts=[start for _, start in boundaries])
+    return times, freqs, magnitudes, boundaries
+
+def render_spectrogram(times, freqs, magnitudes, output_image=None, boundaries=None, fmax=None):
+    """
+    Draws a spectrogram in dB with time on the x-axis, optionally labelling where each
+    fan speed's recording starts. Saves to output_image if given, otherwise shows it.
+    The magnitudes are max-pooled to the figure's pixel resolution first (see render.py).
+    """
+    import matplotlib.pyplot as plt
+    from render import pool_axis
+
+    if fmax is not None:
+        keep = freqs <= fmax
+        freqs, magnitudes = freqs[keep], magnitudes[:, keep]
+    magnitudes, _ = pool_axis(magnitudes, 1200, axis=0)
+    magnitudes, _ = pool_axis(magnitudes, 800, axis=1)
+
+    plt.figure(figsize=(12, 8))
+    plt.imshow(20 * np.log10(magnitudes.T + 1e-12), aspect="auto", origin="lower", cmap="viridis",
+               extent=[times[0], times[-1], freqs[0], freqs[-1]])
+    plt.colorbar(label="Magnitude (dB)")
+    if boundaries:
+        # Label every tenth recording so the ticks stay readable
+        ticks = boundaries[::max(1, len(boundaries) // 10)]
+        plt.xticks([start for _, start in ticks], [str(value) for value, _ in ticks])
+        plt.xlabel("Fan Speed (start of recording)")
+    else:
+        plt.xlabel("Time (s)")
+    plt.ylabel("Frequency (Hz)")
+    plt.title("Session Spectrogram")
+    plt.tight_layout()
+    if output_image is not None:
+        plt.savefig(output_image)
+        plt.close()
+        print(f"Spectrogram saved to {output_image}")
+    else:
+        plt.show()
@@ -0,0 +1,103 @@
+import numpy as np
+from scipy.io import wavfile
+
+from fft_cache import get_default_cache
+
+def iter_wav_blocks(file_path, block_size=65536):
+    """
+    Yields a .wav file as consecutive mono float64 blocks without loading the whole file.
+
+    The file is memory-mapped, so only the block currently being converted is resident.
+
+    Parameters:
+    - file_path (str): Path to the .wav file.
+    - block_size (int): Number of samples per block. Default is 65536.
+
+    Yields:
+    - sample_rate, block
+    """
+    sample_rate, data = wavfile.read(file_path, mmap=True)
+    for start in range(0, data.shape[0], block_size):
+        block = data[start:start + block_size]
+        # Convert each block to mono separately to avoid a full-length float copy
+        if len(block.shape) == 2:
+            block = block.mean(axis=1)
+        else:
+            block = block.astype(np.float64)
+        yield sample_rate, block
+
+def analyze_audio_streaming(file_path, block_size=65536, nperseg=8192, use_cache=True):
+    """
+    Streaming version of analyze.analyze_audio for recordings of any length.
+
+    The file is read in fixed-size blocks and reduced on the fly, so memory stays flat no matter
+    how long the recording is. The spectrum is a Welch average of Hann-windowed segments with
+    50% overlap, giving nperseg // 2 + 1 bins at a resolution of sample_rate / nperseg. Magnitudes
+    are normalized by the window sum, so a pure tone reads the same amplitude as in
+    analyze_audio, while the noise floor is much smoother because of the averaging (though
+    higher per bin, since each bin is wider).
+
+    Parameters:
+    - file_path (str): Path to the .wav file.
+    - block_size (int): Number of samples read per block. Default is 65536.
+    - nperseg (int): Welch segment length. Default is 8192.
+    - use_cache (bool): Whether to go through the spectrum cache. Default is True.
+
+    Returns:
+    - average_volume, freqs, fft_magnitude
+    """
+    if use_cache:
+        params = {"analysis": "analyze_audio_streaming", "nperseg": nperseg}
+        return get_default_cache().get_or_compute(
+            file_path, lambda path: _analyze_audio_streaming(path, block_size, nperseg), params=params)
+    return _analyze_audio_streaming(file_path, block_size, nperseg)
+
+def _analyze_audio_streaming(file_path, block_size, nperseg):
+    hop = nperseg // 2
+    window = np.hanning(nperseg)
+    scale = window.sum()
+
+    abs_sum = 0.0
+    n_samples = 0
+    magnitude_sum = np.zeros(nperseg // 2 + 1)
+    n_segments = 0
+    carry = np.zeros(0)  # Samples left over from the previous block that start an incomplete segment
+    sample_rate = None
+
+    for sample_rate, block in iter_wav_blocks(file_path, block_size):
+        abs_sum += np.abs(block).sum()
+        n_samples += len(block)
+
+        buffer = np.concatenate([carry, block])
+        if len(buffer) >= nperseg:
+            segments = np.lib.stride_tricks.sliding_window_view(buffer, nperseg)[::hop]
+            magnitude_sum += np.abs(np.fft.rfft(segments * window, axis=1)).sum(axis=0)
+            n_segments += len(segments)
+            carry = buffer[len(segments) * hop:]
+        else:
+            carry = buffer
+
+    if sample_rate is None:
+        raise ValueError(f"{file_path} contains no samples")
+
+    if n_segments == 0:
+        # Recording is shorter than one segment, so use a single zero-padded segment
+        segment = np.zeros(nperseg)
+        segment[:len(carry)] = carry
+        magnitude_sum += np.abs(np.fft.rfft(segment * window))
+        n_segments = 1
+
+    average_volume = abs_sum / n_samples
+    freqs = np.fft.rfftfreq(nperseg, d=1/sample_rate)
+    fft_magnitude = magnitude_sum / n_segments / scale
+
+    return average_volume, freqs, fft_magnitude
+
+
+if __name__ == "__main__":
+    import sys
+
+    for file_path in sys.argv[1:]:
+        average_volume, freqs, fft_magnitude = analyze_audio_streaming(file_path)
+        peak = freqs[np.argmax(fft_magnitude[1:]) + 1]
+        print(f"{file_path}: average volume {average_volume:.2f}, strongest tone {peak:.1f} Hz")
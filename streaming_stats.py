@@ -0,0 +1,227 @@
+import math
+import bisect
+
+import numpy as np
+import pandas as pd
+
+class QuietestTakes:
+    """
+    Keeps the k quietest recordings of every fan speed, one recording at a time.
+
+    Each fan speed holds a bounded, sorted list of at most k (volume, session) pairs, so memory
+    does not grow with the number of sessions. Ties are broken by session name, which matches
+    sorting a row of "all_volumes.csv" (whose columns are sorted folder names) by volume.
+
+    Parameters:
+    - k (int): Number of takes kept per fan speed. Default is 3.
+    """
+
+    def __init__(self, k=3):
+        self.k = k
+        self.takes = {}
+
+    def add(self, speed, volume, session):
+        """
+        Offers one recording; NaN volumes (missing recordings) are ignored.
+        """
+        if volume is None or np.isnan(volume):
+            return
+        takes = self.takes.setdefault(speed, [])
+        entry = (float(volume), session)
+        if len(takes) == self.k and entry >= takes[-1]:
+            return
+        bisect.insort(takes, entry)
+        del takes[self.k:]
+
+    def add_row(self, speed, volumes):
+        """
+        Offers every session of one row of the wide volume table (a Series indexed by session).
+        """
+        for session, volume in volumes.items():
+            self.add(speed, volume, session)
+
+    def merge(self, other):
+        """
+        Adds the takes kept by another QuietestTakes, e.g. from another shard of the corpus.
+        """
+        for speed, takes in other.takes.items():
+            for volume, session in takes:
+                self.add(speed, volume, session)
+        return self
+
+    def quietest(self, speed):
+        """
+        Returns the kept (volume, session) pairs of a fan speed, quietest first.
+        """
+        return list(self.takes.get(speed, []))
+
+class RunningSpectrum:
+    """
+    Running mean and variance of spectra (Welford's algorithm), updated one spectrum at a time.
+
+    Only the count, the mean and the sum of squared deviations are stored, and two running
+    spectra computed on different shards can be merged exactly (Chan et al.).
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = None
+        self._m2 = None
+
+    def add(self, spectrum):
+        spectrum = np.asarray(spectrum, dtype=np.float64)
+        if self.mean is None:
+            self.mean = np.zeros_like(spectrum)
+            self._m2 = np.zeros_like(spectrum)
+        self.count += 1
+        delta = spectrum - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (spectrum - self.mean)
+        return self
+
+    def merge(self, other):
+        if other.count == 0:
+            return self
+        if self.count == 0:
+            self.count, self.mean, self._m2 = other.count, other.mean.copy(), other._m2.copy()
+            return self
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean = self.mean + delta * (other.count / count)
+        self._m2 = self._m2 + other._m2 + delta ** 2 * (self.count * other.count / count)
+        self.count = count
+        return self
+
+    def variance(self, ddof=1):
+        """
+        Per-bin variance; NaN while there are not more than ddof spectra.
+        """
+        if self.count <= ddof:
+            return None if self.mean is None else np.full_like(self.mean, np.nan)
+        return self._m2 / (self.count - ddof)
+
+    def std(self, ddof=1):
+        variance = self.variance(ddof)
+        return None if variance is None else np.sqrt(variance)
+
+class QuantileSketch:
+    """
+    Mergeable quantile sketch with a relative accuracy guarantee (DDSketch).
+
+    Positive values are counted in logarithmically spaced buckets, so any quantile is
+    returned within relative_accuracy of the exact value while the number of buckets only
+    depends on the range of the values (a few hundred for the volumes of a fan sweep), not on
+    how many were added. The minimum and maximum are tracked exactly.
+
+    Parameters:
+    - relative_accuracy (float): Maximum relative error of a quantile. Default is 0.5%.
+    """
+
+    def __init__(self, relative_accuracy=0.005):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.buckets = {}
+        self.zero_count = 0
+        self.count = 0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value, count=1):
+        value = float(value)
+        if math.isnan(value):
+            return
+        if value <= 0:
+            self.zero_count += count
+        else:
+            index = math.ceil(math.log(value) / self._log_gamma)
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.count += count
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def merge(self, other):
+        if other.gamma != self.gamma:
+            raise ValueError("Cannot merge sketches with different relative accuracies")
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    def quantile(self, q):
+        """
+        Returns the q-quantile (0 <= q <= 1), or NaN for an empty sketch.
+        """
+        if self.count == 0:
+            return math.nan
+        if q <= 0:
+            return self.min
+        if q >= 1:
+            return self.max
+
+        rank = q * (self.count - 1)
+        if rank < self.zero_count:
+            return max(self.min, 0.0)
+        seen = self.zero_count
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen > rank:
+                estimate = 2 * self.gamma ** index / (self.gamma + 1)
+                return min(max(estimate, self.min), self.max)
+        return self.max
+
+class VolumeStats:
+    """
+    Streaming per-fan-speed summary of the recorded volumes: a quantile sketch per fan speed
+    plus the k quietest takes, both updated one recording at a time and mergeable across shards.
+    """
+
+    def __init__(self, k=3, relative_accuracy=0.005):
+        self.relative_accuracy = relative_accuracy
+        self.sketches = {}
+        self.quietest = QuietestTakes(k)
+
+    def add(self, speed, volume, session=None):
+        sketch = self.sketches.get(speed)
+        if sketch is None:
+            sketch = self.sketches[speed] = QuantileSketch(self.relative_accuracy)
+        sketch.add(volume)
+        if session is not None:
+            self.quietest.add(speed, volume, session)
+
+    def add_table(self, long_df):
+        """
+        Adds every row of a long volume table (Session, Value, Average Volume), see
+        volume_aggregation.load_session_tables.
+        """
+        sessions = long_df["Session"] if "Session" in long_df else [None] * len(long_df)
+        for session, speed, volume in zip(sessions, long_df["Value"], long_df["Average Volume"]):
+            self.add(speed, volume, session)
+        return self
+
+    def merge(self, other):
+        for speed, sketch in other.sketches.items():
+            if speed in self.sketches:
+                self.sketches[speed].merge(sketch)
+            else:
+                self.sketches[speed] = QuantileSketch(sketch.relative_accuracy).merge(sketch)
+        self.quietest.merge(other.quietest)
+        return self
+
+    def frame(self, quantiles=(0.25, 0.5, 0.75)):
+        """
+        Returns a table indexed by fan speed with the count, minimum, the given quantiles and the
+        maximum of the volumes.
+        """
+        speeds = sorted(self.sketches)
+        data = {
+            "Count": [self.sketches[speed].count for speed in speeds],
+            "Minimum": [self.sketches[speed].min for speed in speeds],
+        }
+        for q in quantiles:
+            data[f"Q{q * 100:g}"] = [self.sketches[speed].quantile(q) for speed in speeds]
+        data["Maximum"] = [self.sketches[speed].max for speed in speeds]
+        return pd.DataFrame(data, index=pd.Index(speeds, name="Value"))
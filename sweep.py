@@ -0,0 +1,247 @@
+import os
+import json
+import time
+import asyncio
+from datetime import datetime
+
+import numpy as np
+from scipy.io.wavfile import write
+
+from analyze import format_speed, save_folder_results
+from live import analyze_clip
+from session_archive import SessionArchiveWriter, archive_path_for
+
+FANCONTROL_SENSOR_FILE = "C:\\Users\\Denis\\Downloads\\Apps\\FanControl\\Configurations\\testing.sensor"
+
+class FileFanController:
+    """
+    Sets the fan speed by writing it to a FanControl "file sensor", as main.recording_script does.
+    """
+
+    def __init__(self, sensor_file=FANCONTROL_SENSOR_FILE):
+        self.sensor_file = sensor_file
+
+    def set_speed(self, value):
+        with open(self.sensor_file, 'w') as file:
+            file.write(str(value))
+
+class MemoryFanController:
+    """
+    In-memory stand-in for FanControl that records every speed it is given.
+    """
+
+    def __init__(self):
+        self.speed = None
+        self.history = []
+
+    def set_speed(self, value):
+        self.speed = value
+        self.history.append((time.perf_counter(), value))
+
+class SoundDeviceCapture:
+    """
+    Blocking capture of one clip with sounddevice, as in main.record_audio.
+    """
+
+    def __init__(self, sample_rate=44100, channels=1):
+        self.sample_rate = sample_rate
+        self.channels = channels
+
+    def settle(self, max_wait):
+        time.sleep(max_wait)
+        return max_wait
+
+    def capture(self, duration):
+        import sounddevice as sd
+
+        audio_data = sd.rec(int(duration * self.sample_rate), samplerate=self.sample_rate,
+                            channels=self.channels, dtype='int16')
+        sd.wait()
+        return audio_data
+
+class LiveCapture:
+    """
+    Capture from a running live.LiveRecorder, which can also end the settle wait early.
+    """
+
+    def __init__(self, recorder, settle_early=True):
+        self.recorder = recorder
+        self.sample_rate = recorder.sample_rate
+        self.settle_early = settle_early
+
+    def settle(self, max_wait):
+        if not self.settle_early:
+            time.sleep(max_wait)
+            return max_wait
+        return self.recorder.settle(max_wait=max_wait)
+
+    def capture(self, duration):
+        return self.recorder.capture(duration)
+
+def sweep_plan(kind="ascending", start=0, stop=100, step=1, repeats=1, seed=None):
+    """
+    Builds the list of sweeps to run, one list of fan speeds per recording session.
+
+    Parameters:
+    - kind (str): "ascending", "descending", "alternating" (ascending and descending passes
+      in turn) or "random" (a new shuffled order for every pass).
+    - start, stop (float): First and last fan speed, inclusive.
+    - step (float): Speed increment; may be below 1 for sub-percent sweeps.
+    - repeats (int): Number of sessions. Default is 1.
+    - seed (int): Seed for the random order.
+    """
+    n_steps = int(round((stop - start) / step)) + 1
+    speeds = [float(round(value, 6)) for value in start + step * np.arange(n_steps)]
+    speeds = [int(value) if value.is_integer() else value for value in speeds]
+
+    rng = np.random.default_rng(seed)
+    plans = []
+    for repeat in range(repeats):
+        if kind == "ascending":
+            plans.append(list(speeds))
+        elif kind == "descending":
+            plans.append(speeds[::-1])
+        elif kind == "alternating":
+            plans.append(list(speeds) if repeat % 2 == 0 else speeds[::-1])
+        elif kind == "random":
+            plans.append([speeds[i] for i in rng.permutation(len(speeds))])
+        else:
+            raise ValueError(f"Unknown sweep kind: {kind}")
+    return plans
+
+def create_session_folder(data_dir):
+    """
+    Creates a "Recordings_<timestamp>" folder in data_dir, adding a suffix if it already exists.
+    """
+    base = os.path.join(data_dir, f"Recordings_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+    folder_name = base
+    suffix = 1
+    while os.path.exists(folder_name):
+        folder_name = f"{base}_{suffix}"
+        suffix += 1
+    os.makedirs(folder_name)
+    return folder_name
+
+def _write_and_analyze(filename, sample_rate, clip, analyze, archive=None, value=None):
+    start = time.perf_counter()
+    if archive is None:
+        write(filename, sample_rate, clip)
+    else:
+        archive.add(value, clip, sample_rate)
+    write_time = time.perf_counter() - start
+
+    result = None
+    if analyze:
+        start = time.perf_counter()
+        result = analyze_clip(clip, sample_rate)
+    return result, write_time, (time.perf_counter() - start) if analyze else 0.0
+
+async def run_sweep(plan, controller, capture, folder_name, settle_time=3.0, duration=5.0, analyze=True, archive=False,
+                    max_pending=4):
+    """
+    Runs one sweep, overlapping the disk write and analysis of each step with the settling and
+    capture of the next one.
+
+    Each step's timing is appended to "sweep_log.jsonl" in the folder as soon as its write
+    finishes. With analyze=True the folder's "analysis_results.csv" and "spectral_data.npz" are
+    written at the end, so no separate analysis pass is needed. If a step fails or the sweep is
+    interrupted, the clips already handed off are still written and logged, and the archive is
+    closed with the speeds recorded so far.
+
+    Parameters:
+    - plan (list): Fan speeds in the order they are recorded.
+    - controller: FileFanController, MemoryFanController or anything with set_speed(value).
+    - capture: SoundDeviceCapture, LiveCapture or anything with sample_rate, settle(max_wait)
+      and capture(duration).
+    - folder_name (str): Folder the recordings are saved in.
+    - settle_time (float): Maximum settle time after each speed change, in seconds.
+    - duration (float): Length of each recording, in seconds.
+    - analyze (bool): Whether to analyze each clip in the background. Default is True.
+    - archive (bool): Write the clips into one session archive next to the folder (see
+      session_archive.py) instead of one .wav file per speed. Default is False.
+    - max_pending (int): Most clips waiting to be written at once; capture pauses when the
+      disk falls this far behind. Default is 4.
+
+    Returns:
+    - list of per-step timing records.
+    """
+    log_path = os.path.join(folder_name, "sweep_log.jsonl")
+    background = []
+    steps = []
+    results = [None] * len(plan)
+    pending = asyncio.Semaphore(max_pending)
+    writer = SessionArchiveWriter(archive_path_for(folder_name)) if archive else None
+
+    async def finish(i, step, filename, clip):
+        try:
+            results[i], write_time, analyze_time = await asyncio.to_thread(
+                _write_and_analyze, filename, capture.sample_rate, clip, analyze, writer, step["value"])
+            step.update(write_s=write_time, analyze_s=analyze_time)
+        except Exception as e:
+            step["error"] = repr(e)
+            raise
+        finally:
+            pending.release()
+            with open(log_path, "a") as log:
+                log.write(json.dumps(step) + "\n")
+
+    try:
+        for i, value in enumerate(plan):
+            await pending.acquire()
+            step = {"value": value, "start": time.time()}
+            try:
+                t0 = time.perf_counter()
+                controller.set_speed(value)
+                print(f"Value {value} set")
+
+                t1 = time.perf_counter()
+                settled = await asyncio.to_thread(capture.settle, settle_time)
+                t2 = time.perf_counter()
+                clip = await asyncio.to_thread(capture.capture, duration)
+                t3 = time.perf_counter()
+            except BaseException:
+                pending.release()
+                raise
+            step.update(set_s=t1 - t0, settle_s=t2 - t1, settled_after_s=settled, capture_s=t3 - t2)
+            steps.append(step)
+
+            # Hand the clip off and move straight on to the next speed
+            filename = os.path.join(folder_name, f"audio_{format_speed(value)}.wav")
+            step["file"] = os.path.basename(filename)
+            background.append(asyncio.create_task(finish(i, step, filename, clip)))
+    finally:
+        # Clips already captured are written even if a later step failed or was interrupted
+        outcomes = await asyncio.gather(*background, return_exceptions=True)
+        if writer is not None:
+            writer.close()
+
+    for outcome in outcomes:
+        if isinstance(outcome, BaseException):
+            raise outcome
+
+    if analyze and steps:
+        # Rows in the same sorted order as analyze.analyze_folder
+        order = sorted(range(len(steps)), key=lambda i: steps[i]["file"])
+        save_folder_results(folder_name, [plan[i] for i in order], [results[i][0] for i in order],
+                            results[order[-1]][1], [results[i][2] for i in order])
+    return steps
+
+async def run_sweeps(plans, controller, capture, data_dir, settle_time=3.0, duration=5.0, analyze=True, archive=False,
+                     max_pending=4):
+    """
+    Runs each plan from sweep_plan as its own recording session in a new folder under data_dir.
+    """
+    folders = []
+    for plan in plans:
+        folder_name = create_session_folder(data_dir)
+        start = time.perf_counter()
+        await run_sweep(plan, controller, capture, folder_name, settle_time, duration, analyze, archive, max_pending)
+        print(f"Finished sweep of {len(plan)} steps into {folder_name} in {time.perf_counter() - start:.1f} s")
+        folders.append(folder_name)
+    return folders
+
+
+if __name__ == "__main__":
+    plans = sweep_plan("ascending", 0, 100, 1, repeats=1)
+    while True:
+        asyncio.run(run_sweeps(plans, FileFanController(), SoundDeviceCapture(), "data3"))
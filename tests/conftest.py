@@ -0,0 +1,50 @@
+import os
+import sys
+import tempfile
+
+import numpy as np
+import pytest
+from scipy.io import wavfile
+
+# The modules live at the top of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Keep the spectrum cache out of the working tree (also for forked pool workers)
+os.environ.setdefault("FFT_CACHE_DIR", tempfile.mkdtemp(prefix="fft_cache_"))
+
+SAMPLE_RATE = 8000
+
+def fan_clip(speed, duration=0.5, sample_rate=SAMPLE_RATE, channels=1, seed=0):
+    """
+    Synthetic int16 fan recording: a blade-pass tone that rises with speed, plus noise.
+    """
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(duration * sample_rate)) / sample_rate
+    signal = (200 + 20 * speed) * np.sin(2 * np.pi * (100 + 10 * speed) * t) + 50 * rng.normal(size=len(t))
+    if channels > 1:
+        signal = np.stack([signal * (1 + channel) for channel in range(channels)], axis=1)
+    return signal.astype(np.int16)
+
+def write_session(data_dir, name="Recordings_20240101_000000", speeds=(0, 50, 100), seed=0, **kwargs):
+    """
+    Writes a "Recordings_*" folder of synthetic "audio_<speed>.wav" files and returns its path.
+    """
+    from analyze import format_speed
+
+    folder = os.path.join(str(data_dir), name)
+    os.makedirs(folder, exist_ok=True)
+    for i, speed in enumerate(speeds):
+        wavfile.write(os.path.join(folder, f"audio_{format_speed(speed)}.wav"), SAMPLE_RATE,
+                      fan_clip(speed, seed=seed + i, **kwargs))
+    return folder
+
+@pytest.fixture
+def metrics_on():
+    import metrics
+
+    enabled = metrics.metrics.enabled
+    metrics.metrics.enabled = True
+    metrics.metrics.reset()
+    yield metrics.metrics
+    metrics.metrics.enabled = enabled
+    metrics.metrics.reset()
@@ -0,0 +1,47 @@
+import os
+
+import pandas as pd
+import pytest
+from scipy.io import wavfile
+
+from analyze import analyze_folder
+from batch_analyze import analyze_corpus
+from conftest import SAMPLE_RATE, fan_clip, write_session
+from spectra_store import SpectraStore
+
+def test_pool_matches_folder_analysis(tmp_path):
+    write_session(tmp_path / "pool", speeds=(0, 12.5, 50))
+    write_session(tmp_path / "serial", speeds=(0, 12.5, 50))
+    analyze_corpus(str(tmp_path / "pool"), workers=2)
+    analyze_folder(str(tmp_path / "serial" / "Recordings_20240101_000000"))
+
+    pool = pd.read_csv(tmp_path / "pool" / "Recordings_20240101_000000" / "analysis_results.csv")
+    serial = pd.read_csv(tmp_path / "serial" / "Recordings_20240101_000000" / "analysis_results.csv")
+    pd.testing.assert_frame_equal(pool, serial)
+
+def test_bad_sessions_are_skipped(tmp_path, capsys):
+    good = write_session(tmp_path, "Recordings_20240101_000000")
+    # Clips of different lengths do not share frequency bins
+    mixed = write_session(tmp_path, "Recordings_20240101_000001")
+    wavfile.write(os.path.join(mixed, "audio_50.wav"), SAMPLE_RATE, fan_clip(50, duration=0.3))
+    # An unreadable recording
+    broken = write_session(tmp_path, "Recordings_20240101_000002")
+    with open(os.path.join(broken, "audio_50.wav"), "wb") as f:
+        f.write(b"not a wav file")
+
+    analyze_corpus(str(tmp_path), workers=1, store_path=str(tmp_path / "store"))
+
+    output = capsys.readouterr().out
+    assert f"Skipping {mixed}" in output and f"Skipping {broken}" in output
+    assert os.path.exists(os.path.join(good, "analysis_results.csv"))
+    store = SpectraStore(str(tmp_path / "store"))
+    volumes = store.volumes_frame()
+    assert not volumes["Recordings_20240101_000000"].isna().any()
+    assert volumes["Recordings_20240101_000001"].isna().all()
+
+def test_folder_with_mixed_lengths_raises_before_writing(tmp_path):
+    folder = write_session(tmp_path, speeds=(0, 50))
+    wavfile.write(os.path.join(folder, "audio_50.wav"), SAMPLE_RATE, fan_clip(50, duration=0.3))
+    with pytest.raises(ValueError):
+        analyze_folder(folder)
+    assert not os.path.exists(os.path.join(folder, "analysis_results.csv"))
@@ -0,0 +1,27 @@
+import tracemalloc
+
+import numpy as np
+
+from benchmark import time_stage
+
+def test_time_stage_times_untraced_and_traces_separately():
+    tracing = []
+    setups = []
+
+    def stage(n):
+        tracing.append(tracemalloc.is_tracing())
+        return np.ones(n).sum()
+
+    result, seconds, peak_mb = time_stage(stage, 1_000_000, setup=lambda: setups.append(1))
+    assert result == 1_000_000
+    assert tracing == [False, True]
+    assert len(setups) == 2
+    assert seconds > 0
+    assert peak_mb >= 8.0  # the 1e6 float64 array
+    assert not tracemalloc.is_tracing()
+
+def test_time_stage_without_memory():
+    tracing = []
+    _, _, peak_mb = time_stage(lambda: tracing.append(tracemalloc.is_tracing()), memory=False)
+    assert tracing == [False]
+    assert peak_mb is None
@@ -0,0 +1,62 @@
+import os
+
+import numpy as np
+import pandas as pd
+from scipy.io import wavfile
+
+from analyze import analyze_audio, analyze_folder, analyze_folder_channels
+from conftest import SAMPLE_RATE, write_session
+from fft_kernel import channel_coherence, split_coherent
+from session_archive import convert_folder
+
+def two_microphones(duration=2.0, seed=0):
+    # Both microphones hear the fan tone; the second one also hears a source of its own
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(duration * SAMPLE_RATE)) / SAMPLE_RATE
+    fan = 1000 * np.sin(2 * np.pi * 600 * t) + 300 * rng.normal(size=len(t))
+    local = 1000 * rng.normal(size=len(t))
+    return np.stack([fan + 10 * rng.normal(size=len(t)), fan + local], axis=1).astype(np.int16)
+
+def test_coherence_separates_an_independent_source():
+    clip = two_microphones()
+    freqs, coherence = channel_coherence(SAMPLE_RATE, clip, nperseg=512)
+    assert np.allclose(coherence[0], 1)
+    assert coherence[1][np.argmin(np.abs(freqs - 600))] > 0.9
+    assert np.median(coherence[1]) < 0.2
+
+    magnitudes = np.abs(np.fft.rfft(clip.T.astype(float), axis=1)) / len(clip)
+    spectrum_freqs = np.fft.rfftfreq(len(clip), 1 / SAMPLE_RATE)
+    coherent, incoherent = split_coherent(spectrum_freqs, magnitudes, freqs, coherence)
+    assert np.allclose(coherent ** 2 + incoherent ** 2, magnitudes ** 2)
+
+def test_folder_channels_and_mixdown(tmp_path):
+    folder = os.path.join(tmp_path, "Recordings_20240101_000000")
+    os.makedirs(folder)
+    for speed in (0, 50):
+        wavfile.write(os.path.join(folder, f"audio_{speed}.wav"), SAMPLE_RATE, two_microphones(seed=speed))
+
+    assert analyze_folder_channels(folder, nperseg=512)
+    results = pd.read_csv(os.path.join(folder, "channel_results.csv"))
+    assert results[["Value", "Channel"]].values.tolist() == [[0, 0], [0, 1], [50, 0], [50, 1]]
+    fractions = results.set_index(["Value", "Channel"])["Coherent Fraction"]
+    assert fractions[(0, 0)] > 0.99 and fractions[(0, 1)] < 0.6
+    with np.load(os.path.join(folder, "channel_spectra.npz")) as npz:
+        assert npz["spectral_data"].shape == (2, 2, len(npz["freqs"]))
+        assert npz["coherence"].shape[:2] == (2, 2)
+
+    # The mono analysis of the same files is the channel average
+    analyze_folder(folder)
+    volume, _, _ = analyze_audio(os.path.join(folder, "audio_0.wav"), use_cache=False)
+    mixed = pd.read_csv(os.path.join(folder, "analysis_results.csv")).set_index("Value")
+    assert mixed.loc[0, "Average Volume"] == volume
+
+def test_archive_channels_match_folder(tmp_path):
+    folder = write_session(tmp_path, speeds=(0, 50), channels=3)
+    analyze_folder_channels(folder, coherence=False)
+    expected = pd.read_csv(os.path.join(folder, "channel_results.csv"))
+
+    archive = convert_folder(folder)
+    os.remove(os.path.join(folder, "channel_results.csv"))
+    analyze_folder_channels(archive, coherence=False)
+    pd.testing.assert_frame_equal(pd.read_csv(os.path.join(folder, "channel_results.csv")), expected)
+    assert list(expected.columns) == ["Value", "Channel", "Average Volume"]
@@ -0,0 +1,83 @@
+import os
+
+import numpy as np
+import pytest
+
+import fft_cache
+from analyze import analyze_audio, analyze_recordings
+from conftest import write_session
+from fft_cache import SpectrumCache
+
+@pytest.fixture
+def cache(tmp_path):
+    previous = fft_cache.get_default_cache()
+    cache = SpectrumCache(str(tmp_path / "cache"))
+    fft_cache.set_default_cache(cache)
+    yield cache
+    fft_cache.set_default_cache(previous)
+
+def test_key_depends_on_contents_and_params(tmp_path, cache):
+    path = tmp_path / "a.bin"
+    path.write_bytes(b"one")
+    key = cache.key(str(path), {"analysis": "x"})
+    assert cache.key(str(path), {"analysis": "x"}) == key
+    assert cache.key(str(path), {"analysis": "y"}) != key
+
+    stat = os.stat(path)
+    path.write_bytes(b"two")
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))  # Same size and mtime, new contents
+    cache._digests.clear()
+    assert cache.key(str(path), {"analysis": "x"}) != key
+
+def test_entries_survive_a_new_process_and_are_read_only(tmp_path, cache):
+    path = tmp_path / "a.bin"
+    path.write_bytes(b"data")
+    calls = []
+    compute = lambda file_path: calls.append(file_path) or (1.5, np.arange(3.0))
+
+    cache.get_or_compute(str(path), compute)
+    volume, values = SpectrumCache(cache.cache_dir).get_or_compute(str(path), compute)
+    assert len(calls) == 1
+    assert volume == 1.5 and list(values) == [0, 1, 2]
+    with pytest.raises(ValueError):
+        values[0] = 5
+
+def test_eviction_keeps_cache_under_limit(tmp_path):
+    cache = SpectrumCache(str(tmp_path / "cache"), max_bytes=20_000)
+    for i in range(5):
+        path = tmp_path / f"{i}.bin"
+        path.write_bytes(bytes([i]))
+        cache.put(str(path), (np.zeros(1000),))
+    sizes = [entry.stat().st_size for entry in (tmp_path / "cache").iterdir()]
+    assert sum(sizes) <= 20_000 and len(sizes) == 2
+
+def test_puts_only_rescan_the_directory_when_needed(tmp_path, monkeypatch):
+    cache = SpectrumCache(str(tmp_path / "cache"), max_bytes=50_000)
+    scans = []
+    evict = cache.evict
+    monkeypatch.setattr(cache, "evict", lambda: scans.append(1) or evict())
+    for i in range(20):
+        path = tmp_path / f"{i}.bin"
+        path.write_bytes(bytes([i]))
+        cache.put(str(path), (np.zeros(1000),))
+        sizes = [entry.stat().st_size for entry in (tmp_path / "cache").iterdir()]
+        assert sum(sizes) <= 50_000
+        assert cache._total_bytes == sum(sizes)
+    # One scan on the first put, then one per overflow, each freeing room for more than one entry
+    assert len(scans) < 10
+
+@pytest.mark.parametrize("first", ["analyze_audio", "analyze_recordings"])
+def test_shared_entries_have_one_dtype(tmp_path, cache, first):
+    folder = write_session(tmp_path, speeds=(10, 60))
+    paths = [os.path.join(folder, name) for name in sorted(os.listdir(folder))]
+
+    if first == "analyze_audio":
+        filled = [analyze_audio(path) for path in paths]
+        reused = analyze_recordings(paths)
+    else:
+        filled = analyze_recordings(paths)
+        reused = [analyze_audio(path) for path in paths]
+    assert cache.misses == len(paths) and cache.hits == len(paths)
+    uncached = [analyze_audio(path, use_cache=False) for path in paths] + analyze_recordings(paths, use_cache=False)
+    for _, _, magnitude in filled + reused + uncached:
+        assert magnitude.dtype == np.float64
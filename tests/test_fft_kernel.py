@@ -0,0 +1,56 @@
+import os
+
+import numpy as np
+import pytest
+import scipy.fft
+
+from analyze import analyze_audio, analyze_recordings
+from conftest import fan_clip, write_session
+from fft_kernel import RELATIVE_TOLERANCE, analyze_channels, batch_spectra, fft_length
+
+def assert_close_to_reference(result, reference):
+    volume, freqs, magnitude = result
+    ref_volume, ref_freqs, ref_magnitude = reference
+    assert volume == ref_volume
+    assert np.array_equal(freqs, ref_freqs)
+    assert np.max(np.abs(magnitude - ref_magnitude)) <= RELATIVE_TOLERANCE * ref_magnitude.max()
+
+def test_batched_float32_matches_analyze_audio(tmp_path):
+    # Two lengths, so the batch holds more than one stacked group
+    folder = write_session(tmp_path, speeds=(0, 30, 60, 100))
+    write_session(tmp_path, name="Recordings_20240101_000001", speeds=(45,), duration=0.37)
+    paths = [os.path.join(folder, name) for name in sorted(os.listdir(folder))]
+    paths.append(os.path.join(tmp_path, "Recordings_20240101_000001", "audio_45.wav"))
+
+    results = analyze_recordings(paths, use_cache=False)
+    for path, result in zip(paths, results):
+        assert_close_to_reference(result, analyze_audio(path, use_cache=False))
+
+@pytest.mark.parametrize("length_mode", ["pad", "trim"])
+def test_fast_lengths(length_mode):
+    n = 4001  # Prime, so a slow FFT length
+    n_fft = fft_length(n, length_mode)
+    assert n_fft == scipy.fft.next_fast_len(n_fft, real=True)
+    assert (n_fft >= n) if length_mode == "pad" else (n_fft <= n)
+
+    clip = fan_clip(50, duration=n / 8000)
+    [(freqs, magnitude)] = batch_spectra([clip], 8000, length_mode)
+    assert len(freqs) == n_fft // 2 + 1 == len(magnitude)
+    n_used = min(n, n_fft)
+    expected = np.abs(np.fft.rfft(clip[:n_used].astype(float), n=n_fft)) / n_used
+    assert np.allclose(magnitude, expected, atol=RELATIVE_TOLERANCE * expected.max())
+
+def test_windowed_batch_normalization():
+    clip = fan_clip(50, duration=1.0)
+    [(freqs, magnitude)] = batch_spectra([clip], 8000, window="hann")
+    # A Hann-windowed sine normalized by the window sum reads as half its amplitude
+    assert np.isclose(magnitude[np.argmin(np.abs(freqs - 600))], 1200 / 2, rtol=0.01)
+
+def test_channels_match_per_channel_transforms():
+    clip = fan_clip(50, channels=3)
+    volumes, freqs, magnitudes = analyze_channels(8000, clip)
+    assert magnitudes.shape == (3, len(freqs))
+    for channel in range(3):
+        expected = np.abs(np.fft.rfft(clip[:, channel].astype(float))) / len(clip)
+        assert volumes[channel] == np.mean(np.abs(clip[:, channel]))
+        assert np.max(np.abs(magnitudes[channel] - expected)) <= RELATIVE_TOLERANCE * expected.max()
@@ -0,0 +1,51 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from analyze import analyze_folder, list_recordings
+from conftest import write_session
+from spectra_store import SpectraStore, build_store, read_spectra, write_spectra
+
+SPEEDS = (0, 12.5, 50, 100)
+
+def test_list_recordings_keeps_fractional_speeds(tmp_path):
+    folder = write_session(tmp_path, speeds=SPEEDS)
+    assert sorted(value for value, _ in list_recordings(folder)) == list(SPEEDS)
+
+def test_build_store_with_fractional_speed(tmp_path):
+    folder = write_session(tmp_path / "data", speeds=SPEEDS)
+    analyze_folder(folder)
+
+    store = build_store(str(tmp_path / "data"), str(tmp_path / "store"))
+    store = SpectraStore(str(tmp_path / "store"))
+    assert store.speeds.dtype == np.float64
+    assert list(store.speeds) == list(SPEEDS)
+    volumes = store.volumes_frame()
+    assert 12.5 in volumes.index
+    assert not np.isnan(volumes.loc[12.5].iloc[0])
+
+def test_spectra_table_round_trip(tmp_path):
+    spectra_df = pd.DataFrame(np.ones((4, 3)), index=pd.Index([0.0, 1.0, 2.0, 3.0], name="Frequency (Hz)"),
+                              columns=["0", "12.5", "50"])
+    store_path = str(tmp_path / "store")
+    os.makedirs(store_path)
+    write_spectra(store_path, spectra_df)
+    assert list(read_spectra(store_path).columns) == ["0", "12.5", "50"]
+
+    csv_path = str(tmp_path / "all_spectra.csv")
+    write_spectra(csv_path, spectra_df)
+    assert list(read_spectra(csv_path, speed_range=(10, 20)).columns) == ["12.5"]
+
+def test_spectra_plot_with_fractional_speed(tmp_path):
+    from specgramTest import plot_spectra_with_db
+
+    reference = write_session(tmp_path / "silence", speeds=(1,))
+    freqs = np.fft.rfftfreq(4000, 1 / 8000)
+    spectra_df = pd.DataFrame(np.ones((len(freqs), 3)), index=pd.Index(freqs, name="Frequency (Hz)"),
+                              columns=["0", "12.5", "50"])
+    spectra_df.to_csv(tmp_path / "all_spectra.csv")
+    output = str(tmp_path / "spectra.png")
+    plot_spectra_with_db(str(tmp_path / "all_spectra.csv"), output,
+                         reference_wav=os.path.join(reference, "audio_1.wav"))
+    assert os.path.exists(output)
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from conftest import SAMPLE_RATE, fan_clip
+from frames import analyze_clip_clean, frame_levels, frame_view, interruption_mask
+
+def test_frame_views_share_memory():
+    data = np.arange(10.0)
+    frames = frame_view(data, 4)
+    assert frames.shape == (2, 4) and np.shares_memory(frames, data)
+    overlapping = frame_view(data, 4, hop=3)
+    assert overlapping.tolist() == [[0, 1, 2, 3], [3, 4, 5, 6], [6, 7, 8, 9]]
+    assert np.shares_memory(overlapping, data)
+    assert frame_view(data, 20).shape == (0, 20)
+
+def test_frame_levels():
+    data = np.array([1, -1, 1, -1, 3, -3, 3, -3], dtype=np.int16)
+    abs_mean, rms = frame_levels(data, 4)
+    assert abs_mean.tolist() == [1, 3] and rms.tolist() == [1, 3]
+
+@pytest.mark.parametrize("hop", [None, 300])
+def test_chunked_frame_levels_match_whole_clip_levels(hop):
+    data = fan_clip(80, duration=1.0)
+    data[100] = -32768  # abs of the most negative int16 does not fit in int16
+    frames = frame_view(data.astype(np.float64), 800, hop)
+    abs_mean, rms = frame_levels(data, 800, hop, chunk_samples=2000)
+    assert np.allclose(abs_mean, np.abs(frames).mean(axis=1))
+    assert np.allclose(rms, np.sqrt((frames ** 2).mean(axis=1)))
+
+def test_mask_rejects_loud_frames_only():
+    levels = 100 * np.exp(np.random.default_rng(0).normal(0, 0.02, 50))
+    levels[20] *= 10    # A burst
+    levels[40] /= 10    # A dropout is not an interruption
+    keep = interruption_mask(levels, pad_frames=1)
+    assert keep[[19, 20, 21]].tolist() == [False, False, False]
+    assert keep.sum() == 47 and keep[40]
+    # A steady clip keeps every frame even though its MAD is tiny
+    assert interruption_mask(np.full(20, 5.0) + np.arange(20) * 1e-6).all()
+
+@pytest.mark.parametrize("spectrum", ["gated", "welch"])
+def test_clean_analysis_ignores_a_burst(spectrum):
+    clip = fan_clip(50, duration=2.0).astype(np.float64)
+    quiet_volume = np.mean(np.abs(clip))
+    burst = clip.copy()
+    burst[8000:9600] += np.random.default_rng(1).normal(0, 20000, 1600)  # 0.2 s of shouting
+
+    volume, freqs, magnitude, kept = analyze_clip_clean(burst, SAMPLE_RATE, spectrum=spectrum)
+    assert 0.8 <= kept < 0.95
+    assert volume == pytest.approx(quiet_volume, rel=0.05)
+    tone = magnitude[np.argmin(np.abs(freqs - 600))]
+    assert tone == pytest.approx(600, rel=0.1)
+    if spectrum == "gated":
+        assert len(freqs) == len(clip) // 2 + 1
+
+def test_clip_shorter_than_a_frame():
+    volume, freqs, magnitude, kept = analyze_clip_clean(fan_clip(50, duration=0.05), SAMPLE_RATE)
+    assert kept == 1.0 and len(freqs) == len(magnitude) == 201
@@ -0,0 +1,38 @@
+import numpy as np
+import pandas as pd
+
+from harmonics import fundamental_slope, track_harmonics
+
+FUNDAMENTAL = 4.0  # Hz per percent
+
+def sweep_spectra(noise_ridge_db=11.0, seed=0):
+    # Speed x frequency table with harmonics 1-4 of the fundamental, a stationary tone, and a
+    # faint ridge at 20.96 Hz/% such as a chain of noise peaks
+    rng = np.random.default_rng(seed)
+    freqs = np.arange(0, 2000.0)
+    speeds = np.arange(20, 101, 2)
+    spectra = np.exp(rng.normal(0, 0.1, (len(freqs), len(speeds))))
+    for column, speed in enumerate(speeds):
+        for order in range(1, 5):
+            spectra[int(round(order * FUNDAMENTAL * speed)), column] = 30.0
+        spectra[1234, column] = 30.0
+        spectra[int(round(20.96 * speed - 300)) % len(freqs), column] = 10 ** (noise_ridge_db / 20)
+    return pd.DataFrame(spectra, index=pd.Index(freqs, name="Frequency (Hz)"), columns=[str(s) for s in speeds])
+
+def test_fundamental_ignores_stray_slope():
+    assert abs(fundamental_slope([4.0, 8.0, 12.0, 20.96], [25, 25, 25, 11]) - 4.0) < 0.05
+    # Subharmonics explain the same slopes but are not picked
+    assert abs(fundamental_slope([8.0, 12.0, 16.0]) - 4.0) < 1e-9
+
+def test_known_fundamental_and_orders():
+    harmonics, points = track_harmonics(sweep_spectra())
+    moving = harmonics[harmonics["Order"] > 0]
+    assert list(moving["Order"]) == [1, 2, 3, 4]
+    fundamental = moving["Slope (Hz/%)"] / (moving["Order"] + moving["Order Error"])
+    assert np.allclose(fundamental, FUNDAMENTAL, atol=0.02)
+
+    # The stationary tone is kept with order 0, the faint ridge is dropped
+    stationary = harmonics[harmonics["Order"] == 0]
+    assert len(stationary) == 1 and abs(stationary["Intercept (Hz)"].iloc[0] - 1234) < 1
+    assert not np.isclose(harmonics["Slope (Hz/%)"], 20.96, atol=0.5).any()
+    assert set(points["Ridge"]) == set(range(len(harmonics)))
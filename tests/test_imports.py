@@ -0,0 +1,28 @@
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULES = sorted(name[:-3] for name in os.listdir(ROOT) if name.endswith(".py"))
+HEAVY = ("numpy", "pandas", "scipy", "matplotlib", "seaborn", "sounddevice")
+
+def run_python(code, cwd):
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    return subprocess.run([sys.executable, "-c", code], cwd=cwd, env=env, capture_output=True, text=True, timeout=120)
+
+def test_imports_have_no_side_effects(tmp_path):
+    # Nothing printed, run or written to the working directory
+    result = run_python("".join(f"import {module}\n" for module in MODULES), str(tmp_path))
+    assert result.returncode == 0, result.stderr
+    assert result.stdout == ""
+    assert os.listdir(tmp_path) == []
+
+def test_cli_help_stays_light(tmp_path):
+    code = ("import sys, contextlib, io, cli\n"
+            "for argv in ([], ['analyze'], ['plot'], ['record'], ['model']):\n"
+            "    with contextlib.suppress(SystemExit), contextlib.redirect_stdout(io.StringIO()):\n"
+            "        cli.build_parser().parse_args(argv + ['--help'])\n"
+            f"print(sorted(m for m in {HEAVY!r} if m in sys.modules))")
+    result = run_python(code, str(tmp_path))
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == "[]"
@@ -0,0 +1,56 @@
+import threading
+
+import numpy as np
+import pytest
+from scipy.io import wavfile
+
+from conftest import SAMPLE_RATE, fan_clip
+from live import LiveRecorder, RingBuffer, SyntheticSource, WavFileSource, analyze_clip
+
+def run_with_timeout(function, timeout=10.0):
+    # Runs function in a thread so a hang fails the test instead of blocking the suite
+    outcome = {}
+
+    def target():
+        try:
+            outcome["result"] = function()
+        except BaseException as e:
+            outcome["error"] = e
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), f"{function} did not return within {timeout} s"
+    if "error" in outcome:
+        raise outcome["error"]
+    return outcome["result"]
+
+def test_ring_buffer_wraps_and_closes():
+    buffer = RingBuffer(8)
+    buffer.write(np.arange(6))
+    buffer.write(np.arange(6, 12))
+    block, position = buffer.read(4)
+    assert list(block[:, 0]) == list(range(4, 12)) and position == 12
+    with pytest.raises(OverflowError):
+        buffer.read(0)
+    buffer.close()
+    assert buffer.wait(12, timeout=5.0)
+
+def test_finite_source_ends_capture_and_settle(tmp_path):
+    path = str(tmp_path / "clip.wav")
+    wavfile.write(path, SAMPLE_RATE, fan_clip(50, duration=1.0))
+
+    with LiveRecorder(WavFileSource(path, blocksize=256, realtime=True, loop=False), window_seconds=0.1) as recorder:
+        clip = run_with_timeout(lambda: recorder.capture(5.0))
+        assert 0 < len(clip) <= SAMPLE_RATE
+        assert run_with_timeout(lambda: recorder.settle(max_wait=5.0)) < 5.0
+        with pytest.raises(EOFError):
+            run_with_timeout(lambda: recorder.capture(1.0))
+
+def test_live_clip_matches_tone():
+    source = SyntheticSource(sample_rate=SAMPLE_RATE, tones=((500.0, 1000.0),), noise=10.0, realtime=True, seed=0)
+    with LiveRecorder(source, window_seconds=0.1) as recorder:
+        clip = run_with_timeout(lambda: recorder.capture(0.5))
+    assert clip.shape == (SAMPLE_RATE // 2, 1)
+    _, freqs, magnitude = analyze_clip(clip, SAMPLE_RATE)
+    assert abs(freqs[np.argmax(magnitude)] - 500.0) < 2.0
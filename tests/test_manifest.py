@@ -0,0 +1,79 @@
+import os
+
+import pandas as pd
+from scipy.io import wavfile
+
+import manifest as manifest_module
+import cli
+from analyze import analyze_folder
+from conftest import fan_clip, write_session
+from manifest import Manifest
+
+def test_unchanged_touched_and_edited_files(tmp_path):
+    path = tmp_path / "data" / "a.bin"
+    path.parent.mkdir()
+    path.write_bytes(b"abc")
+    manifest = Manifest(str(tmp_path / "data" / "manifest.json"))
+    assert not manifest.is_current(str(path), "analyze")
+    manifest.record(str(path), "analyze")
+    manifest.save()
+
+    reloaded = Manifest(str(tmp_path / "data" / "manifest.json"))
+    assert reloaded.is_current(str(path), "analyze")
+    assert not reloaded.is_current(str(path), "volumes")
+
+    os.utime(path, ns=(0, 10**18))  # Touched, same contents
+    assert reloaded.is_current(str(path), "analyze")
+    path.write_bytes(b"abd")  # Same size, new contents
+    assert not reloaded.is_current(str(path), "analyze")
+
+    reloaded.forget("analyze")
+    assert reloaded.data["stages"] == {}
+
+def test_version_bump_invalidates(tmp_path, monkeypatch):
+    path = tmp_path / "a.bin"
+    path.write_bytes(b"abc")
+    manifest = Manifest(str(tmp_path / "manifest.json"))
+    manifest.record(str(path), "analyze")
+    monkeypatch.setattr(manifest_module, "ANALYSIS_VERSION", manifest_module.ANALYSIS_VERSION + 1)
+    assert not manifest.is_current(str(path), "analyze")
+
+def test_paths_are_relative_to_the_manifest(tmp_path):
+    data = tmp_path / "data"
+    folder = write_session(data)
+    manifest = Manifest(str(data / "manifest.json"))
+    assert analyze_folder(folder, manifest=manifest)
+
+    moved = tmp_path / "moved"
+    os.rename(data, moved)
+    manifest = Manifest(str(moved / "manifest.json"))
+    assert all(key.startswith("Recordings_") for key in manifest.data["stages"]["analyze"])
+    assert not analyze_folder(str(moved / os.path.basename(folder)), manifest=manifest)
+
+def test_analyze_folder_skips_only_unchanged_sessions(tmp_path):
+    folder = write_session(tmp_path, speeds=(0, 50))
+    manifest = Manifest(str(tmp_path / "manifest.json"))
+    assert analyze_folder(folder, manifest=manifest)
+    assert not analyze_folder(folder, manifest=manifest)
+
+    wavfile.write(os.path.join(folder, "audio_50.wav"), 8000, fan_clip(50, seed=99))
+    assert analyze_folder(folder, manifest=manifest)
+
+    os.remove(os.path.join(folder, "analysis_results.csv"))  # Missing output
+    assert analyze_folder(folder, manifest=manifest)
+
+def test_clean_and_plain_analysis_do_not_share_the_manifest_stage(tmp_path):
+    folder = write_session(tmp_path, speeds=(0, 50))
+    results = os.path.join(folder, "analysis_results.csv")
+    cli.main(["analyze", str(tmp_path), "-j", "1"])
+    assert "Kept Fraction" not in pd.read_csv(results).columns
+
+    cli.main(["analyze", str(tmp_path), "-j", "1", "--clean"])
+    assert "Kept Fraction" in pd.read_csv(results).columns
+    manifest = Manifest(str(tmp_path / "manifest.json"))
+    assert not analyze_folder(folder, manifest=manifest, clean=True)
+
+    # Back to plain analysis, whose earlier record no longer matches the outputs
+    assert analyze_folder(folder, manifest=manifest)
+    assert "Kept Fraction" not in pd.read_csv(results).columns
+    assert not analyze_folder(folder, manifest=manifest)
@@ -0,0 +1,42 @@
+import threading
+
+import metrics
+from batch_analyze import analyze_corpus
+from conftest import write_session
+
+def test_pooled_metrics_reach_parent(tmp_path, metrics_on):
+    write_session(tmp_path, "Recordings_20240101_000000")
+    write_session(tmp_path, "Recordings_20240101_000001", seed=10)
+
+    analyze_corpus(str(tmp_path), workers=2)
+
+    snapshot = metrics_on.snapshot()
+    assert snapshot["counters"]["files"] == 6
+    assert snapshot["counters"]["audio_seconds"] == 3.0
+    assert snapshot["timers"]["analyze_audio"]["count"] == 6
+    assert snapshot["timers"]["analyze_corpus"]["count"] == 1
+
+def test_take_and_merge(metrics_on):
+    metrics.increment("files", 2)
+    with metrics.timer("fft"):
+        pass
+    taken = metrics_on.take()
+    assert metrics_on.snapshot()["counters"] == {}
+
+    metrics_on.merge(taken)
+    metrics_on.merge(taken)
+    snapshot = metrics_on.snapshot()
+    assert snapshot["counters"]["files"] == 4
+    assert snapshot["timers"]["fft"]["count"] == 2
+
+def test_increment_is_thread_safe(metrics_on):
+    def work():
+        for _ in range(10000):
+            metrics.increment("bytes")
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert metrics_on.snapshot()["counters"]["bytes"] == 80000
@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from noise_model import FakeTemperatureSource, build_noise_model, control_loop, isotonic_fit, temperature_curve
+from sweep import MemoryFanController
+
+def lip_volumes():
+    # Quietest-take levels rise 0.2 dB per percent, with a 3 dB lip from 70 to 75 %
+    speeds = np.arange(0, 101)
+    levels_db = 20 + 0.2 * speeds + np.where((speeds >= 70) & (speeds <= 75), 3.0, 0.0)
+    volumes = 10 ** (levels_db / 20)
+    return pd.DataFrame({"Recordings_A": volumes, "Recordings_B": volumes * 1.1},
+                        index=pd.Index(speeds, name="Fan Speed")), speeds, levels_db
+
+def measured_within(speeds, levels_db, speed, budget_db):
+    # Every measured speed up to and including speed is within the budget
+    return bool(np.all(levels_db[speeds <= speed] <= budget_db + 1e-9))
+
+def test_isotonic_fit_pools_violators():
+    fitted = isotonic_fit([1, 3, 2, 4])
+    assert np.allclose(fitted, [1, 2.5, 2.5, 4])
+    assert np.all(np.diff(isotonic_fit(np.random.default_rng(0).normal(size=50))) >= 0)
+
+@pytest.mark.parametrize("curve", ["envelope", "isotonic"])
+def test_max_speed_never_enters_the_lip(curve):
+    volumes_df, speeds, levels_db = lip_volumes()
+    model = build_noise_model(volumes_df, curve=curve)
+    for budget_db in np.arange(levels_db.min(), levels_db.max() + 1, 0.05):
+        speed = model.max_speed(budget_db)
+        if budget_db >= levels_db[0]:
+            assert measured_within(speeds, levels_db, speed, budget_db), (budget_db, speed)
+
+    # Just under the lip, the highest allowed speed is below 70 %
+    assert model.max_speed(20 + 0.2 * 70 + 1) < 70
+
+def test_envelope_is_the_default():
+    model = build_noise_model(lip_volumes()[0])
+    assert model.metadata["curve"] == "envelope"
+
+def test_control_loop_respects_budget():
+    volumes_df, speeds, levels_db = lip_volumes()
+    model = build_noise_model(volumes_df, curve="isotonic")
+    budget_db = 20 + 0.2 * 72 + 1  # Between the level at 72 % and the lip's level
+    controller = MemoryFanController()
+    source = FakeTemperatureSource([40, 60, 75, 80, 95])
+    history = control_loop(model, source, budget_db, controller=controller,
+                           curve=temperature_curve(((40, 20), (80, 100))), interval=0, iterations=5,
+                           critical_temperature=90)
+
+    assert [temperature for temperature, _ in history] == [40, 60, 75, 80, 95]
+    written = [speed for _, speed in controller.history]
+    for speed in written[:-1]:
+        assert measured_within(speeds, levels_db, speed, budget_db)
+    # Critical temperature overrides the budget
+    assert written[-1] == 100
@@ -0,0 +1,75 @@
+import os
+
+import numpy as np
+
+from analyze import analyze_folder
+from binning import linear_edges
+from conftest import write_session
+from noise_reference import (ReferenceLibrary, background_removed_spectra, build_reference_library,
+                             load_reference_library, remove_background)
+
+def silence_dir(tmp_path):
+    path = tmp_path / "dataSilence"
+    write_session(path, name="Recordings_20240101_000000", speeds=(1, 50), seed=0, duration=1.0)
+    write_session(path, name="Recordings_20240301_000000", speeds=(1, 50), seed=5, duration=0.25)
+    return str(path)
+
+def test_closest_reference_in_time(tmp_path):
+    library = build_reference_library(silence_dir(tmp_path), max_freq=1000)
+    assert library.names == ["Recordings_20240101_000000", "Recordings_20240301_000000"]
+    sessions = ["Recordings_20240102_120000", "Recordings_20240501_000000", "unnamed"]
+    assert list(library.closest(sessions)) == [0, 1, -1]
+    profiles = library.profiles_for(sessions)
+    assert np.array_equal(profiles[0], library.profiles[0], equal_nan=True)
+    # The second session's coarser bins leave gaps, filled by the first
+    assert np.allclose(profiles[2], np.nanmean(library.profiles, axis=0))
+
+def test_library_rebuilt_when_parameters_change(tmp_path):
+    silence = silence_dir(tmp_path)
+    path = os.path.join(silence, "reference_library.npz")
+    library = load_reference_library(silence, speeds=[1], max_freq=1000)
+    assert library.speeds == [1] and library.matches(speeds=[1], max_freq=1000)
+    assert os.path.exists(path)
+
+    reloaded = load_reference_library(silence, speeds=[1], max_freq=1000)
+    assert np.array_equal(reloaded.profiles, library.profiles.astype(np.float32), equal_nan=True)
+
+    all_speeds = load_reference_library(silence, max_freq=1000)
+    assert all_speeds.speeds is None
+    assert not np.allclose(all_speeds.profiles, library.profiles, equal_nan=True)
+    assert ReferenceLibrary.load(path).speeds is None
+
+    edges = linear_edges(1000, 10)
+    assert np.array_equal(load_reference_library(silence, edges=edges).edges, edges)
+    assert len(load_reference_library(silence, max_freq=500).edges) == len(linear_edges(500))
+
+def test_library_without_build_parameters_is_rebuilt(tmp_path):
+    silence = silence_dir(tmp_path)
+    path = os.path.join(silence, "reference_library.npz")
+    library = build_reference_library(silence, max_freq=1000)
+    np.savez_compressed(path, names=np.array(library.names), times=library.times, edges=library.edges,
+                        profiles=library.profiles, volumes=library.volumes)
+    assert ReferenceLibrary.load(path).stale
+    assert not load_reference_library(silence, max_freq=1000).stale
+    assert not ReferenceLibrary.load(path).stale
+
+def test_remove_background_modes():
+    spectra = np.array([[[3.0, 5.0], [2.0, 1.0]]])  # (sessions, speeds, bins)
+    references = np.array([[1.0, 4.0]])
+    assert np.allclose(remove_background(spectra, references, "ratio", floor=0), [[[3, 1.25], [2, 0.25]]])
+    subtracted = remove_background(spectra, references, "subtract", floor=0)
+    assert np.allclose(subtracted, [[[np.sqrt(8), 3], [np.sqrt(3), 0]]])
+
+def test_background_of_identical_session_is_removed(tmp_path):
+    silence = silence_dir(tmp_path)
+    # The same recordings as the first calibration session, analyzed as a fan session
+    analyze_folder(write_session(tmp_path / "data", name="Recordings_20240101_010000", speeds=(1, 50), seed=0,
+                                 duration=1.0))
+    library = build_reference_library(silence, max_freq=1000)
+
+    ratios = background_removed_spectra(str(tmp_path / "data"), library)
+    assert list(ratios.columns) == ["1", "50"]
+    # The reference is the mean of both recordings, so the two ratios average to exactly 1
+    assert np.allclose(ratios.mean(axis=1), 1, rtol=1e-5)
+    # The 600 Hz blade-pass tone is only in the 50% recording
+    assert ratios.loc[600.0, "50"] > 1.9 and ratios.loc[600.0, "1"] < 0.1
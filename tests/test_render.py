@@ -0,0 +1,35 @@
+import os
+
+import numpy as np
+
+from render import pool_axis, pool_coordinates, render_heatmap, report_jobs
+
+def test_max_pooling_keeps_narrow_peaks():
+    values = np.zeros((1000, 3))
+    values[437, 1] = 5.0
+    pooled, starts = pool_axis(values, 100, axis=0, reducer="max")
+    assert pooled.shape == (100, 3) and starts[0] == 0
+    assert pooled.max() == 5.0 and pooled[:, 1].argmax() == 43
+
+    means, _ = pool_axis(values, 100, axis=0, reducer="mean")
+    assert np.isclose(means.sum(), 0.5)
+    assert np.allclose(pool_coordinates(np.arange(1000.0), starts)[:3], [4.5, 14.5, 24.5])
+
+def test_small_axes_are_not_pooled():
+    values = np.arange(6.0).reshape(2, 3)
+    pooled, starts = pool_axis(values, 10, axis=1)
+    assert pooled is values and list(starts) == [0, 1, 2]
+
+def test_render_heatmap_sorts_columns(tmp_path):
+    import matplotlib
+    matplotlib.use("Agg")
+
+    output = str(tmp_path / "heatmap.png")
+    render_heatmap(np.random.default_rng(0).random((5000, 4)), [0, 10, 100, 50], np.arange(5000.0), output,
+                   width_px=300, height_px=200, db=True)
+    assert os.path.getsize(output) > 0
+
+def test_report_figure_names(tmp_path):
+    outputs = [os.path.basename(kwargs["output_image"]) for _, kwargs in report_jobs("data", str(tmp_path), silence_dir="s")]
+    assert outputs == ["volumeScatterFinal.png", "volumeHistogram2D.png", "spectra_plot_db.png",
+                       "avgSpectraBkgdRemoved_plot_db.png"]
@@ -0,0 +1,67 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.io import wavfile
+
+from analyze import analyze_folder
+from conftest import fan_clip, write_session
+from session_archive import (SessionArchive, SessionArchiveWriter, archive_path_for, convert_folder,
+                            find_sessions, is_archive)
+
+SPEEDS = (0, 12.5, 50, 100)
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_round_trip(tmp_path, compress):
+    path = str(tmp_path / "Recordings_20240101_000000.session")
+    clips = {speed: fan_clip(speed, channels=1 + int(speed == 50)) for speed in SPEEDS}
+    clips[100] = np.array([32767, -32768, 32767, -32768, 0], dtype=np.int16)  # Extreme deltas wrap
+    with SessionArchiveWriter(path, compress=compress, metadata={"device": "test"}) as writer:
+        for speed, clip in clips.items():
+            writer.add(speed, clip, 8000)
+
+    assert is_archive(path) and not os.path.exists(path + ".partial")
+    with SessionArchive(path) as archive:
+        assert archive.speeds == sorted(SPEEDS)
+        assert archive.metadata == {"device": "test"}
+        for speed, sample_rate, data in archive.recordings():
+            assert sample_rate == 8000
+            assert data.dtype == np.int16 and np.array_equal(data, clips[speed])
+            if not compress:
+                assert not data.flags.writeable
+
+def test_failed_session_leaves_no_archive(tmp_path):
+    path = str(tmp_path / "Recordings_20240101_000000.session")
+    with pytest.raises(ValueError):
+        with SessionArchiveWriter(path) as writer:
+            writer.add(0, fan_clip(0), 8000)
+            writer.add(0, fan_clip(0), 8000)  # Duplicate speed
+    assert not os.path.exists(path) and not os.path.exists(path + ".partial")
+    with pytest.raises(ValueError):
+        SessionArchiveWriter(path).add(0, fan_clip(0).astype(np.float32), 8000)
+
+def test_converted_session_analyzes_like_the_folder(tmp_path):
+    folder = write_session(tmp_path / "wav", speeds=SPEEDS)
+    analyze_folder(folder)
+    expected = pd.read_csv(os.path.join(folder, "analysis_results.csv"))
+
+    packed = tmp_path / "packed"
+    packed.mkdir()
+    archive_path = convert_folder(folder, archive_path_for(str(packed / os.path.basename(folder))), remove=True)
+    assert not any(name.endswith(".wav") for name in os.listdir(folder))
+    assert find_sessions(str(packed)) == [archive_path]
+
+    analyze_folder(archive_path)
+    result = pd.read_csv(os.path.join(str(packed / os.path.basename(folder)), "analysis_results.csv"))
+    pd.testing.assert_frame_equal(result, expected)
+
+def test_convert_folder_checks_the_round_trip(tmp_path, monkeypatch):
+    import session_archive
+
+    folder = write_session(tmp_path, speeds=(0, 50))
+    monkeypatch.setattr(session_archive, "_encode", lambda data, compress, level: ("raw", b"\0" * data.nbytes))
+    with pytest.raises(ValueError):
+        convert_folder(folder, remove=True)
+    assert os.path.exists(os.path.join(folder, "audio_50.wav"))
+    assert wavfile.read(os.path.join(folder, "audio_50.wav"))[1].any()
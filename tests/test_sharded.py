@@ -0,0 +1,110 @@
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from analyze import analyze_folder
+from conftest import write_session
+from sharded import (DirectoryQueue, SQLiteQueue, enqueue_corpus, open_queue, reduce_partials, run_worker)
+from spectra_aggregation import generate_spectra_csv
+from volume_aggregation import aggregate_volumes
+
+@pytest.fixture(params=["sqlite", "directory"])
+def queue_path(request, tmp_path, monkeypatch):
+    # Expired leases are only reclaimed after the grace period of a fresh rename
+    monkeypatch.setattr(DirectoryQueue, "CLAIM_GRACE_SECONDS", 0)
+    return str(tmp_path / ("queue.db" if request.param == "sqlite" else "queue"))
+
+def test_open_queue_type(tmp_path):
+    assert isinstance(open_queue(str(tmp_path / "q.db")), SQLiteQueue)
+    assert isinstance(open_queue(str(tmp_path / "q")), DirectoryQueue)
+
+def test_claims_are_exclusive_and_puts_idempotent(queue_path):
+    queue = open_queue(queue_path)
+    queue.put("a", {"n": 1})
+    queue.put("b", {"n": 2})
+    queue.put("a", {"n": 3})
+    assert queue.claim("w1", 60) == ("a", {"n": 1})
+    assert queue.claim("w2", 60) == ("b", {"n": 2})
+    assert queue.claim("w3", 60) is None
+    assert queue.counts() == {"pending": 0, "leased": 2, "done": 0, "failed": 0}
+
+def test_expired_lease_is_reclaimed(queue_path):
+    queue = open_queue(queue_path)
+    queue.put("a", {"n": 1})
+    assert queue.claim("dead", -1)[0] == "a"  # A worker that died right after claiming
+    assert queue.claim("alive", 60) == ("a", {"n": 1})
+    assert queue.renew("a", "alive", 60)
+    assert not queue.renew("a", "dead", 60)  # Lost its lease to "alive"
+
+    queue.complete("a", "alive")
+    assert queue.counts()["done"] == 1
+    assert queue.claim("other", 60) is None
+
+def test_unit_fails_after_max_attempts(queue_path):
+    queue = open_queue(queue_path, max_attempts=2)
+    queue.put("a", {})
+    queue.put("b", {})
+    for worker in ("w1", "w2"):
+        unit, _ = queue.claim(worker, 60)
+        assert unit == "a"
+        queue.release(unit, worker, error="boom")
+    for worker in ("w1", "w2"):
+        unit, _ = queue.claim(worker, -1)  # Lease expires every time
+        assert unit == "b"
+    assert queue.claim("w3", 60) is None
+    assert queue.counts() == {"pending": 0, "leased": 0, "done": 0, "failed": 2}
+    assert ("a", "boom") in queue.errors()
+
+def test_completing_a_given_up_unit_clears_its_failure(queue_path):
+    queue = open_queue(queue_path, max_attempts=1)
+    queue.put("a", {})
+    queue.claim("slow", -1)
+    assert queue.claim("other", 60) is None  # The expired lease used up the only attempt
+    assert queue.counts()["failed"] == 1
+
+    queue.complete("a", "slow")  # The slow worker finishes after all
+    assert queue.counts() == {"pending": 0, "leased": 0, "done": 1, "failed": 0}
+    assert list(queue.errors()) == []
+
+def test_release_by_another_worker_is_ignored(queue_path):
+    queue = open_queue(queue_path)
+    queue.put("a", {})
+    queue.claim("owner", 60)
+    queue.release("a", "intruder", error="nope")
+    assert queue.counts()["leased"] == 1
+
+@pytest.mark.parametrize("unit", ["session", "speed"])
+def test_sharded_run_matches_serial_pipeline(tmp_path, queue_path, unit):
+    data_dir = str(tmp_path / "data")
+    for i in range(4):
+        write_session(data_dir, name=f"Recordings_20240101_00000{i}", speeds=(0, 50, 100), seed=10 * i)
+
+    queue = open_queue(queue_path)
+    enqueue_corpus(queue, data_dir, unit)
+    assert run_worker(queue_path, worker="w1", max_units=2) == 2
+    run_worker(queue_path, worker="w2", poll_seconds=0.01)
+    assert queue.counts()["done"] == (4 if unit == "session" else 12)
+    volumes, spectra = reduce_partials(queue.partials_dir, str(tmp_path / "v.csv"), str(tmp_path / "s.csv"))
+
+    for folder in sorted(os.listdir(data_dir)):
+        analyze_folder(os.path.join(data_dir, folder))
+    serial_volumes = aggregate_volumes(data_dir, str(tmp_path / "all_volumes.csv"))
+    generate_spectra_csv(str(tmp_path / "all_volumes.csv"), data_dir, str(tmp_path / "all_spectra.csv"))
+    serial_spectra = pd.read_csv(tmp_path / "all_spectra.csv", index_col="Frequency (Hz)")
+
+    pd.testing.assert_frame_equal(volumes, serial_volumes, check_dtype=False)
+    serial_spectra = serial_spectra.loc[spectra.index]
+    assert list(spectra.columns.astype(str)) == list(serial_spectra.columns)
+    assert np.allclose(spectra.to_numpy(), serial_spectra.to_numpy(), rtol=1e-5, atol=1e-4)
+
+def test_module_entry_point_runs_the_cli(tmp_path):
+    queue = open_queue(str(tmp_path / "queue"))
+    queue.put("a", {})
+    script = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "sharded.py")
+    result = subprocess.run([sys.executable, script, "status", str(tmp_path)], capture_output=True, text=True,
+                            check=True)
+    assert "'pending': 1" in result.stdout
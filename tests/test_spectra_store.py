@@ -0,0 +1,73 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from analyze import analyze_folder
+from conftest import write_session
+from spectra_aggregation import generate_spectra_csv
+from spectra_store import SpectraStore, build_store, is_store, read_spectra, read_volumes
+
+SPEEDS = (0, 25, 50, 75, 100)
+
+def build(tmp_path, sessions=2, max_freq=2000):
+    data_dir = tmp_path / "data"
+    for i in range(sessions):
+        analyze_folder(write_session(data_dir, name=f"Recordings_20240101_00000{i}", speeds=SPEEDS, seed=10 * i))
+    build_store(str(data_dir), str(tmp_path / "store"), max_freq=max_freq)
+    return str(data_dir), str(tmp_path / "store")
+
+def test_store_matches_folder_results(tmp_path):
+    data_dir, store_path = build(tmp_path)
+    assert is_store(store_path)
+    store = SpectraStore(store_path)
+    sessions, speeds, freqs, spectra = store.spectra()
+    assert isinstance(spectra, np.memmap) and spectra.dtype == np.float32
+    assert freqs.max() <= 2000 and list(speeds) == list(SPEEDS)
+
+    for i, session in enumerate(sessions):
+        with np.load(os.path.join(data_dir, session, "spectral_data.npz")) as npz:
+            order = np.argsort(npz["values"])
+            expected = npz["spectral_data"][order][:, :len(freqs)]
+        assert np.allclose(spectra[i], expected, rtol=1e-6)
+        results = pd.read_csv(os.path.join(data_dir, session, "analysis_results.csv")).set_index("Value")
+        assert np.allclose(read_volumes(store_path)[session], results.loc[list(SPEEDS), "Average Volume"])
+
+def test_partial_reads(tmp_path):
+    _, store_path = build(tmp_path)
+    store = SpectraStore(store_path)
+    _, _, freqs, whole = store.spectra()
+
+    sessions, speeds, sub_freqs, part = store.spectra(sessions=[store.sessions[1]], speed_range=(25, 75),
+                                                      freq_range=(500, 1000))
+    assert sessions == [store.sessions[1]]
+    assert list(speeds) == [25, 50, 75]
+    assert sub_freqs.min() >= 500 and sub_freqs.max() <= 1000
+    rows = np.flatnonzero((freqs >= 500) & (freqs <= 1000))
+    assert np.array_equal(part[0], whole[1, 1:4, rows[0]:rows[-1] + 1])
+
+def test_missing_recordings_are_nan(tmp_path):
+    data_dir = tmp_path / "data"
+    analyze_folder(write_session(data_dir, name="Recordings_20240101_000000", speeds=SPEEDS))
+    analyze_folder(write_session(data_dir, name="Recordings_20240101_000001", speeds=(0, 50)))
+    store = build_store(str(data_dir), str(tmp_path / "store"))
+    volumes = SpectraStore(store.path).volumes_frame()
+    assert volumes["Recordings_20240101_000001"].isna().tolist() == [False, True, False, True, True]
+    _, _, _, spectra = SpectraStore(store.path).spectra()
+    assert np.isnan(spectra[1, 1]).all() and not np.isnan(spectra[1, 0]).any()
+
+def test_spectra_from_a_store_that_partly_covers_the_volume_table(tmp_path, capsys):
+    _, store_path = build(tmp_path)
+    volumes = SpectraStore(store_path).volumes_frame()
+    # A session and a fan speed the store has never seen, quieter than everything stored
+    volumes["Recordings_20240101_000009"] = 0.0
+    volumes.loc[60] = 0.0
+    output = str(tmp_path / "all_spectra.csv")
+    generate_spectra_csv(volumes, store_path, output)
+
+    spectra = read_spectra(output)
+    assert [float(speed) for speed in spectra.columns] == list(SPEEDS)
+    assert not spectra.isna().any().any()
+    out = capsys.readouterr().out
+    assert "Session not in store: Recordings_20240101_000009" in out
+    assert "Fan speed 60 not in store" in out
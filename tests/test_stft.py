@@ -0,0 +1,48 @@
+import os
+
+import numpy as np
+import pytest
+import scipy.signal
+
+from conftest import SAMPLE_RATE, write_session
+from session_archive import convert_folder
+from stft import load_session_signal, session_spectrogram, stft
+
+def test_matches_scipy_stft():
+    signal = np.random.default_rng(0).normal(0, 1000, 20000).astype(np.int16)
+    times, freqs, magnitudes = stft(signal, SAMPLE_RATE, nperseg=512, hop=200, nfft=1024, chunk_frames=7)
+    window = scipy.signal.get_window("hann", 512)
+    frames = np.lib.stride_tricks.sliding_window_view(signal.astype(float), 512)[::200]
+    expected = np.abs(np.fft.rfft(frames * window, n=1024, axis=1)) / window.sum()
+    assert magnitudes.shape == expected.shape and magnitudes.dtype == np.float32
+    assert np.allclose(magnitudes, expected, rtol=1e-4, atol=1e-3)
+    assert np.allclose(times, (np.arange(len(frames)) * 200 + 256) / SAMPLE_RATE)
+    assert np.array_equal(freqs, np.fft.rfftfreq(1024, 1 / SAMPLE_RATE))
+
+def test_tone_amplitude_and_short_signal():
+    t = np.arange(8000) / SAMPLE_RATE
+    _, freqs, magnitudes = stft(1000 * np.sin(2 * np.pi * 500 * t), SAMPLE_RATE, nperseg=800)
+    assert np.allclose(magnitudes[:, np.argmin(np.abs(freqs - 500))], 500, rtol=1e-3)
+    with pytest.raises(ValueError):
+        stft(np.zeros(100), SAMPLE_RATE, nperseg=512)
+
+def test_session_signal_in_speed_order(tmp_path):
+    folder = write_session(tmp_path, speeds=(100, 5, 50))
+    sample_rate, signal, boundaries = load_session_signal(folder, buffer_path=str(tmp_path / "buffer.npy"))
+    assert sample_rate == SAMPLE_RATE and signal.dtype == np.int16
+    assert boundaries == [(5, 0), (50, 4000), (100, 8000)]
+    assert np.load(tmp_path / "buffer.npy", mmap_mode="r").shape == (12000,)
+
+    archive = convert_folder(folder)
+    _, archived, archived_boundaries = load_session_signal(archive)
+    assert np.array_equal(archived, signal) and archived_boundaries == boundaries
+
+def test_session_spectrogram_cache(tmp_path):
+    folder = write_session(tmp_path, speeds=(0, 50))
+    first = session_spectrogram(folder, nperseg=1024)
+    cache_files = [name for name in os.listdir(folder) if name.startswith("spectrogram_")]
+    assert cache_files == ["spectrogram_1024_512_1024_hann.npz"]
+    second = session_spectrogram(folder, nperseg=1024)
+    for a, b in zip(first[:3], second[:3]):
+        assert np.array_equal(a, b)
+    assert second[3] == [(0, 0.0), (50, 0.5)]
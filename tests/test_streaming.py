@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+import scipy.signal
+from scipy.io import wavfile
+
+from conftest import fan_clip
+from streaming import analyze_audio_streaming, iter_wav_blocks
+
+@pytest.fixture
+def long_clip(tmp_path):
+    path = str(tmp_path / "audio_50.wav")
+    clip = fan_clip(50, duration=3.3)
+    wavfile.write(path, 8000, clip)
+    return path, clip
+
+def test_blocks_cover_the_file(long_clip, tmp_path):
+    path, clip = long_clip
+    blocks = [block for _, block in iter_wav_blocks(path, block_size=1000)]
+    assert all(len(block) == 1000 for block in blocks[:-1])
+    assert np.array_equal(np.concatenate(blocks), clip)
+
+    stereo = str(tmp_path / "stereo.wav")
+    wavfile.write(stereo, 8000, fan_clip(50, channels=2))
+    [(_, block)] = list(iter_wav_blocks(stereo))
+    assert np.allclose(block, fan_clip(50, channels=2).mean(axis=1))
+
+@pytest.mark.parametrize("block_size", [1000, 4096, 65536])
+def test_block_size_does_not_change_the_result(long_clip, block_size):
+    path, clip = long_clip
+    volume, freqs, magnitude = analyze_audio_streaming(path, block_size=block_size, nperseg=2048, use_cache=False)
+    assert volume == pytest.approx(np.mean(np.abs(clip)))
+
+    # Same segments as a Welch average of Hann-windowed, 50% overlapping magnitude spectra
+    window = np.hanning(2048)
+    segments = np.lib.stride_tricks.sliding_window_view(clip.astype(float), 2048)[::1024]
+    expected = np.abs(np.fft.rfft(segments * window, axis=1)).mean(axis=0) / window.sum()
+    assert np.allclose(magnitude, expected)
+    assert np.array_equal(freqs, np.fft.rfftfreq(2048, 1 / 8000))
+
+def test_tone_amplitude_and_lower_noise_floor(long_clip):
+    path, clip = long_clip
+    # 5 Hz bins, so the 600 Hz tone of amplitude 1200 falls on a bin and reads as half its
+    # amplitude, like analyze_audio
+    _, freqs, magnitude = analyze_audio_streaming(path, nperseg=1600, use_cache=False)
+    assert magnitude[np.argmin(np.abs(freqs - 600))] == pytest.approx(600, rel=0.02)
+    # Averaging segments smooths the noise floor compared with one full-length transform
+    full = np.abs(np.fft.rfft(clip)) / len(clip)
+    floor, full_floor = magnitude[freqs > 1000], full[np.fft.rfftfreq(len(clip), 1 / 8000) > 1000]
+    assert floor.std() / floor.mean() < full_floor.std() / full_floor.mean() / 3
+    _, psd = scipy.signal.welch(clip, 8000, nperseg=1600)
+    assert np.argmax(psd) == np.argmax(magnitude)
+
+def test_short_clip_is_zero_padded(tmp_path):
+    path = str(tmp_path / "short.wav")
+    wavfile.write(path, 8000, fan_clip(50, duration=0.1))
+    _, freqs, magnitude = analyze_audio_streaming(path, nperseg=2048, use_cache=False)
+    assert len(freqs) == len(magnitude) == 1025 and np.isfinite(magnitude).all()
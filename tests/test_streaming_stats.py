@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+
+from streaming_stats import QuantileSketch, QuietestTakes, RunningSpectrum, VolumeStats
+
+def test_quietest_takes_match_sorting_and_merge():
+    rng = np.random.default_rng(0)
+    volumes = pd.DataFrame(rng.uniform(1, 10, (5, 12)).round(1), index=range(0, 101, 25),
+                           columns=[f"Recordings_{i:02d}" for i in range(12)])
+    volumes.iloc[1, 3] = np.nan
+
+    whole, first, second = QuietestTakes(3), QuietestTakes(3), QuietestTakes(3)
+    for speed, row in volumes.iterrows():
+        whole.add_row(speed, row)
+        first.add_row(speed, row.iloc[:6])
+        second.add_row(speed, row.iloc[6:])
+    first.merge(second)
+
+    for speed, row in volumes.iterrows():
+        expected = sorted((volume, session) for session, volume in row.dropna().items())[:3]
+        assert whole.quietest(speed) == expected
+        assert first.quietest(speed) == expected
+
+def test_running_spectrum_matches_numpy_and_merges():
+    spectra = np.random.default_rng(1).normal(5, 2, (20, 64))
+    whole, first, second = RunningSpectrum(), RunningSpectrum(), RunningSpectrum()
+    for spectrum in spectra:
+        whole.add(spectrum)
+    for spectrum in spectra[:7]:
+        first.add(spectrum)
+    for spectrum in spectra[7:]:
+        second.add(spectrum)
+    first.merge(second)
+
+    for running in (whole, first):
+        assert running.count == 20
+        assert np.allclose(running.mean, spectra.mean(axis=0))
+        assert np.allclose(running.variance(), spectra.var(axis=0, ddof=1))
+    assert np.isnan(RunningSpectrum().add(spectra[0]).variance()).all()
+
+def test_quantile_sketch_relative_accuracy():
+    values = np.random.default_rng(2).lognormal(3, 1, 10_000)
+    sketch, first, second = QuantileSketch(0.005), QuantileSketch(0.005), QuantileSketch(0.005)
+    for value in values:
+        sketch.add(value)
+    for value in values[:3000]:
+        first.add(value)
+    for value in values[3000:]:
+        second.add(value)
+    first.merge(second)
+
+    for q in (0.01, 0.25, 0.5, 0.75, 0.99):
+        exact = np.quantile(values, q, method="lower")
+        assert abs(sketch.quantile(q) / exact - 1) <= 0.005 + 1e-9
+        assert first.quantile(q) == sketch.quantile(q)
+    assert sketch.quantile(0) == values.min() and sketch.quantile(1) == values.max()
+
+def test_volume_stats_minimum_is_exact():
+    rng = np.random.default_rng(3)
+    table = pd.DataFrame({"Session": np.repeat(["a", "b", "c", "d"], 5),
+                          "Value": np.tile(range(0, 101, 25), 4),
+                          "Average Volume": rng.uniform(50, 100, 20)})
+    stats = VolumeStats().add_table(table).frame()
+    grouped = table.groupby("Value")["Average Volume"]
+    assert np.array_equal(stats["Minimum"], grouped.min())
+    # The sketch returns an order statistic, pandas interpolates between the middle two
+    assert np.allclose(stats["Q50"], grouped.quantile(0.5, interpolation="lower"), rtol=0.005)
+    assert list(stats["Count"]) == [4] * 5
@@ -0,0 +1,90 @@
+import os
+import json
+import asyncio
+import threading
+import time
+
+import pytest
+
+import sweep
+from conftest import SAMPLE_RATE, fan_clip
+from session_archive import SessionArchive, archive_path_for
+from sweep import MemoryFanController, run_sweep
+
+class FakeCapture:
+    """
+    Returns synthetic clips without waiting; fails on the speed given as fail_at.
+    """
+
+    def __init__(self, fail_at=None):
+        self.sample_rate = SAMPLE_RATE
+        self.fail_at = fail_at
+        self.controller = None
+
+    def settle(self, max_wait):
+        return 0.0
+
+    def capture(self, duration):
+        speed = self.controller.speed
+        if speed == self.fail_at:
+            raise RuntimeError("device lost")
+        return fan_clip(speed, duration)[:, None]
+
+def _log(folder):
+    with open(os.path.join(folder, "sweep_log.jsonl")) as f:
+        return [json.loads(line) for line in f]
+
+def _run(plan, capture, folder, **kwargs):
+    controller = MemoryFanController()
+    capture.controller = controller
+    return asyncio.run(run_sweep(plan, controller, capture, folder, settle_time=0, duration=0.1, **kwargs))
+
+def test_sweep_writes_log_and_results(tmp_path):
+    steps = _run([0, 12.5, 50], FakeCapture(), str(tmp_path))
+    assert len(steps) == 3
+    assert sorted(step["value"] for step in _log(str(tmp_path))) == [0, 12.5, 50]
+    assert os.path.exists(tmp_path / "audio_12.5.wav")
+    assert os.path.exists(tmp_path / "analysis_results.csv")
+
+def test_failed_step_keeps_earlier_steps(tmp_path):
+    folder = str(tmp_path)
+    with pytest.raises(RuntimeError):
+        _run([0, 10, 20, 30], FakeCapture(fail_at=20), folder, archive=True)
+
+    # The steps captured before the failure were written, logged and archived
+    assert sorted(step["value"] for step in _log(folder)) == [0, 10]
+    assert not os.path.exists(archive_path_for(folder) + ".partial")
+    with SessionArchive(archive_path_for(folder)) as archive:
+        assert archive.speeds == [0, 10]
+
+def test_pending_writes_are_capped(tmp_path, monkeypatch):
+    write_and_analyze = sweep._write_and_analyze
+    lock = threading.Lock()
+    active = [0, 0]
+
+    def slow_write(*args):
+        with lock:
+            active[0] += 1
+            active[1] = max(active[1], active[0])
+        time.sleep(0.05)
+        try:
+            return write_and_analyze(*args)
+        finally:
+            with lock:
+                active[0] -= 1
+
+    monkeypatch.setattr(sweep, "_write_and_analyze", slow_write)
+    _run(list(range(8)), FakeCapture(), str(tmp_path), analyze=False, max_pending=2)
+    assert active[1] <= 2
+    assert len(_log(str(tmp_path))) == 8
+
+def test_simple_recording_uses_the_sweep_options(tmp_path, monkeypatch):
+    import cli
+    import main
+
+    calls = []
+    monkeypatch.setattr(main, "recording_script", lambda **kwargs: calls.append(kwargs))
+    cli.main(["record", "--data-dir", str(tmp_path), "--sessions", "2", "--order", "alternating", "--start", "10",
+              "--stop", "20", "--step", "2.5", "--settle", "0.5", "--duration", "1"])
+    assert [call["values"] for call in calls] == [[10, 12.5, 15, 17.5, 20], [20, 17.5, 15, 12.5, 10]]
+    assert all(call["settle_time"] == 0.5 and call["duration"] == 1 for call in calls)
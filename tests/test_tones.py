@@ -0,0 +1,48 @@
+import numpy as np
+
+from tones import dtft, track_tones, zoom_dtft
+
+SAMPLE_RATE = 44100
+
+def tone_clip(freqs, duration=2.0, seed=0):
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(duration * SAMPLE_RATE)) / SAMPLE_RATE
+    clip = sum(1000 * np.sin(2 * np.pi * f * t) for f in freqs) + 100 * rng.normal(size=len(t))
+    return clip.astype(np.int16)
+
+def rfft_magnitudes(clip):
+    return np.abs(np.fft.rfft(clip.astype(float))) / len(clip)
+
+def test_dtft_matches_rfft_on_bins():
+    clip = tone_clip([123.4, 1000.0])
+    bins = np.array([0, 1, 246, 247, 2000, 17000])
+    freqs = bins * SAMPLE_RATE / len(clip)
+    expected = rfft_magnitudes(clip)[bins]
+    assert np.allclose(dtft(clip, freqs, SAMPLE_RATE), expected, rtol=1e-4, atol=1e-4)
+
+def test_zoom_dtft_matches_rfft_on_bins():
+    clip = tone_clip([123.4, 1000.0, 2500.7])
+    resolution = SAMPLE_RATE / len(clip)  # 0.5 Hz, the rfft bin spacing
+    centers = np.array([123.5, 1000.0, 2500.5])
+    offsets = np.arange(-4, 5) * resolution
+    bins = np.rint((centers[:, None] + offsets) / resolution).astype(int)
+    expected = rfft_magnitudes(clip)[bins]
+    assert np.allclose(zoom_dtft(clip, centers, offsets, SAMPLE_RATE), expected, rtol=1e-4, atol=1e-4)
+
+def test_zoom_dtft_matches_dtft_off_grid():
+    clip = tone_clip([456.13, 3000.0])
+    centers = np.array([456.0, 2999.7])
+    offsets = np.arange(-1.0, 1.01, 0.01)
+    expected = dtft(clip, (centers[:, None] + offsets).ravel(), SAMPLE_RATE).reshape(len(centers), -1)
+    assert np.allclose(zoom_dtft(clip, centers, offsets, SAMPLE_RATE), expected, rtol=1e-4, atol=1e-4)
+
+def test_track_tones_refines_off_bin_tones():
+    true_freqs = np.array([456.13, 2999.87])
+    clip = tone_clip(true_freqs)
+    tone_freqs, magnitudes = track_tones(clip, SAMPLE_RATE, true_freqs.round(), band_hz=0.5, resolution_hz=0.01)
+    assert np.all(np.abs(tone_freqs - true_freqs) <= 0.01)
+    # A full-amplitude sine reads as half its amplitude, like analyze_audio
+    assert np.allclose(magnitudes, 500, rtol=0.02)
+    # The nearest rfft bins are up to half a bin off and read lower
+    on_bins = rfft_magnitudes(clip)[np.rint(true_freqs * len(clip) / SAMPLE_RATE).astype(int)]
+    assert np.all(magnitudes >= on_bins)
@@ -0,0 +1,95 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from manifest import Manifest
+from volume_aggregation import aggregate_volumes, load_session_tables, to_long, to_wide, volume_stats
+
+def write_results(data_dir, folder, values, volumes):
+    os.makedirs(os.path.join(data_dir, folder), exist_ok=True)
+    pd.DataFrame({"Value": values, "Average Volume": volumes}).to_csv(
+        os.path.join(data_dir, folder, "analysis_results.csv"), index=False)
+
+def legacy_table(data_dir):
+    # The dict-of-dicts aggregation that the pivot replaced
+    aggregated, folders = {}, []
+    for folder in sorted(os.listdir(data_dir)):
+        path = os.path.join(data_dir, folder, "analysis_results.csv")
+        if os.path.exists(path):
+            folders.append(folder)
+            df = pd.read_csv(path)
+            if "Value" not in df.columns or "Average Volume" not in df.columns:
+                continue
+            for _, row in df.iterrows():
+                aggregated.setdefault(int(row["Value"]), {})[folder] = row["Average Volume"]
+    df = pd.DataFrame.from_dict(aggregated, orient="index", columns=folders).sort_index()
+    df.index.name = "Fan Speed"
+    return df
+
+def corpus(tmp_path):
+    data_dir = str(tmp_path / "data")
+    rng = np.random.default_rng(0)
+    write_results(data_dir, "Recordings_a", [0, 10, 100, 20], rng.random(4))
+    write_results(data_dir, "Recordings_b", [0, 20], rng.random(2))
+    write_results(data_dir, "Recordings_c", [10, 100, 30], rng.random(3))
+    os.makedirs(os.path.join(data_dir, "Recordings_empty"))
+    os.makedirs(os.path.join(data_dir, "Recordings_bad"))
+    pd.DataFrame({"Other": [1]}).to_csv(os.path.join(data_dir, "Recordings_bad", "analysis_results.csv"), index=False)
+    return data_dir
+
+def test_matches_legacy_aggregation(tmp_path):
+    data_dir = corpus(tmp_path)
+    output = str(tmp_path / "all_volumes.csv")
+    wide = aggregate_volumes(data_dir, output, max_workers=2)
+    expected = legacy_table(data_dir).drop(columns="Recordings_bad").astype(float)
+    written = pd.read_csv(output, index_col="Fan Speed")
+    pd.testing.assert_frame_equal(written.drop(columns="Recordings_bad"), expected)
+    assert written["Recordings_bad"].isna().all()
+    pd.testing.assert_frame_equal(wide.drop(columns="Recordings_bad"), expected, check_dtype=False)
+
+def test_long_wide_round_trip(tmp_path):
+    long_df = load_session_tables(corpus(tmp_path))
+    assert set(long_df["Session"]) == {"Recordings_a", "Recordings_b", "Recordings_c"}
+    assert long_df["Value"].dtype.kind == "i"
+    wide = to_wide(long_df)
+    back = to_long(wide).sort_values(["Session", "Value"]).reset_index(drop=True)
+    expected = long_df.sort_values(["Session", "Value"]).reset_index(drop=True)
+    pd.testing.assert_frame_equal(back, expected, check_dtype=False)
+    assert load_session_tables(str(tmp_path / "data" / "Recordings_empty")).empty
+
+def test_incremental_aggregation_rereads_changed_folders(tmp_path):
+    data_dir = corpus(tmp_path)
+    output = str(tmp_path / "all_volumes.csv")
+    manifest = Manifest(os.path.join(data_dir, "manifest.json"))
+    aggregate_volumes(data_dir, output, manifest=manifest)
+
+    write_results(data_dir, "Recordings_b", [0, 20, 40], [7.0, 8.0, 9.0])
+    write_results(data_dir, "Recordings_d", [0], [5.0])
+    incremental = aggregate_volumes(data_dir, output, manifest=manifest)
+    full = aggregate_volumes(data_dir, str(tmp_path / "full.csv"))
+    pd.testing.assert_frame_equal(incremental, full, check_dtype=False)
+    assert incremental.loc[40, "Recordings_b"] == 9.0
+
+def test_volume_stats_match_the_loaded_table(tmp_path):
+    data_dir = corpus(tmp_path)
+    long_df = load_session_tables(data_dir)
+    stats = volume_stats(data_dir, k=2)
+    summary = stats.frame(quantiles=())
+    grouped = long_df.groupby("Value")["Average Volume"]
+    assert np.allclose(summary["Minimum"], grouped.min())
+    assert list(summary["Count"]) == list(grouped.count())
+    expected = long_df.sort_values(["Average Volume", "Session"]).groupby("Value").head(2)
+    assert stats.quietest.quietest(0) == [(volume, session) for session, volume in
+                                          expected[expected["Value"] == 0][["Session", "Average Volume"]].values]
+
+def test_volume_curves_stream_the_sessions(tmp_path, monkeypatch):
+    import matplotlib
+    matplotlib.use("Agg")
+    import dataViz
+
+    data_dir = corpus(tmp_path)
+    monkeypatch.setattr(dataViz, "load_session_tables", None)  # Never combined into one table
+    dataViz.plot_volume_curves(data_dir, str(tmp_path / "curves.png"))
+    dataViz.plot_volume_curves(data_dir, str(tmp_path / "summary.png"), stats=volume_stats(data_dir))
+    assert os.path.exists(tmp_path / "curves.png") and os.path.exists(tmp_path / "summary.png")
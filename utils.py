@@ -1,11 +1,11 @@
-import matplotlib
 import numpy as np
-import matplotlib.pyplot as plt
 
 def cmap_map(function, cmap):
     """ Applies function (which should operate on vectors of shape 3: [r, g, b]), on colormap cmap.
     This routine will break any discontinuous points in a colormap.
     """
+    import matplotlib
+
     cdict = cmap._segmentdata
     step_dict = {}
     # Firt get the list of points where the segments start or end
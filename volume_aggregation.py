@@ -1,60 +1,171 @@
 import os
+from concurrent.futures import ThreadPoolExecutor
+
 import pandas as pd
 
-def aggregate_volumes(data_dir, output_csv):
+from manifest import Manifest
+from metrics import timed
+from spectra_store import SpectraStore, is_store
+from streaming_stats import VolumeStats
+
+def find_analysis_files(data_dir):
     """
-    Aggregates volume values from 'analysis_results.csv' across multiple folders.
+    Returns (folder, analysis_file) pairs for every folder in data_dir with an 'analysis_results.csv'.
+    """
+    pairs = []
+    for folder in sorted(os.listdir(data_dir)):
+        analysis_file = os.path.join(data_dir, folder, "analysis_results.csv")
+        if os.path.exists(analysis_file):
+            pairs.append((folder, analysis_file))
+    return pairs
+
+def _read_analysis_file(analysis_file):
+    df = pd.read_csv(analysis_file)
+    if 'Value' not in df.columns or 'Average Volume' not in df.columns:
+        print(f"Skipping {analysis_file}: Missing required columns.")
+        return None
+    return df[['Value', 'Average Volume']]
+
+def load_session_tables(data_dir, folders=None, max_workers=8):
+    """
+    Bulk-loads the 'analysis_results.csv' of every session into one long table.
+
+    Parameters:
+    - data_dir (str): Path to the root directory containing folders with 'analysis_results.csv'.
+    - folders (list): Only load these folders. Default is every folder with an analysis file.
+    - max_workers (int): Number of threads reading files concurrently. Default is 8.
+
+    Returns:
+    - DataFrame with columns "Session", "Value" and "Average Volume".
+    """
+    pairs = find_analysis_files(data_dir)
+    if folders is not None:
+        wanted = set(folders)
+        pairs = [(folder, path) for folder, path in pairs if folder in wanted]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        tables = list(executor.map(_read_analysis_file, [path for _, path in pairs]))
+
+    loaded = {folder: table for (folder, _), table in zip(pairs, tables) if table is not None}
+    if not loaded:
+        return pd.DataFrame({"Session": pd.Series(dtype=str), "Value": pd.Series(dtype=int),
+                             "Average Volume": pd.Series(dtype=float)})
+
+    long_df = pd.concat(loaded, names=["Session", None]).reset_index(level="Session").reset_index(drop=True)
+    if (long_df["Value"] % 1 == 0).all():
+        long_df["Value"] = long_df["Value"].astype(int)  # Sub-percent sweeps keep float speeds
+    return long_df
+
+def iter_session_tables(data_dir, folders=None):
+    """
+    Yields (folder, table) for every session's 'analysis_results.csv', reading one file at a
+    time so that only one session is held in memory. Arguments are as for load_session_tables.
+    """
+    wanted = set(folders) if folders is not None else None
+    for folder, analysis_file in find_analysis_files(data_dir):
+        if wanted is not None and folder not in wanted:
+            continue
+        table = _read_analysis_file(analysis_file)
+        if table is not None:
+            yield folder, table
+
+def volume_stats(data_dir, folders=None, k=3):
+    """
+    Summarizes the volumes of every session in a VolumeStats (see streaming_stats.py), one
+    session at a time.
 
     Parameters:
     - data_dir (str): Path to the root directory containing folders with 'analysis_results.csv'.
+    - folders (list): Only read these folders. Default is every folder with an analysis file.
+    - k (int): Number of quietest takes kept per fan speed. Default is 3.
+
+    Returns:
+    - VolumeStats of the volumes.
+    """
+    stats = VolumeStats(k=k)
+    for folder, table in iter_session_tables(data_dir, folders):
+        stats.add_table(table.assign(Session=folder))
+    return stats
+
+def to_wide(long_df, sessions=None):
+    """
+    Pivots the long session table into the layout of "all_volumes.csv":
+    one row per fan speed and one column per session.
+    """
+    wide = long_df.pivot_table(index="Value", columns="Session", values="Average Volume", aggfunc="last")
+    wide.index.name = "Fan Speed"
+    wide.columns.name = None
+    if sessions is not None:
+        wide = wide.reindex(columns=sessions)
+    return wide
+
+def to_long(wide_df):
+    """
+    Inverse of to_wide: turns an "all_volumes.csv" table back into the long session table.
+    """
+    # Missing recordings are NaN in the wide table and have no row in the long one
+    long_df = (wide_df.rename_axis(index="Value", columns="Session").stack().dropna()
+               .rename("Average Volume").reset_index())
+    return long_df[["Session", "Value", "Average Volume"]]
+
+@timed("aggregate_volumes")
+def aggregate_volumes(data_dir, output_csv, manifest=None, max_workers=8):
+    """
+    Aggregates volume values from 'analysis_results.csv' across multiple folders.
+
+    Parameters:
+    - data_dir (str): Path to the root directory containing folders with 'analysis_results.csv',
+      or a SpectraStore directory holding the volumes.
     - output_csv (str): Path to save the aggregated CSV file.
+    - manifest (Manifest): If given and output_csv already exists, columns of folders whose
+      'analysis_results.csv' is unchanged are reused instead of re-read.
+    - max_workers (int): Number of threads reading files concurrently. Default is 8.
+
+    Returns:
+    - The aggregated (wide) DataFrame.
     """
-    aggregated_data = {}  # Dictionary to store fan speeds and their volume values
-    folder_names = []      # Counter for trials (folders)
+    if is_store(data_dir):
+        df_aggregated = SpectraStore(data_dir).volumes_frame()
+        df_aggregated.to_csv(output_csv)
+        print(f"Aggregated data saved to {output_csv}")
+        return df_aggregated
 
-    # Iterate through each folder in the data directory
-    for folder in sorted(os.listdir(data_dir)):
-        folder_path = os.path.join(data_dir, folder)
-        analysis_file = os.path.join(folder_path, "analysis_results.csv")
-
-        # Check if 'analysis_results.csv' exists in the folder
-        if os.path.isdir(folder_path) and os.path.exists(analysis_file):
-            print(f"Found analysis file: {analysis_file}")
-            folder_names.append(folder)  # Add folder name as a column
-
-            # Read the CSV file
-            df = pd.read_csv(analysis_file)
-
-            # Ensure it contains the expected columns
-            if 'Value' in df.columns and 'Average Volume' in df.columns:
-                for _, row in df.iterrows():
-                    fan_speed = int(row['Value'])
-                    volume = row['Average Volume']
-
-                    # Initialize the fan speed entry if not present
-                    if fan_speed not in aggregated_data:
-                        aggregated_data[fan_speed] = {}
-
-                    # Append the volume to the corresponding fan speed
-                    aggregated_data[fan_speed][folder] = volume
-            else:
-                print(f"Skipping {analysis_file}: Missing required columns.")
-        else:
-            print(f"Skipping {folder}: 'analysis_results.csv' not found.")
-
-   
-    # Create a DataFrame from the aggregated data
-    df_aggregated = pd.DataFrame.from_dict(aggregated_data, orient='index')
-    df_aggregated.index.name = "Fan Speed"
-
-    # Ensure all columns (folder names) are present, even if some fan speeds are missing
-    df_aggregated = df_aggregated.reindex(columns=folder_names)
+    pairs = find_analysis_files(data_dir)
+    folder_names = [folder for folder, _ in pairs]
+    print(f"Found {len(pairs)} analysis files in {data_dir}")
+
+    # Reuse the previous output for folders whose analysis file is unchanged
+    frames = []
+    changed = folder_names
+    if manifest is not None and os.path.exists(output_csv):
+        previous = pd.read_csv(output_csv, index_col="Fan Speed")
+        current = [folder for folder, path in pairs
+                   if folder in previous.columns and manifest.is_current(path, "volumes")]
+        frames.append(to_long(previous[current]))
+        current = set(current)
+        changed = [folder for folder in folder_names if folder not in current]
+        print(f"Reusing {len(current)} unchanged folders, reading {len(changed)}")
+
+    frames.append(load_session_tables(data_dir, folders=changed, max_workers=max_workers))
+    long_df = pd.concat(frames, ignore_index=True)
+
+    # Build the wide table in one pivot, keeping a column for every folder
+    df_aggregated = to_wide(long_df, sessions=folder_names)
 
     # Save the aggregated data to a CSV file
     df_aggregated.to_csv(output_csv)
     print(f"Aggregated data saved to {output_csv}")
 
+    if manifest is not None:
+        changed = set(changed)
+        for folder, path in pairs:
+            if folder in changed:
+                manifest.record(path, "volumes")
+        manifest.save()
+    return df_aggregated
+
 
-data_dir = "data3"  # Replace with your data directory
-output_csv = data_dir + "//all_volumes.csv"  # Desired output file name
-aggregate_volumes(data_dir, output_csv)
+if __name__ == "__main__":
+    data_dir = "data3"  # Replace with your data directory
+    output_csv = data_dir + "//all_volumes.csv"  # Desired output file name
+    aggregate_volumes(data_dir, output_csv, manifest=Manifest(data_dir + "//manifest.json"))
@@ -1,7 +1,21 @@
-import wmi
-w = wmi.WMI(namespace="root\OpenHardwareMonitor")
-temperature_infos = w.Sensor()
-for sensor in temperature_infos:
-    if sensor.SensorType==u'Temperature':
-        print(sensor.Name)
-        print(sensor.Value)
\ No newline at end of file
+def read_temperatures():
+    """
+    Reads every temperature sensor of OpenHardwareMonitor (which must be running) through WMI.
+
+    Returns:
+    - dict mapping sensor name to temperature in degrees Celsius.
+    """
+    import wmi
+
+    w = wmi.WMI(namespace="root\OpenHardwareMonitor")
+    temperature_infos = w.Sensor()
+    return {sensor.Name: sensor.Value for sensor in temperature_infos if sensor.SensorType==u'Temperature'}
+
+def print_temperatures():
+    for name, value in read_temperatures().items():
+        print(name)
+        print(value)
+
+
+if __name__ == "__main__":
+    print_temperatures()